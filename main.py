@@ -4,6 +4,7 @@
 import os
 import click
 from src import options
+from src import local_plan
 from src import local_setup
 from src import remote_setup
 
@@ -18,7 +19,31 @@ def cli(ctx: click.Context, **_):
 
 @cli.command('setup')
 @options.setup_options
-def setup(path: str, no_roots: bool=False, verbose: bool=False, remote: str=None, rerun: bool=False):
+def setup(path: str, no_roots: bool=False, verbose: bool=False, remote: str=None, rerun: bool=False,
+          no_cache: bool=False, jobs: int=4, trace_file: str=None, metrics_file: str=None, verify: bool=False,
+          lock_timeout: float=600.0):
+    setup_filename = _find_setup_file(path)
+
+    if remote is None:
+        local_setup.perform(setup_filename, no_roots, verbose, rerun, no_cache, jobs, trace_file,
+                            metrics_file, verify, lock_timeout)
+    else:
+        remote_setup.perform(setup_filename, remote)
+
+
+@cli.command('plan')
+@options.plan_options
+def plan(path: str, rerun: bool=False, no_cache: bool=False, as_json: bool=False, exit_code: bool=False,
+         verify: bool=False):
+    """
+    Show the actions a setup would perform without performing them.
+    Does not require root privileges.
+    """
+    setup_filename = _find_setup_file(path)
+    local_plan.perform(setup_filename, rerun, no_cache, as_json, exit_code, verify)
+
+
+def _find_setup_file(path: str) -> str:
     if os.path.isdir(path):
         setup_filename = os.path.join(path, 'setup.yaml')
     else:
@@ -30,11 +55,7 @@ def setup(path: str, no_roots: bool=False, verbose: bool=False, remote: str=None
         raise click.ClickException('The file {} has an unsupported extension. '
                                    'Supported extensions are *.yaml and *.yml.'
                                    .format(setup_filename))
-
-    if remote is None:
-        local_setup.perform(setup_filename, no_roots, verbose, rerun)
-    else:
-        remote_setup.perform(setup_filename, remote)
+    return setup_filename
 
 
 if __name__ == '__main__':
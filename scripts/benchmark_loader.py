@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import gc
+import time
+import tracemalloc
+
+import click
+
+
+SOURCE_ROOT = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+sys.path.insert(0, SOURCE_ROOT)
+
+from src import config  # noqa: E402
+
+
+_CATEGORY_TEMPLATE = '''  category-{n}:
+    $apt-packages: [foo-{n}, bar-{n}]
+    $copy:
+      source-{n}: ~/target-{n}
+    $folders: [~/folder-{n}]
+    $flatpak-packages:
+      - package: org.example.App{n}
+        remote: flathub
+        type: app
+    $flatpak-repositories:
+      - name: repo-{n}
+        location: https://example.com/{n}.flatpakrepo
+    $github-releases:
+      - repo: user/repo-{n}
+        release: v1.0.{n}
+        asset: asset-[0-9.]+.zip
+        target: ~/asset-{n}.zip
+    $ppas: [user/ppa-{n}]
+    $scriptlet: |
+      echo "Hello {n}"
+    $scripts: [script-{n}.sh]
+    $snap-packages:
+      - snap-{n}
+      - package: classic-snap-{n}
+        classic: true
+'''
+
+
+def _generate_config(actions: int) -> str:
+    categories = (actions + 9) // 10
+    return 'setup:\n' + ''.join(_CATEGORY_TEMPLATE.format(n=n) for n in range(categories))
+
+
+def _load(content: str, round_trip: bool) -> config.Setup:
+    setup = config.Setup(round_trip=round_trip)
+    setup.load_plugins()
+    setup.load_config_str(content)
+    return setup
+
+
+def _measure(content: str, round_trip: bool):
+    # Time and memory are measured in separate passes
+    # since tracing allocations slows down loading considerably
+    gc.collect()
+    start = time.perf_counter()
+    _load(content, round_trip)
+    duration = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    setup = _load(content, round_trip)
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del setup
+    return duration, retained, peak
+
+
+@click.command()
+@click.option('--actions', default=50000, help='Number of actions in the generated configuration.')
+def main(actions: int):
+    """
+    Compare time and memory needed to load a large generated configuration
+    using the safe loader (default) and the ruamel.yaml round-trip loader.
+    """
+    content = _generate_config(actions)
+    print('Configuration with {} actions ({:.1f} MiB)'.format(actions, len(content) / 2 ** 20))
+    for label, round_trip in (('safe', False), ('round-trip', True)):
+        duration, retained, peak = _measure(content, round_trip)
+        print('{:>10}: {:6.2f} s, {:7.1f} MiB retained, {:7.1f} MiB peak'
+              .format(label, duration, retained / 2 ** 20, peak / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
@@ -37,8 +37,12 @@ def _build_release(release_version: str, ubuntu_release: str):
                                'apt-get', '-y', 'install', 'python3', 'python3-pip'])
         # Install ubup dependencies as well as pyinstaller
         subprocess.check_call(['lxc', 'exec', container_name, '--',
-                               'pip3', 'install', 'click', 'ruamel.yaml', 'schema', 'progressbar2', 'pyinstaller',
+                               'pip3', 'install', 'click', 'ruamel.yaml', 'schema', 'pyinstaller',
                                'requests', 'simpleflock'])
+        # Record the release version
+        subprocess.check_call(['lxc', 'exec', container_name, '--', 'bash', '-c',
+                               'cd /root/ubup && sed -i "s/^VERSION = .*/VERSION = \'{}\'/" src/version.py'
+                               .format(release_version)])
         # Make a release build
         subprocess.check_call(['lxc', 'exec', container_name, '--', 'bash', '-c',
                                'cd /root/ubup && pyinstaller -F -n ubup main.py'])
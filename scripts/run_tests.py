@@ -58,7 +58,7 @@ def _run_with_docker(verbose: bool=False, file_or_dir: str=None):
                                    'apt-get', '-y', 'install', 'python3', 'python3-pip'])
             # Install ubup dependencies
             subprocess.check_call(['docker', 'exec', '-i', container_name,
-                                   'pip3', 'install', 'click', 'ruamel.yaml', 'schema', 'progressbar2', 'requests'])
+                                   'pip3', 'install', 'click', 'ruamel.yaml', 'schema', 'requests'])
             # Install test requirements
             subprocess.check_call(['docker', 'exec', '-i', container_name, 'pip3', 'install', 'pytest'])
             # Run the test suite in the container
@@ -108,7 +108,7 @@ def _run_with_lxd(verbose: bool=False, file_or_dir: str=None):
                                    'apt-get', '-y', 'install', 'python3', 'python3-pip'])
             # Install ubup dependencies
             subprocess.check_call(['lxc', 'exec', container_name, '--',
-                                   'pip3', 'install', 'click', 'ruamel.yaml', 'schema', 'progressbar2', 'requests'])
+                                   'pip3', 'install', 'click', 'ruamel.yaml', 'schema', 'requests'])
             # Install test requirements
             subprocess.check_call(['lxc', 'exec', container_name, '--', 'pip3', 'install', 'pytest'])
             # Run the test suite in the container
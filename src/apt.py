@@ -0,0 +1,512 @@
+# -*- coding: utf-8 -*-
+
+from typing import Dict, Iterable, List, Optional, Set
+
+import os
+import re
+import glob
+import base64
+import binascii
+import mmap
+import time
+import fcntl
+import select
+import shutil
+import tempfile
+import threading
+
+from . import log
+from . import plugins
+
+DPKG_STATUS_PATH = '/var/lib/dpkg/status'
+APT_CONFIG_DIR = '/etc/apt'
+APT_METHODS_DIR = '/usr/lib/apt/methods'
+# Locks taken by apt and dpkg, in the order they take them
+LOCK_PATHS = ('/var/lib/dpkg/lock-frontend', '/var/lib/dpkg/lock', '/var/lib/apt/lists/lock',
+              '/var/cache/apt/archives/lock')
+PROC_LOCKS_PATH = '/proc/locks'
+
+# Time in seconds to wait for other package managers to release their locks
+lock_timeout = 600.0
+
+# e.g. "Need to get 1,024 kB/52.3 MB of archives." (the first size is only printed if some archives are cached)
+_NEED_TO_GET_PATTERN = re.compile(r'^Need to get (?:[0-9.,]+ [kMG]?B/)?([0-9.,]+) ([kMG]?B) of archives')
+_SIZE_UNITS = {'B': 1, 'kB': 1e3, 'MB': 1e6, 'GB': 1e9}
+
+# Time in seconds after which the locks are checked again while waiting for their holder to exit,
+# in case it releases them without exiting
+_LOCK_RECHECK_INTERVAL = 5.0
+
+# Package arguments apt-get interprets as patterns or actions instead of names.
+# Whether these are satisfied is left to apt.
+_NON_NAME_PATTERN = re.compile(r'[*?\[\]^$]|[+-]$')
+
+_lock = threading.Lock()
+# Parsed status databases by path together with the file identity they were parsed from
+_indices = {}
+
+# Matches the user and name of PPAs in source URIs
+_PPA_URI_PATTERN = re.compile(r'https?://ppa\.launchpad(?:content)?\.net/([a-z0-9.+-]+)/([a-z0-9.+-]+)')
+# Parsed source files by path together with the file identity they were parsed from
+_sources = {}
+
+_index_lock = threading.Lock()
+# Plugin which changed the sources since the package index was last updated or None
+_index_invalidated_by = None
+
+
+def _file_identity(path: str):
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def _parse_status(data) -> Dict[str, str]:
+    """
+    Parse a dpkg status database
+    :param data: Contents of the database (e.g. a memory map)
+    :return: Versions of all installed packages by name and by name with architecture
+    """
+    installed = {}
+    end = len(data)
+    position = 0
+    while position < end:
+        # Paragraphs are separated by empty lines
+        paragraph_end = data.find(b'\n\n', position)
+        if paragraph_end == -1:
+            paragraph_end = end
+        package = architecture = version = None
+        is_installed = False
+        for line in data[position:paragraph_end].split(b'\n'):
+            if line.startswith(b'Package:'):
+                package = line[8:].strip().decode()
+            elif line.startswith(b'Status:'):
+                # e.g. "install ok installed" or "hold ok installed"
+                fields = line[7:].split()
+                is_installed = len(fields) == 3 and fields[2] == b'installed'
+            elif line.startswith(b'Architecture:'):
+                architecture = line[13:].strip().decode()
+            elif line.startswith(b'Version:'):
+                version = line[8:].strip().decode()
+        if package is not None and is_installed:
+            installed[package] = version
+            if architecture is not None:
+                installed['{}:{}'.format(package, architecture)] = version
+        position = paragraph_end + 2
+    return installed
+
+
+def installed_packages(path: Optional[str] = None) -> Dict[str, str]:
+    """
+    Index the installed packages according to a dpkg status database.
+    The database is only parsed again once it changed.
+    :param path: Path of the database, defaults to the one of the system
+    :return: Versions of all installed packages by name and by name with architecture
+             (e.g. "libc6" and "libc6:amd64")
+    """
+    path = path or DPKG_STATUS_PATH
+    with _lock:
+        identity = _file_identity(path)
+        cached = _indices.get(path)
+        if cached is not None and cached[0] == identity:
+            return cached[1]
+        with open(path, 'rb') as file:
+            if identity[1] == 0:
+                index = {}
+            else:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    index = _parse_status(data)
+        _indices[path] = (identity, index)
+        return index
+
+
+def missing_packages(packages: Iterable[str], path: Optional[str] = None) -> List[str]:
+    """
+    Determine which of a set of apt-get install arguments are not installed yet
+    :param packages: Package names, optionally with architecture (foo:i386), version (foo=1.0)
+                     or release (foo/bionic)
+    :param path: Path of the dpkg status database, defaults to the one of the system
+    :return: Arguments of the packages which are not installed or can't be checked
+    """
+    installed = installed_packages(path)
+    missing = []
+    for package in packages:
+        name, _, version = package.partition('=')
+        if name not in installed and (_NON_NAME_PATTERN.search(package) or '/' in package):
+            # Patterns and target releases can't be checked. Like apt-get, look up the exact
+            # name first, as names may end with "+" or "-" too (e.g. g++).
+            missing.append(package)
+            continue
+        if name not in installed or (version and installed[name] != version):
+            missing.append(package)
+    return missing
+
+
+def _parse_sources(path: str) -> Set[str]:
+    # PPAs of the enabled sources of a one-line style (.list) or deb822 style (.sources) file
+    with open(path, encoding='utf-8', errors='replace') as file:
+        text = file.read()
+    uris = []
+    if path.endswith('.sources'):
+        for paragraph in re.split(r'\n\s*\n', text):
+            fields = {}
+            for line in paragraph.splitlines():
+                key, _, value = line.partition(':')
+                if not line.startswith(('#', ' ', '\t')) and value:
+                    fields[key.strip().lower()] = value.strip()
+            if 'deb' in fields.get('types', '').split() and fields.get('enabled', 'yes') != 'no':
+                uris += fields.get('uris', '').split()
+    else:
+        for line in text.splitlines():
+            # e.g. "deb [arch=amd64 signed-by=...] http://ppa.launchpad.net/user/ppa/ubuntu bionic main"
+            fields = re.sub(r'\[[^\]]*\]', '', line.split('#', 1)[0]).split()
+            if len(fields) >= 2 and fields[0] == 'deb':
+                uris.append(fields[1])
+    ppas = set()
+    for uri in uris:
+        match = _PPA_URI_PATTERN.match(uri)
+        if match is not None:
+            ppas.add('{}/{}'.format(*match.groups()))
+    return ppas
+
+
+def existing_ppas(config_dir: Optional[str] = None) -> Set[str]:
+    """
+    Determine the PPAs which are enabled in the apt sources.
+    Source files are only parsed again once they changed.
+    :param config_dir: apt configuration directory, defaults to the one of the system
+    :return: PPAs in the format user/ppa
+    """
+    config_dir = config_dir or APT_CONFIG_DIR
+    paths = glob.glob(os.path.join(config_dir, '**', '*.list'), recursive=True) + \
+        glob.glob(os.path.join(config_dir, '**', '*.sources'), recursive=True)
+    ppas = set()
+    with _lock:
+        for path in paths:
+            try:
+                identity = _file_identity(path)
+                cached = _sources.get(path)
+                if cached is None or cached[0] != identity:
+                    cached = _sources[path] = (identity, _parse_sources(path))
+            except FileNotFoundError:
+                continue
+            ppas.update(cached[1])
+    return ppas
+
+
+def distribution_codename(os_release_path: str = '/etc/os-release') -> str:
+    """
+    :return: Codename of the Ubuntu release the system is based on (e.g. "bionic")
+    """
+    fields = {}
+    with open(os_release_path) as file:
+        for line in file:
+            key, _, value = line.strip().partition('=')
+            fields[key] = value.strip('"\'')
+    codename = fields.get('UBUNTU_CODENAME') or fields.get('VERSION_CODENAME')
+    if not codename:
+        raise Exception('Could not determine the Ubuntu release from {}'.format(os_release_path))
+    return codename
+
+
+def supports_https(methods_dir: Optional[str] = None) -> bool:
+    """
+    :param methods_dir: Directory of the apt transport methods, defaults to the one of the system
+    :return: Whether apt can fetch sources via https (built in since apt 1.5, apt-transport-https before)
+    """
+    return os.path.exists(os.path.join(methods_dir or APT_METHODS_DIR, 'https'))
+
+
+def dearmor(key: str) -> bytes:
+    """
+    Convert an ASCII armored OpenPGP key to a binary keyring like gpg --dearmor does,
+    as apt < 1.4 can't read ASCII armored keyrings
+    :param key: ASCII armored key
+    :return: Binary key
+    """
+    lines = [line.strip() for line in key.strip().splitlines()]
+    try:
+        start = next(i for i, line in enumerate(lines) if line.startswith('-----BEGIN PGP '))
+        end = next(i for i, line in enumerate(lines) if line.startswith('-----END PGP '))
+    except StopIteration:
+        raise Exception('Invalid OpenPGP key: armor lines not found')
+    body = lines[start + 1:end]
+    # Armor headers (e.g. "Version: ...") are separated from the data by an empty line
+    if '' in body:
+        body = body[body.index('') + 1:]
+    # The last line starting with "=" is the checksum
+    data = ''.join(line for line in body if not line.startswith('='))
+    try:
+        return base64.b64decode(data, validate=True)
+    except binascii.Error as e:
+        raise Exception('Invalid OpenPGP key: {}'.format(e))
+
+
+def ppa_sources(ppa: str, codename: str, keyring_path: str, https: bool = True) -> str:
+    """
+    :param ppa: PPA in the format user/ppa
+    :param codename: Codename of the Ubuntu release
+    :param keyring_path: Path of the file containing the signing key of the PPA
+    :param https: Whether apt supports https, otherwise the PPA is fetched via http
+    :return: deb822 style source entry of a PPA
+    """
+    if https:
+        uri = 'https://ppa.launchpadcontent.net/{}/ubuntu/'.format(ppa)
+    else:
+        # Packages are still verified with the signing key of the PPA
+        uri = 'http://ppa.launchpad.net/{}/ubuntu/'.format(ppa)
+    return ('Types: deb\n'
+            'URIs: {}\n'
+            'Suites: {}\n'
+            'Components: main\n'
+            'Signed-By: {}\n').format(uri, codename, keyring_path)
+
+
+def lock_holders(paths: Optional[Iterable[str]] = None) -> List[int]:
+    """
+    Find the processes holding apt or dpkg locks. Doesn't require root privileges.
+    :param paths: Paths of the lock files, defaults to the ones of apt and dpkg
+    :return: Process IDs of the holders
+    """
+    inodes = set()
+    for path in paths or LOCK_PATHS:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        inodes.add((os.major(stat.st_dev), os.minor(stat.st_dev), stat.st_ino))
+    holders = []
+    if len(inodes) == 0:
+        return holders
+    # e.g. "3: POSIX  ADVISORY  WRITE 1234 08:01:131090 0 EOF",
+    # waiting processes are listed as "3: -> POSIX ..."
+    with open(PROC_LOCKS_PATH) as file:
+        for line in file:
+            fields = line.split()
+            if len(fields) < 6 or fields[1] == '->':
+                continue
+            major, minor, inode = fields[5].split(':')
+            pid = int(fields[4])
+            if (int(major, 16), int(minor, 16), int(inode)) in inodes and pid not in holders:
+                holders.append(pid)
+    return holders
+
+
+def _process_name(pid: int) -> str:
+    try:
+        with open('/proc/{}/comm'.format(pid)) as file:
+            return file.read().strip()
+    except OSError:
+        return 'unknown process'
+
+
+def _wait_for_exit(pid: int, timeout: float) -> bool:
+    # Block until a process exits or the timeout expires.
+    # Returns False if waiting for processes isn't supported.
+    try:
+        fd = os.pidfd_open(pid)
+    except ProcessLookupError:
+        return True
+    except (AttributeError, OSError):
+        # pidfd_open() requires Python 3.9 and Linux 5.3
+        return False
+    try:
+        poll = select.poll()
+        poll.register(fd, select.POLLIN)
+        poll.poll(timeout * 1000)
+    finally:
+        os.close(fd)
+    return True
+
+
+def _wait_for_unlock(paths: Iterable[str], timeout: float) -> bool:
+    # Block until the lock files are released or the timeout expires.
+    # Returns False if the lock files can't be opened (they are only readable by root).
+    files = []
+    try:
+        for path in paths:
+            try:
+                files.append(open(path, 'rb'))
+            except FileNotFoundError:
+                pass
+    except OSError:
+        for file in files:
+            file.close()
+        return False
+
+    def wait():
+        # A shared lock is granted as soon as no other process holds the lock, it's released right away
+        for file in files:
+            with file:
+                try:
+                    fcntl.lockf(file, fcntl.LOCK_SH)
+                    fcntl.lockf(file, fcntl.LOCK_UN)
+                except OSError:
+                    pass
+
+    # The blocking fcntl call has no timeout, so it's made on a thread which is abandoned when the time is up
+    thread = threading.Thread(target=wait, name='apt-lock-waiter', daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return True
+
+
+def wait_for_lock(timeout: Optional[float] = None):
+    """
+    Wait until no other process holds an apt or dpkg lock (e.g. unattended-upgrades)
+    :param timeout: Maximum time to wait in seconds, defaults to lock_timeout
+    """
+    deadline = time.monotonic() + (lock_timeout if timeout is None else timeout)
+    reported = None
+    while True:
+        holders = [pid for pid in lock_holders() if pid != os.getpid()]
+        if len(holders) == 0:
+            return
+        pid = holders[0]
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise Exception('{} (pid {}) did not release the package manager lock in time'
+                            .format(_process_name(pid), pid))
+        if pid != reported:
+            log.information('Waiting for {} (pid {}) to release the package manager lock'
+                            .format(_process_name(pid), pid))
+            reported = pid
+        if _wait_for_exit(pid, min(remaining, _LOCK_RECHECK_INTERVAL)):
+            continue
+        # Without pidfds, wait for the locks themselves, which also notices locks released without exiting
+        if not _wait_for_unlock(LOCK_PATHS, remaining):
+            time.sleep(min(remaining, 1.0))
+
+
+class StatusParser:
+    """
+    Turns the status records apt writes to APT::Status-Fd (e.g. "pmstatus:vim:42.5:Unpacking vim")
+    into progress notifications. Also picks up the download size from the regular output of apt-get.
+    """
+    _PHASES = {'dlstatus': 'Downloading', 'pmstatus': 'Installing'}
+
+    def __init__(self, observer: plugins.CommandObserver):
+        self._observer = observer
+        self._download_size = None
+        self._phase = None
+        self._phase_started = None
+        self._lock = threading.Lock()
+
+    def feed(self, line: str):
+        """
+        Process a status record or a line of regular output
+        """
+        with self._lock:
+            match = _NEED_TO_GET_PATTERN.match(line)
+            if match is not None:
+                self._download_size = float(match.group(1).replace(',', '')) * _SIZE_UNITS[match.group(2)]
+                return
+            kind, _, record = line.partition(':')
+            phase = self._PHASES.get(kind)
+            fields = record.split(':', 2)
+            if phase is None or len(fields) < 2:
+                return
+            try:
+                fraction = min(float(fields[1]) / 100, 1.0)
+            except ValueError:
+                return
+            now = time.monotonic()
+            if phase != self._phase:
+                self._phase = phase
+                self._phase_started = now
+            elapsed = now - self._phase_started
+            rate = eta = None
+            if fraction > 0 and elapsed > 0:
+                eta = elapsed * (1 - fraction) / fraction
+                if phase == 'Downloading' and self._download_size is not None:
+                    rate = self._download_size * fraction / elapsed
+        self._observer.progress(phase, fraction, rate, eta)
+
+
+class _StatusPipe:
+    # Named pipe apt writes its status records to, read on a background thread
+    def __init__(self, handler):
+        self._handler = handler
+        self._dir = tempfile.mkdtemp(prefix='ubup-apt-')
+        self.path = os.path.join(self._dir, 'status')
+        os.mkfifo(self.path, 0o600)
+        # Holding both ends, opening the pipe for writing never blocks and reading never hits the end
+        self._fd = os.open(self.path, os.O_RDWR)
+        self._thread = threading.Thread(target=self._read, daemon=True)
+
+    def __enter__(self) -> str:
+        self._thread.start()
+        return self.path
+
+    def __exit__(self, *args):
+        # Records never contain null bytes, use one to stop reading
+        os.write(self._fd, b'\0')
+        self._thread.join()
+        os.close(self._fd)
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def _read(self):
+        buffer = b''
+        while True:
+            chunk = os.read(self._fd, 64 * 1024)
+            chunk, end, _ = chunk.partition(b'\0')
+            *lines, buffer = (buffer + chunk).split(b'\n')
+            for line in lines:
+                self._handler(line.decode(errors='replace'))
+            if end:
+                return
+
+
+def _apt_get(plugin: plugins.AbstractPlugin, *args: str):
+    wait_for_lock()
+    # Let apt wait as well in case another process takes the lock right after we checked
+    command = ['apt-get', '-o', 'DPkg::Lock::Timeout={}'.format(int(lock_timeout)), *args]
+    if plugin.observer is None:
+        plugin.run_command_sudo(*command, capture=False)
+        return
+    parser = StatusParser(plugin.observer)
+    with _StatusPipe(parser.feed) as status_path:
+        # sudo closes all other file descriptors, so a shell opens the status pipe for apt-get
+        plugin.run_command_sudo('sh', '-c', 'exec "$@" 3>"$0"', status_path, *command, '-o', 'APT::Status-Fd=3',
+                                capture=False, output_handler=parser.feed)
+
+
+def invalidate_index(plugin: plugins.AbstractPlugin):
+    """
+    Note that the apt sources changed, so the package index is updated before the next installation
+    :param plugin: Plugin which changed the sources, used to update the index if nothing else does
+    """
+    global _index_invalidated_by
+    with _index_lock:
+        _index_invalidated_by = plugin
+
+
+def index_outdated() -> bool:
+    """
+    :return: Whether the apt sources changed since the package index was last updated
+    """
+    with _index_lock:
+        return _index_invalidated_by is not None
+
+
+def update_index(plugin: Optional[plugins.AbstractPlugin] = None):
+    """
+    Update the package index if the sources changed since it was last updated
+    :param plugin: Plugin to run apt-get with, defaults to the one which changed the sources
+    """
+    global _index_invalidated_by
+    # Concurrent installations wait for a single update
+    with _index_lock:
+        if _index_invalidated_by is None:
+            return
+        _apt_get(plugin or _index_invalidated_by, '-q', 'update')
+        _index_invalidated_by = None
+
+
+def install(plugin: plugins.AbstractPlugin, packages: List[str]):
+    """
+    Install packages, updating the package index first if necessary
+    :param plugin: Plugin to run apt-get with
+    :param packages: apt-get install arguments
+    """
+    update_index(plugin)
+    _apt_get(plugin, '-y', '-q', 'install', *packages)
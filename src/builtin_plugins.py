@@ -1,23 +1,34 @@
 # -*- coding: utf-8 -*-
 
-from typing import Set
+from typing import Dict, List, Optional, Set, Tuple
 
 import abc
 import os
+import asyncio
+import collections
 import re
 import glob
 import tempfile
+import subprocess
 import schema
 import shutil
 import urllib.parse
-import urllib.request
 import requests
 import json
 
+from . import apt
+from . import download_cache
 from . import plugins
+from . import probes
+from . import snapd
 
 
 class _AbstractFlatpakPlugin(plugins.AbstractPlugin):
+    @staticmethod
+    def _check_is_flatpak_available() -> bool:
+        # Read-only variant of _check_is_flatpak_installed
+        return shutil.which('flatpak') is not None
+
     def _check_is_flatpak_installed(self) -> bool:
         try:
             self.run_command('flatpak', '--version')
@@ -30,9 +41,12 @@ class _AbstractFlatpakPlugin(plugins.AbstractPlugin):
         # method for installing Flatpak on Ubuntu (as of 2017-12-30).
         # Source: https://flatpak.org/getting
         ppa_plg = PPAsPlugin(config=['alexlarsson/flatpak'],
-                             verbose=self._verbose)
+                             verbose=self._verbose,
+                             log_path=self.log_path,
+                             observer=self.observer)
         ppa_plg.perform()
-        self.run_command_sudo('apt', 'install', '-y', 'flatpak')
+        apt.install(self, ['flatpak'])
+        probes.flatpak_inventory.invalidate()
 
     @abc.abstractmethod
     def perform(self):
@@ -42,15 +56,36 @@ class _AbstractFlatpakPlugin(plugins.AbstractPlugin):
 class AptPackagesPlugin(plugins.AbstractPlugin):
     key = 'apt-packages'
     schema = [str]
+    step_duration = 5.0
+    # Installing all packages in a single transaction saves apt's dependency
+    # resolution and dpkg trigger processing for every merged action
+    coalescible = True
+
+    @classmethod
+    def coalesce(cls, configs: List[List[str]]) -> List[str]:
+        packages = []
+        seen = set()
+        for config in configs:
+            for package in config:
+                if package not in seen:
+                    seen.add(package)
+                    packages.append(package)
+        return packages
 
     def perform(self):
-        packages = self.config
-        self.run_command_sudo('apt-get', '-y', '-q', 'install', *packages)
+        # Starting apt and acquiring its lock takes seconds, only run it if necessary
+        packages = apt.missing_packages(self.config)
+        if len(packages) > 0:
+            apt.install(self, packages)
+
+    def pending(self) -> Optional[List[str]]:
+        return ['install {}'.format(package) for package in apt.missing_packages(self.config)]
 
 
 class CopyPlugin(plugins.AbstractPlugin):
     key = 'copy'
     schema = {str: str}
+    step_duration = 0.5
 
     def perform(self):
         for src, dst in self.config.items():
@@ -78,6 +113,12 @@ class CopyPlugin(plugins.AbstractPlugin):
 class CreateFoldersPlugin(plugins.AbstractPlugin):
     key = 'folders'
     schema = [str]
+    step_duration = 0.1
+    barrier = False
+
+    def pending(self) -> Optional[List[str]]:
+        return ['create {}'.format(folder) for folder in self.config
+                if not os.path.exists(self._expand_path(folder))]
 
     def perform(self):
         folders = self.config
@@ -101,37 +142,92 @@ class FlatpakPackagesPlugin(_AbstractFlatpakPlugin):
             schema.Optional('remote'): str
         }
     ]
+    step_duration = 30.0
+
+    def _download_package(self, url: str) -> str:
+        # Flatpak only reads the package, so the cached file is used in place
+        return download_cache.DownloadCache().fetch(url, self.observer)
 
     @staticmethod
-    def _download_package(url: str, suffix: str='.flatpakref') -> str:
-        file = tempfile.NamedTemporaryFile('wb', prefix='download_',
-                                           suffix=suffix, delete=False)
-        with urllib.request.urlopen(url) as response, open(file.name, 'wb') as out_file:
-            shutil.copyfileobj(response, out_file)
+    def _parse_flatpakref(filepath: str) -> Tuple[str, Optional[str]]:
+        """
+        :return: Id and branch (if given) of the application of a .flatpakref file
+        """
+        fields = {}
+        with open(filepath) as file:
+            for line in file:
+                key, _, value = line.partition('=')
+                fields.setdefault(key.strip(), value.strip())
+        if 'Name' not in fields:
+            raise Exception('Error parsing flatpakref file: {}'.format(filepath))
+        return fields['Name'], fields.get('Branch') or None
 
-        return file.name
+    @staticmethod
+    def _parse_ref(ref: str) -> Tuple[str, Optional[str], Optional[str]]:
+        """
+        :param ref: Id or (partial) ref, e.g. org.gimp.GIMP, org.gimp.GIMP//stable or app/org.gimp.GIMP/x86_64/stable
+        :return: Id, architecture and branch (None if not given)
+        """
+        parts = ref.split('/')
+        if parts[0] in ('app', 'runtime') and len(parts) > 1:
+            parts = parts[1:]
+        parts += [''] * (3 - len(parts))
+        return parts[0], parts[1] or None, parts[2] or None
+
+    def _is_installed(self, inventory: probes.FlatpakInventory, package: str, type_: str, target: str) -> bool:
+        """
+        Check whether the ref of an entry is installed
+        :param package: Package of the entry, local path in case of .flatpakref files
+        :return: False if unknown (e.g. for bundles)
+        """
+        if type_ in ('app', 'runtime'):
+            return inventory.is_installed(target, *self._parse_ref(package))
+        if type_ == 'ref' and os.path.isfile(package):
+            id_, branch = self._parse_flatpakref(package)
+            return inventory.is_installed(target, id_, branch=branch)
+        return False
 
     @staticmethod
-    def _get_flatpakref_application_name(filepath: str) -> str:
-        with open(filepath) as file:
-            text = file.read()
-            for line in text.splitlines():
-                if line.startswith('Name='):
-                    return line.split('=')[1].strip()
-        raise Exception('Error parsing flatpakref file: {}'.format(filepath))
-
-    def _check_is_application_installed(self, name: str) -> bool:
-        output = self.run_command('flatpak', 'list')
-        return output.find(name) != -1
-
-    def _install_flatpak_package(self, app: str, remote: str=None, type_: str=None, target: str='system'):
-        # Flatpak considers it an error to install already
-        # installed applications
-        # Workaround by using "--reinstall" which uninstalls
-        # the application first if it is already installed.
-        # FIXME: At least with .flatpak bundles, the "--reinstall"
-        # option doesn't seem to fix the issue currently.
-        cmd = ['flatpak', 'install', '--reinstall', '-y']
+    def _parse_entry(flatpak) -> Tuple[str, str, str, Optional[str]]:
+        """
+        Normalize an entry of the plugin configuration
+        :param flatpak: Package name or dictionary with additional options
+        :return: Tuple of package, type, target and remote
+        """
+        target = 'system'
+        type_ = None
+        remote = None
+
+        if isinstance(flatpak, dict):
+            package = flatpak['package']
+            if 'target' in flatpak:
+                target = flatpak['target']
+            if 'type' in flatpak:
+                type_ = flatpak['type']
+            if 'remote' in flatpak:
+                remote = flatpak['remote']
+        else:
+            package = flatpak
+
+        # Determine type based on package argument
+        if type_ is None:
+            if package[package.rfind('.')+1:] == 'flatpakref':
+                type_ = 'ref'
+            elif package[package.rfind('.')+1:] == 'flatpak':
+                type_ = 'bundle'
+            else:
+                type_ = 'app'
+
+        return package, type_, target, remote
+
+    def _install_flatpak_packages(self, apps: List[str], remote: str=None, type_: str=None, target: str='system'):
+        cmd = ['flatpak', 'install', '-y']
+        if type_ == 'bundle':
+            # Flatpak considers it an error to install already installed applications,
+            # which can't be checked for bundles without installing them.
+            # FIXME: At least with .flatpak bundles, the "--reinstall"
+            # option doesn't seem to fix the issue currently.
+            cmd += ['--reinstall']
         if target == 'user':
             cmd += ['--user']
         else:
@@ -147,11 +243,11 @@ class FlatpakPackagesPlugin(_AbstractFlatpakPlugin):
                 cmd += ['--app']
         if remote is not None:
             cmd += [remote]
-        cmd += [app]
+        cmd += apps
         if target == 'system':
-            self.run_command_sudo(*cmd)
+            self.run_command_sudo(*cmd, capture=False)
         else:
-            self.run_command(*cmd)
+            self.run_command(*cmd, capture=False)
 
     def perform(self):
         # Install flatpak if not already installed
@@ -160,31 +256,36 @@ class FlatpakPackagesPlugin(_AbstractFlatpakPlugin):
 
         assert self._check_is_flatpak_installed()
 
-        for flatpak in self.config:
-            target = 'system'
-            type_ = None
-            remote = None
-
-            if isinstance(flatpak, dict):
-                package = flatpak['package']
-                if 'target' in flatpak:
-                    target = flatpak['target']
-                if 'type' in flatpak:
-                    type_ = flatpak['type']
-                if 'remote' in flatpak:
-                    remote = flatpak['remote']
-            else:
-                package = flatpak
-
-            # Determine type based on package argument
-            if type_ is None:
-                if package[package.rfind('.')+1:] == 'flatpakref':
-                    type_ = 'ref'
-                elif package[package.rfind('.')+1:] == 'flatpak':
-                    type_ = 'bundle'
-                else:
-                    type_ = 'app'
+        try:
+            # Apps and runtimes of the same installation and remote are installed in a single
+            # transaction, so Flatpak resolves and downloads shared runtimes only once.
+            # Bundles and refs may provide runtimes or add remotes used by the following
+            # packages, so they are installed in order after the preceding groups.
+            groups = collections.OrderedDict()
+            for package, type_, target, remote in self.run_async(self._prepare_packages()):
+                if type_ in ('app', 'runtime'):
+                    groups.setdefault((target, remote, type_), []).append(package)
+                    continue
+                self._install_groups(groups)
+                self._install_flatpak_packages([package], remote, type_, target)
+            self._install_groups(groups)
+        finally:
+            probes.flatpak_inventory.invalidate()
+
+    def _install_groups(self, groups: Dict[Tuple[str, Optional[str], str], List[str]]):
+        for (target, remote, type_), packages in groups.items():
+            self._install_flatpak_packages(packages, remote, type_, target)
+        groups.clear()
+
+    async def _prepare_packages(self) -> List[Tuple[str, str, str, Optional[str]]]:
+        """
+        Download remote packages while taking a snapshot of the installed refs
+        :return: Entries of packages to install with paths of downloaded packages
+        """
+        loop = asyncio.get_event_loop()
+        entries = [self._parse_entry(flatpak) for flatpak in self.config]
 
+        async def prepare(package: str, type_: str) -> str:
             # Download remote bundles or refs
             # This is required for bundles because it is not currently supported
             # by Flatpak to download remote .flatpak bundles. We also download
@@ -193,24 +294,35 @@ class FlatpakPackagesPlugin(_AbstractFlatpakPlugin):
             if type_ in ('ref', 'bundle'):
                 is_remote_package = bool(urllib.parse.urlparse(package).scheme)
                 if is_remote_package:
-                    package = self._download_package(package, suffix='.flatpakref' if type_ == 'ref' else '.flatpak')
-                else:
-                    # Consider the package to be a local file,
-                    # therefore expand the path:
-                    package = self._expand_path(package)
-
-            # In case of .flatpakref files, we will only perform
-            # the installation if the application is not already installed
-            if type_ == 'ref':
-                # Check if the .flatpakref is remote
-                app_name = self._get_flatpakref_application_name(package)
-                if self._check_is_application_installed(app_name):
-                    continue
-
-            # NOTE: Doesn't check whether the application is
-            # already installed or not. Will perform a reinstall
-            # if the application is already installed.
-            self._install_flatpak_package(package, remote, type_, target)
+                    return await loop.run_in_executor(None, self._download_package, package)
+                # Consider the package to be a local file,
+                # therefore expand the path:
+                return self._expand_path(package)
+            return package
+
+        inventory, *packages = await asyncio.gather(
+            loop.run_in_executor(None, probes.flatpak_inventory),
+            *(prepare(package, type_) for package, type_, _, _ in entries)
+        )
+
+        result = []
+        for (_, type_, target, remote), package in zip(entries, packages):
+            if not self._is_installed(inventory, package, type_, target):
+                result.append((package, type_, target, remote))
+        return result
+
+    def pending(self) -> Optional[List[str]]:
+        steps = []
+        if not self._check_is_flatpak_available():
+            steps += ['install flatpak']
+        inventory = probes.flatpak_inventory()
+        for flatpak in self.config:
+            package, type_, target, remote = self._parse_entry(flatpak)
+            # Remote refs and bundles can't be checked without downloading them
+            path = package if type_ != 'ref' or urllib.parse.urlparse(package).scheme else self._expand_path(package)
+            if not self._is_installed(inventory, path, type_, target):
+                steps += ['install {}'.format(package)]
+        return steps
 
 
 class FlatpakRepositoriesPlugin(_AbstractFlatpakPlugin):
@@ -222,6 +334,15 @@ class FlatpakRepositoriesPlugin(_AbstractFlatpakPlugin):
             schema.Optional('target'): schema.Or('user', 'system'),
         }
     ]
+    step_duration = 2.0
+
+    def pending(self) -> Optional[List[str]]:
+        steps = []
+        if not self._check_is_flatpak_available():
+            steps += ['install flatpak']
+        inventory = probes.flatpak_inventory()
+        return steps + ['add remote {}'.format(repo['name']) for repo in self.config
+                        if not inventory.has_remote(repo.get('target', 'system'), repo['name'])]
 
     def perform(self):
         # Install flatpak if not already installed
@@ -230,6 +351,7 @@ class FlatpakRepositoriesPlugin(_AbstractFlatpakPlugin):
 
         assert self._check_is_flatpak_installed()
 
+        inventory = probes.flatpak_inventory()
         for repo in self.config:
             cmd = ['flatpak', 'remote-add', '--if-not-exists']
             target = 'system'
@@ -237,6 +359,9 @@ class FlatpakRepositoriesPlugin(_AbstractFlatpakPlugin):
             if 'target' in repo:
                 target = repo['target']
 
+            if inventory.has_remote(target, repo['name']):
+                continue
+
             if target == 'user':
                 cmd += ['--user']
             elif target == 'system':
@@ -244,10 +369,11 @@ class FlatpakRepositoriesPlugin(_AbstractFlatpakPlugin):
 
             cmd += [repo['name'], repo['location']]
 
+            probes.flatpak_inventory.invalidate()
             if target == 'system':
-                self.run_command_sudo(*cmd)
+                self.run_command_sudo(*cmd, capture=False)
             else:
-                self.run_command(*cmd)
+                self.run_command(*cmd, capture=False)
 
 
 class GitHubReleasesPlugin(plugins.AbstractPlugin):
@@ -260,8 +386,12 @@ class GitHubReleasesPlugin(plugins.AbstractPlugin):
             'target': str
         }
     ]
+    step_duration = 5.0
 
     def perform(self):
+        # Assets of a release don't change, but the release "latest" refers to does
+        cache = download_cache.DownloadCache()
+        metadata_cache = download_cache.DownloadCache(max_age=0)
         for release in self.config:
             user, repo = release['repo'].split('/')
             release_name = release['release']
@@ -270,8 +400,9 @@ class GitHubReleasesPlugin(plugins.AbstractPlugin):
             if release_name != 'latest' and not release_name.startswith('tags/'):
                 release_name = 'tags/' + release_name
             url = 'https://api.github.com/repos/{}/{}/releases/{}'.format(user, repo, release_name)
-            response_text = requests.request('GET', url).content.decode()
-            response_json = json.loads(response_text)
+            # GitHub answers revalidations of unchanged releases without counting them against the rate limit
+            with open(metadata_cache.fetch(url, self.observer)) as file:
+                response_json = json.load(file)
             assets = response_json['assets']
             found_asset = None
             for asset in assets:
@@ -279,9 +410,7 @@ class GitHubReleasesPlugin(plugins.AbstractPlugin):
                     found_asset = asset
                     break
             if found_asset is not None:
-                download_url = found_asset['browser_download_url']
-                with urllib.request.urlopen(download_url) as response, open(download_target, 'wb') as out_file:
-                    shutil.copyfileobj(response, out_file)
+                cache.download(found_asset['browser_download_url'], download_target, self.observer)
             else:
                 raise Exception('Asset "{}" not found in downloads for "{}/{}" "{}"'
                                 .format(download_asset, user, repo, release_name))
@@ -290,51 +419,89 @@ class GitHubReleasesPlugin(plugins.AbstractPlugin):
 class PPAsPlugin(plugins.AbstractPlugin):
     key = 'ppas'
     schema = [str]
-    # Source: https://askubuntu.com/a/148968
-    _ppa_regex = re.compile(r'^deb http://ppa.launchpad.net/[a-z0-9-]+/[a-z0-9-]+')
+    step_duration = 5.0
+    # All PPAs of merged actions are added in one step
+    coalescible = True
+
+    @classmethod
+    def coalesce(cls, configs: List[List[str]]) -> List[str]:
+        return AptPackagesPlugin.coalesce(configs)
 
     def _get_existing_ppas(self) -> Set[str]:
         """
         Get a set of PPAs already active on the system
         :return: Set of active PPAs
         """
-        existing_ppas = set()
-        sources_lists = glob.iglob('/etc/apt/**/*.list', recursive=True)
-        for sources_list in sources_lists:
-            with open(sources_list) as file:
-                text = file.read()
-            for line in text.splitlines():
-                match = self._ppa_regex.match(line)
-                if match is not None:
-                    split_line = match.group(0).split('/')
-                    existing_ppas.add(split_line[3] + '/' + split_line[4])
-        return existing_ppas
+        return apt.existing_ppas()
+
+    def _fetch_signing_key(self, ppa: str) -> str:
+        """
+        Look up the signing key of a PPA on Launchpad
+        :param ppa: PPA in the format user/ppa
+        :return: ASCII armored public key
+        """
+        user, name = ppa.split('/', 1)
+        response = requests.get('https://api.launchpad.net/1.0/~{}/+archive/ubuntu/{}'.format(user, name))
+        response.raise_for_status()
+        fingerprint = response.json()['signing_key_fingerprint']
+        key = requests.get('https://keyserver.ubuntu.com/pks/lookup',
+                           params={'op': 'get', 'options': 'mr', 'search': '0x' + fingerprint})
+        key.raise_for_status()
+        if self.observer is not None:
+            self.observer.downloaded(len(response.content) + len(key.content))
+        return key.text
+
+    async def _fetch_signing_keys(self, ppas: List[str]) -> List[str]:
+        loop = asyncio.get_event_loop()
+        return await asyncio.gather(*(loop.run_in_executor(None, self._fetch_signing_key, ppa) for ppa in ppas))
 
     def perform(self):
         existing_ppas = self._get_existing_ppas()
-        any_new_ppas = False
-        for ppa in self.config:
-            if ppa not in existing_ppas:
-                any_new_ppas = True
-                self.run_command_sudo('apt-add-repository', '-y', 'ppa:' + ppa)
-        if any_new_ppas:
-            self.run_command_sudo('apt-get', 'update')
+        new_ppas = [ppa for ppa in self.config if ppa not in existing_ppas]
+        if len(new_ppas) == 0:
+            return
+        codename = apt.distribution_codename()
+        https = apt.supports_https()
+        keys = self.run_async(self._fetch_signing_keys(new_ppas))
+        # Stage the keyrings and source entries of all PPAs in a copy of the apt
+        # configuration directory and install them with a single command
+        with tempfile.TemporaryDirectory(prefix='ppas_') as staging_dir:
+            os.makedirs(os.path.join(staging_dir, 'keyrings'))
+            os.makedirs(os.path.join(staging_dir, 'sources.list.d'))
+            for ppa, key in zip(new_ppas, keys):
+                name = '{}-ubuntu-{}'.format(*ppa.split('/', 1))
+                with open(os.path.join(staging_dir, 'keyrings', name + '.gpg'), 'wb') as file:
+                    file.write(apt.dearmor(key))
+                keyring_path = os.path.join(apt.APT_CONFIG_DIR, 'keyrings', name + '.gpg')
+                with open(os.path.join(staging_dir, 'sources.list.d', '{}-{}.sources'.format(name, codename)), 'w') \
+                        as file:
+                    file.write(apt.ppa_sources(ppa, codename, keyring_path, https))
+            self.run_command_sudo('cp', '-r', '--no-preserve=mode,ownership', staging_dir + '/.', apt.APT_CONFIG_DIR)
+        # Updating the package index is deferred to the next installation,
+        # so several PPAs actions share a single update
+        apt.invalidate_index(self)
+
+    def pending(self) -> Optional[List[str]]:
+        existing_ppas = self._get_existing_ppas()
+        return ['add ppa:{}'.format(ppa) for ppa in self.config if ppa not in existing_ppas]
 
 
 class ScriptletPlugin(plugins.AbstractPlugin):
     key = 'scriptlet'
     schema = str
+    step_duration = 10.0
 
     def perform(self):
         with tempfile.NamedTemporaryFile('w', prefix='scriptlet_',
                                          suffix='.sh', encoding='utf-8', delete=False) as file:
             file.write(self.config)
-        self.run_command('/bin/bash', file.name)
+        self.run_command('/bin/bash', file.name, capture=False)
 
 
 class ScriptsPlugin(plugins.AbstractPlugin):
     key = 'scripts'
     schema = [str]
+    step_duration = 10.0
 
     def perform(self):
         scripts = self.config
@@ -342,7 +509,7 @@ class ScriptsPlugin(plugins.AbstractPlugin):
             filename = self._expand_path(filename)
             if not os.path.isfile(filename):
                 raise FileNotFoundError('The file {} doesn\'t exist'.format(filename), self.key)
-            self.run_command('/bin/bash', filename)
+            self.run_command('/bin/bash', filename, capture=False)
 
 
 class SnapPackagesPlugin(plugins.AbstractPlugin):
@@ -358,36 +525,125 @@ class SnapPackagesPlugin(plugins.AbstractPlugin):
             schema.Optional('dangerous'): bool
         },
     ]
+    step_duration = 20.0
+    barrier = False
+
+    @staticmethod
+    def _parse_entry(package) -> Tuple[str, dict]:
+        # Using type(package) == dict here is not enough because
+        # while a subclass of dict will be passed as config,
+        # it is not guaranteed what concrete subclass
+        # that will be. Currently, CommentedMap from ruamel.yaml
+        # is used, but this may change in the future!
+        if isinstance(package, dict):
+            options = {option: package[option] for option in ('channel', 'classic', 'devmode', 'jailmode')
+                       if option in package}
+            options.update(classic=bool(options.get('classic')), devmode=bool(options.get('devmode')),
+                           jailmode=bool(options.get('jailmode')))
+            return package['package'], options
+        return package, {'classic': False, 'devmode': False, 'jailmode': False}
+
+    def _is_satisfied(self, installed: dict, name: str, options: dict) -> bool:
+        # Local snap files are always installed
+        return not name.endswith('.snap') and name in installed and \
+            snapd.is_satisfied(installed[name], options.get('channel'), options['devmode'], options['jailmode'])
+
+    def pending(self) -> Optional[List[str]]:
+        installed = probes.installed_snaps()
+        steps = []
+        for package in self.config:
+            name, options = self._parse_entry(package)
+            if not self._is_satisfied(installed, name, options):
+                steps += ['install {}'.format(name)]
+        return steps
+
+    def _install_file(self, package):
+        cmd = ['snap', 'install']
+        if isinstance(package, dict):
+            for option in ('classic', 'devmode', 'jailmode', 'dangerous'):
+                if package.get(option):
+                    cmd += ['--' + option]
+            package = package['package']
+        cmd += [self._expand_path(package)]
+        self.run_command_sudo(*cmd, capture=False)
+
+    def _start_change(self, client: snapd.Client, action: str, names: List[str], options: dict) -> str:
+        try:
+            if len(names) > 1:
+                return client.install_many(names)
+            return getattr(client, action)(names[0], **options)
+        except snapd.SnapdError as e:
+            if not e.access_denied:
+                raise
+        # snapd only accepts changes from root, let the snap command submit the change
+        cmd = ['snap', action, '--no-wait']
+        if 'channel' in options:
+            cmd += ['--channel', options['channel']]
+        cmd += ['--' + option for option in ('classic', 'devmode', 'jailmode') if options.get(option)]
+        return self.run_command_sudo(*cmd, *names).strip()
 
     def perform(self):
-        packages = self.config
-        for package in packages:
-            # Using type(package) == dict here is not enough because
-            # while a subclass of dict will be passed as config,
-            # it is not guaranteed what concrete subclass
-            # that will be. Currently, CommentedMap from ruamel.yaml
-            # is used, but this may change in the future!
-            if isinstance(package, dict):
-                package_name = package['package']
-                if package_name.endswith('.snap'):
-                    package_name = self._expand_path(package_name)
-                cmd = ['snap', 'install']
-                if 'channel' in package:
-                    cmd += ['--channel', package['channel']]
-                if 'classic' in package and package['classic']:
-                    cmd += ['--classic']
-                if 'devmode' in package and package['devmode']:
-                    cmd += ['--devmode']
-                if 'jailmode' in package and package['jailmode']:
-                    cmd += ['--jailmode']
-                if 'dangerous' in package and package['dangerous']:
-                    cmd += ['--dangerous']
-                cmd += [package_name]
-                self.run_command_sudo(*cmd)
-            else:
-                if package.endswith('.snap'):
-                    package = self._expand_path(package)
-                self.run_command_sudo('snap', 'install', package)
+        errors = []
+        with snapd.Client() as client:
+            installed = client.snaps()
+            # Snaps without options are installed together in a single change,
+            # which saves snapd checking its prerequisites for each of them
+            group = []
+            individual = []
+            for package in self.config:
+                name, options = self._parse_entry(package)
+                if name.endswith('.snap'):
+                    individual.append(package)
+                elif self._is_satisfied(installed, name, options):
+                    continue
+                elif name not in installed and not any(options.values()):
+                    group.append(name)
+                else:
+                    individual.append(package)
+
+            if len(group) > 0:
+                error = None
+                try:
+                    client.wait(self._start_change(client, 'install', group, {}), self.observer)
+                except (snapd.SnapdError, subprocess.CalledProcessError) as e:
+                    error = str(e)
+                # Snaps of a failed change may still have been installed
+                installed = client.snaps()
+                for name in group:
+                    if name in installed:
+                        self._report(name, None)
+                    else:
+                        errors.append(self._report(name, error or 'not installed'))
+
+            for package in individual:
+                name, options = self._parse_entry(package)
+                try:
+                    if name.endswith('.snap'):
+                        self._install_file(package)
+                    else:
+                        action = 'refresh' if name in installed else 'install'
+                        client.wait(self._start_change(client, action, [name], options), self.observer)
+                except (snapd.SnapdError, subprocess.CalledProcessError) as e:
+                    errors.append(self._report(name, str(e)))
+                else:
+                    self._report(name, None)
+        if len(errors) > 0:
+            raise Exception('Could not install {} of the snaps:\n{}'.format(len(errors), '\n'.join(errors)))
+
+    def _report(self, name: str, error: Optional[str]) -> str:
+        line = '{}: {}'.format(name, error or 'installed')
+        if self._verbose:
+            print(line)
+        return line
+
+
+# Plugins which update the apt package index themselves before installing packages
+APT_INDEX_PLUGINS = (
+    AptPackagesPlugin,
+    FlatpakPackagesPlugin,
+    FlatpakRepositoriesPlugin,
+    PPAsPlugin
+)
 
 
 BUILTIN_PLUGINS = (
@@ -1,84 +1,163 @@
 # -*- coding: utf-8 -*-
 
-from typing import Dict, List, Type, Callable
+from typing import Dict, List, Optional, Type
 
 import os
 import glob
-import ruamel.yaml as yaml
-import schema
-import progressbar
+import functools
+import concurrent.futures
 import threading
-import itertools
 import time
 
+from . import apt
 from . import builtin_plugins
+from . import executor
 from . import plugin_support
 from . import plugins
-from . import termcol
+from . import progress
+from . import run_log
+from . import loader
 from . import log
+from . import metrics
+from . import plan_cache
 from . import tree
 from . import state
+from . import trace
+from . import validation
 
-_OPTIONAL_META_SCHEMA = {
-    schema.Optional('author'): str,
-    schema.Optional('description'): str,
-}
-
-
-def _run_safe(f: Callable, result):
-    try:
-        f()
-    except Exception as e:
-        result += [e]
-
-
-def _track_progress(indent_level: int, label: str, f: Callable):
-    indent = indent_level * '  '
-    widgets = [indent,
-               termcol.COLORS.WARNING,
-               progressbar.AnimatedMarker(), ' ', label, ' ',
-               termcol.COLORS.ENDC]
-    p = progressbar.ProgressBar(widgets=widgets,
-                                maxval=progressbar.UnknownLength,
-                                redirect_stdout=True)
-    p.start()
-    result = []
-    thread = threading.Thread(target=_run_safe, args=(f, result))
-    thread.start()
-    for progress_count in itertools.count():
-        if not thread.is_alive():
-            break
-        p.update(progress_count)
-        time.sleep(0.1)
-    if len(result) > 0:
-        p.widgets = [indent, termcol.error('❌ ' + label)]
-    else:
-        p.widgets = [indent, termcol.success('✔ ' + label)]
-    p.update(force=True)
-    p.finish()
-    if len(result) > 0 and isinstance(result[0], Exception):
-        raise result[0]
+
+# Label of the package index update, which is performed as a step of its own
+_INDEX_UPDATE_LABEL = 'update-package-index'
+
+# Includes are resolved before any action is performed, rather than failing halfway through the run
+_INCLUDE_HINT = 'Included files are loaded before performing, they can\'t be created by actions of the same setup.'
+
+
+def _plain(value):
+    # Convert ruamel.yaml round-trip types into plain Python types
+    # so plans do not depend on the loader they were created with
+    if isinstance(value, dict):
+        return loader.mapping_type()((_plain(k), _plain(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [_plain(v) for v in value]
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        return str(value)
+    if isinstance(value, int):
+        return int(value)
+    if isinstance(value, float):
+        return float(value)
+    return value
+
+
+def _names(value) -> List[str]:
+    # Directive values are either a single string or a list of strings
+    return [str(v) for v in value] if isinstance(value, list) else [str(value)]
 
 
 class SetupError(Exception):
     pass
 
 
+class PlannedAction:
+    """
+    An action of a setup plan together with the work it would perform
+    """
+    __slots__ = ('path', 'action', 'status', 'steps', 'estimated_duration')
+
+    # The action was already performed according to the state
+    DONE = 'done'
+    # The plugin reported that there is nothing left to do
+    SATISFIED = 'satisfied'
+    # The action will be performed
+    PENDING = 'pending'
+
+    def __init__(self, path: List[str], action: tree.Action, status: str, steps: Optional[List[str]] = None,
+                 estimated_duration: float = 0.0):
+        """
+        :param path: Names of the categories containing the action
+        :param action: The action
+        :param status: One of DONE, SATISFIED and PENDING
+        :param steps: Descriptions of the pending steps or None if unknown
+        :param estimated_duration: Estimated duration in seconds
+        """
+        self.path = path
+        self.action = action
+        self.status = status
+        self.steps = steps
+        self.estimated_duration = estimated_duration
+
+
 class Setup:
-    def __init__(self, data_path: str = None, rerun: bool = False):
+    def __init__(self, data_path: str = None, rerun: bool = False, round_trip: bool = False,
+                 tracer: trace.Tracer = None):
+        """
+        :param data_path: Path to configuration folder
+        :param rerun: Whether to perform actions even if they were already performed
+        :param round_trip: Whether to load configurations using the ruamel.yaml round-trip loader
+                           instead of the faster and leaner safe loader
+        :param tracer: Tracer to record a timeline of loading and performing the setup with
+        """
         self._data_path = data_path
+        self._tracer = tracer or trace.NullTracer()
+        self._round_trip = round_trip
         self._root = None
+        self._config_dir = None
 
-        self._action_schema = {}
-        self._schema_root = {}
+        self._plugins = {}
+        self._validator = None
+        self._plan_cache = None
+        self._included_plans = {}
+        self._include_stack = []
         self._rerun = rerun
         self._state = None
         self._skipped_count = 0
+        self._lock = threading.Lock()
+        self._concurrent = False
+        self._progress = None
+        self._run_log = None
+        self._metrics = metrics.Metrics()
+        # Actions of coalescible plugins which are still open for merging, by plugin key
+        self._batches = {}
+        self._coalesced_count = 0
+        # Digests of performed actions whose effects are no longer present
+        self._drifted = set()
+        self._drifted_count = 0
 
     @property
     def skipped_steps_count(self) -> int:
         return self._skipped_count
 
+    @property
+    def log_dir(self) -> Optional[str]:
+        """
+        Directory containing the command output logs of the last run
+        (None if no command was run)
+        """
+        return self._run_log.path if self._run_log is not None and self._run_log.exists else None
+
+    @property
+    def metrics(self) -> metrics.Metrics:
+        """
+        Resources used by the actions performed in the last run
+        """
+        return self._metrics
+
+    @property
+    def drifted_steps_count(self) -> int:
+        """
+        Number of performed actions which were found to have drifted by the last verification
+        """
+        return self._drifted_count
+
+    @property
+    def coalesced_steps_count(self) -> int:
+        """
+        Number of actions which were merged into preceding actions of the same plugin
+        """
+        return self._coalesced_count
+
     def load_plugins(self):
         if self._data_path is not None:
             custom_plugins = self._load_custom_plugins()
@@ -86,81 +165,458 @@ class Setup:
             custom_plugins = []
         self._set_plugins(list(builtin_plugins.BUILTIN_PLUGINS) + custom_plugins)
 
-    def load_config_file(self, filename: str):
-        with open(filename) as file:
-            y = yaml.YAML()
-            data = y.load(file)
-
-        if data is None:
-            raise SetupError('No setup configuration found in {}.'.format(filename))
+    def load_config_file(self, filename: str, use_cache: bool = True):
+        with self._tracer.span('load configuration', 'config', filename=filename):
+            if use_cache:
+                self._plan_cache = plan_cache.PlanCache(self._plugins.values())
+            self._config_dir = os.path.dirname(os.path.abspath(filename))
+            self._root = self._load_plan_file(filename)
 
-        self.load_config(data)
-
-        self._state = state.ConfigState()
-        if self._state.exists:
-            self._state.load()
+        with self._tracer.span('load state', 'state'):
+            # Keep the state of each configuration file separately
+            namespace = os.environ.get(state.NAMESPACE_ENV) or os.path.realpath(filename)
+            self._state = state.ConfigState(namespace)
+            if self._state.exists:
+                self._state.load()
 
     def load_config_str(self, config: str):
-        y = yaml.YAML()
-        data = y.load(config)
+        data = loader.load(config, round_trip=self._round_trip)
 
         if data is None:
             raise SetupError('Trying to load empty configuration.')
 
-        self.load_config(data)
+        self._root = self._compile_plan(data, source=config)
 
     def load_config(self, data: Dict):
+        self._root = self._compile_plan(data)
+
+    def perform(self, indent: bool = False, verbose: bool = False, jobs: int = 1, verify: bool = False):
+        """
+        Perform all actions
+        :param indent: Whether to indent output according to the category tree
+        :param verbose: Whether verbose output is enabled
+        :param jobs: Maximum number of actions to perform concurrently in parallel categories
+        :param verify: Whether to check that the effects of already performed actions are
+                       still present and perform the actions again otherwise
+        """
+        base_dir = self._config_dir or self._data_path or os.getcwd()
+        if verify:
+            with self._tracer.span('verify', 'state'):
+                self.verify()
+        ex = executor.Executor(jobs)
+        self._concurrent = False
+        self._batches = {}
+        self._coalesced_count = 0
+        with self._tracer.span('schedule', 'setup'):
+            self._schedule_node(ex, self._root, base_dir, [], [], indent=indent, verbose=verbose)
+        self._concurrent = self._concurrent and jobs > 1
+        self._run_log = run_log.RunLog()
+        self._metrics = metrics.Metrics()
+        with self._tracer.span('perform', 'setup', jobs=jobs), progress.ProgressRenderer() as self._progress:
+            try:
+                ex.run()
+                # Don't leave the package index outdated if no installation followed changed sources
+                self._update_index([], verbose=verbose)
+            finally:
+                if self._state is not None:
+                    self._state.close()
+        self._progress = None
+
+    def plan(self, verify: bool = False) -> List[PlannedAction]:
+        """
+        Determine the work a run would perform without performing it.
+        Only uses cheap, read-only checks and does not require root privileges.
+        :param verify: Whether to check that the effects of already performed actions are still present
+        :return: Planned actions in order
+        """
+        if verify:
+            self.verify()
+        base_dir = self._config_dir or self._data_path or os.getcwd()
+        planned = []
+        self._plan_node(self._root, base_dir, [], planned)
+
+        # Probes are mostly waiting for external tools, check actions concurrently
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(self._plan_action, [p for p in planned if p.status == PlannedAction.PENDING]))
+        return planned
+
+    def verify(self) -> int:
+        """
+        Check whether the effects of already performed actions are still present using
+        the cheap probes of their plugins. Actions whose effects are missing (e.g. because
+        a package was removed) are considered not performed for the rest of this session.
+        Actions whose plugins can't check their effects are trusted.
+        :return: Number of drifted actions
+        """
+        self._drifted = set()
+        base_dir = self._config_dir or self._data_path or os.getcwd()
+        planned = []
+        self._plan_node(self._root, base_dir, [], planned)
+        performed = [p for p in planned if p.status == PlannedAction.DONE]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(self._probe_action, performed))
+        self._drifted = {state.action_hash(p.action) for p in performed if p.steps}
+        self._drifted_count = len(self._drifted)
+        return self._drifted_count
+
+    def _plan_node(self, node: tree.Category, base_dir: str, path: List[str], planned: List[PlannedAction]):
+        for child, child_base_dir in self._expand_includes(node.children, base_dir):
+            if isinstance(child, tree.Category):
+                self._plan_node(child, child_base_dir, path + [child.name], planned)
+            elif isinstance(child, tree.Action):
+                if child.name not in self._plugins:
+                    raise SetupError('Unknown plugin key "{}"'.format(child.name))
+                if self._is_done(child):
+                    planned.append(PlannedAction(path, child, PlannedAction.DONE))
+                else:
+                    planned.append(PlannedAction(path, child, PlannedAction.PENDING))
+
+    def _probe_action(self, planned: PlannedAction):
+        plugin_inst = self._plugins[planned.action.name](
+            config=planned.action.body,
+            data_path=self._data_path
+        )
+        try:
+            planned.steps = plugin_inst.pending()
+        except Exception:
+            # Probes are best effort, treat the result as unknown
+            planned.steps = None
+
+    def _plan_action(self, planned: PlannedAction):
+        plugin_cls = self._plugins[planned.action.name]
+        # Without a result, assume the whole action needs to be performed
+        self._probe_action(planned)
+        if planned.steps is None:
+            body = planned.action.body
+            step_count = len(body) if isinstance(body, (list, dict)) else 1
+        else:
+            step_count = len(planned.steps)
+            if step_count == 0:
+                planned.status = PlannedAction.SATISFIED
+        planned.estimated_duration = step_count * plugin_cls.step_duration
+
+    def _schedule_node(self, ex: executor.Executor, node: tree.Category, base_dir: str,
+                       dependencies: List[executor.Task], path: List[str], indent_level: int = -1,
+                       indent: bool = False, verbose: bool = False) -> List[executor.Task]:
+        """
+        Add the actions of a category to the task graph
+        :param ex: Executor to add the tasks to
+        :param node: Category to add
+        :param base_dir: Directory that paths of included files are relative to
+        :param dependencies: Tasks that need to complete before the category is performed
+        :param path: Names of the categories containing the category
+        :return: Tasks that complete once the category is performed
+        """
+        if node.name != '':
+            dependencies = [ex.add(functools.partial(self._log_category, node, path, indent_level, indent),
+                                   dependencies, inline=True)]
+            path = path + [node.name]
+
+        children = list(self._expand_includes(node.children, base_dir))
+        kwargs = {'path': path, 'indent_level': indent_level + 1, 'indent': indent, 'verbose': verbose}
+
+        if not node.parallel:
+            # Each child depends on all of its predecessors
+            performed = set()
+            for child, child_base_dir in children:
+                if isinstance(child, tree.Category):
+                    for name in child.depends_on:
+                        if name not in performed:
+                            raise SetupError('Category "{}" depends on "{}" which is not one of its preceding '
+                                             'sibling categories'.format(child.name, name))
+                    performed.add(child.name)
+                dependencies = self._schedule_child(ex, child, child_base_dir, dependencies, **kwargs)
+            return dependencies
+
+        # Children only depend on the siblings they explicitly depend on
+        self._concurrent = True
+        exits = []
+        sibling_exits = {}
+        for child, child_base_dir in self._order_siblings(children):
+            # Actions can't be merged across concurrently performed children
+            self._batches.clear()
+            child_dependencies = list(dependencies)
+            if isinstance(child, tree.Category):
+                for name in child.depends_on:
+                    child_dependencies += sibling_exits[name]
+            child_exits = self._schedule_child(ex, child, child_base_dir, child_dependencies, **kwargs)
+            if isinstance(child, tree.Category):
+                sibling_exits.setdefault(child.name, []).extend(child_exits)
+            exits += child_exits
+        self._batches.clear()
+        return ex.join(exits)
+
+    def _schedule_child(self, ex: executor.Executor, child, base_dir: str, dependencies: List[executor.Task],
+                        path: List[str], indent_level: int, indent: bool, verbose: bool) -> List[executor.Task]:
+        if isinstance(child, tree.Category):
+            return self._schedule_node(ex, child, base_dir, dependencies, path, indent_level, indent, verbose)
+
+        if child.name not in self._plugins:
+            raise SetupError('Unknown plugin key "{}"'.format(child.name))
+        plugin_cls = self._plugins[child.name]
+
+        # Already performed actions are skipped and neither merged nor ordering barriers
+        if not self._is_done(child):
+            if plugin_cls.coalescible and plugin_cls.barrier:
+                # Later actions of other plugins may depend on this one (e.g. packages
+                # from an added PPA), so they must not be merged into earlier actions
+                for key in list(self._batches):
+                    if key != child.name:
+                        del self._batches[key]
+            if plugin_cls.coalescible and child.name in self._batches:
+                # Merge into the preceding action of the same plugin. Only actions
+                # that are no ordering barriers were scheduled since, so it's safe
+                # to perform this action earlier.
+                self._batches[child.name].append(child)
+                self._coalesced_count += 1
+                return dependencies
+            if plugin_cls.coalescible:
+                batch = [child]
+                self._batches[child.name] = batch
+                task = ex.add(functools.partial(self._perform_action, batch, path, indent_level, indent, verbose),
+                              dependencies)
+                return [task]
+            if plugin_cls.barrier:
+                self._batches.clear()
+
+        task = ex.add(functools.partial(self._perform_action, [child], path, indent_level, indent, verbose),
+                      dependencies)
+        return [task]
+
+    def _is_done(self, action: tree.Action) -> bool:
+        if self._state is None or self._rerun:
+            return False
+        with self._tracer.span('state lookup', 'state', action=action.name):
+            if self._drifted and state.action_hash(action) in self._drifted:
+                return False
+            return self._state.is_done(action)
+
+    @staticmethod
+    def _order_siblings(children: List) -> List:
+        """
+        Order the children of a parallel category so that categories come after
+        the sibling categories they depend on while otherwise keeping their order
+        """
+        names = {child.name for child, _ in children if isinstance(child, tree.Category)}
+        for child, _ in children:
+            if isinstance(child, tree.Category):
+                for name in child.depends_on:
+                    if name not in names:
+                        raise SetupError('Category "{}" depends on unknown sibling category "{}"'
+                                         .format(child.name, name))
+        ordered = []
+        remaining = list(children)
+        while remaining:
+            pending_names = {child.name for child, _ in remaining if isinstance(child, tree.Category)}
+            ready = [c for c in remaining
+                     if not isinstance(c[0], tree.Category) or not pending_names.intersection(c[0].depends_on)]
+            if not ready:
+                raise SetupError('Circular dependency between categories {}'
+                                 .format(', '.join('"{}"'.format(n) for n in sorted(pending_names))))
+            ordered += ready
+            ready_ids = {id(c) for c in ready}
+            remaining = [c for c in remaining if id(c) not in ready_ids]
+        return ordered
+
+    def _log_category(self, node: tree.Category, path: List[str], indent_level: int, indent: bool):
+        if self._concurrent:
+            log.information('/'.join(path + [node.name]) + ':', bold=True)
+        else:
+            log.information(('  ' * indent_level if indent else '') + '{}:'.format(node.name), bold=True)
+
+    def _expand_includes(self, children: List, base_dir: str):
+        """
+        Iterate over the children of a category and splice in the contents
+        of included files in place of include directives
+        :return: Iterator over tuples of a child and the directory that paths
+                 in included files are relative to
+        """
+        for child in children:
+            if not isinstance(child, tree.Include):
+                yield child, base_dir
+                continue
+            for filename in self._resolve_include(child, base_dir):
+                if filename in self._include_stack:
+                    raise SetupError('Recursive include of {}'.format(filename))
+                root = self._load_included_plan(filename)
+                self._include_stack.append(filename)
+                try:
+                    yield from self._expand_includes(root.children, os.path.dirname(filename))
+                finally:
+                    self._include_stack.pop()
+
+    @staticmethod
+    def _resolve_include(include: tree.Include, base_dir: str) -> List[str]:
+        filenames = []
+        for pattern in include.patterns:
+            pattern = os.path.join(base_dir, os.path.expanduser(pattern))
+            if glob.has_magic(pattern):
+                matches = sorted(glob.glob(pattern))
+                if len(matches) == 0:
+                    raise SetupError('No files match the include pattern {}. {}'.format(pattern, _INCLUDE_HINT))
+                filenames += matches
+            elif os.path.isfile(pattern):
+                filenames += [pattern]
+            else:
+                raise SetupError('The included file {} does not exist. {}'.format(pattern, _INCLUDE_HINT))
+        return [os.path.realpath(f) for f in filenames]
+
+    def _load_included_plan(self, filename: str) -> tree.Category:
+        # Every included file is loaded (and validated) at most once per run
+        try:
+            return self._included_plans[filename]
+        except KeyError:
+            root = self._load_plan_file(filename)
+            self._included_plans[filename] = root
+            return root
+
+    def _load_plan_file(self, filename: str) -> tree.Category:
+        with open(filename, 'rb') as file:
+            content = file.read()
+
+        if self._plan_cache is not None:
+            with self._tracer.span('plan cache lookup', 'config') as args:
+                cache_key = self._plan_cache.key(content)
+                root = self._plan_cache.load(cache_key)
+                args['hit'] = root is not None
+            if root is not None:
+                return root
+
+        with self._tracer.span('parse', 'config', filename=filename):
+            data = loader.load(content, round_trip=self._round_trip)
+
+        if data is None:
+            raise SetupError('No setup configuration found in {}.'.format(filename))
+
+        root = self._compile_plan(data, filename, content)
+
+        if self._plan_cache is not None:
+            self._plan_cache.store(cache_key, root)
+        return root
+
+    def _compile_plan(self, data: Dict, filename: str = None, source=None) -> tree.Category:
         # Support minimal schema without metadata
         if 'setup' not in data:
             data = {'setup': data}
 
-        self._validate_schema(data)
-
-        self._root = self._visit_node('', data['setup'])
-
-    def perform(self, indent: bool = False, verbose: bool = False):
-        self._perform_node(self._root, indent=indent, verbose=verbose)
+        try:
+            self._validate_schema(data, filename)
+        except validation.ValidationError:
+            if self._round_trip or source is None:
+                raise
+            # Plain data carries no source positions. Reload the configuration
+            # with positions to report the issues with their line numbers.
+            data, positions = loader.load_with_positions(source)
+            if 'setup' not in data:
+                data = {'setup': data}
+            self._validate_schema(data, filename, positions)
+            raise
+
+        return self._visit_node('', data['setup'])
+
+    def _perform_action(self, actions: List[tree.Action], path: List[str], indent_level: int = -1,
+                        indent: bool = False, verbose: bool = False):
+        """
+        Perform an action or a group of merged actions of the same plugin
+        """
+        name = actions[0].name
+        if self._concurrent:
+            # Output of concurrently performed actions is interleaved, use full labels
+            label = '/'.join(path + [name])
+            indent_level = 0
+        else:
+            label = name
 
-    def _perform_node(self, node: tree.Category, indent_level: int = -1, indent: bool = False, verbose: bool = False):
-        if node.name != '':
-            log.information(('  ' * indent_level if indent else '') + '{}:'.format(node.name), bold=True)
-        for child in node.children:
-            if isinstance(child, tree.Category):
-                self._perform_node(
-                    node=child,
-                    indent_level=indent_level + 1,
-                    indent=indent,
-                    verbose=verbose
-                )
-            elif isinstance(child, tree.Action):
-                self._perform_action(
-                    action=child,
-                    indent_level=indent_level + 1,
-                    indent=indent,
-                    verbose=verbose
-                )
-
-    def _perform_action(self, action: tree.Action, indent_level: int = -1, indent: bool = False, verbose: bool = False):
-        if action.name not in self._plugins:
-            raise SetupError('Unknown plugin key "{}"'.format(action.name))
-
-        if self._state is not None \
-                and not self._rerun \
-                and self._state.is_done(action):
-            log.regular(('  ' * indent_level if indent else '') + '✓ {}'.format(action.name))
-            self._skipped_count += 1
+        pending_actions = [action for action in actions if not self._is_done(action)]
+        if len(pending_actions) == 0:
+            log.regular(('  ' * indent_level if indent else '') + '✓ {}'.format(label))
+            with self._lock:
+                self._skipped_count += len(actions)
             return
 
-        plugin_cls = self._plugins[action.name]
-        plugins_inst = plugin_cls(
-            config=action.body,
-            data_path=self._data_path,
-            verbose=verbose
-        )
-        _track_progress((indent_level if indent else 0), action.name, plugins_inst.perform)
-
-        if self._state is not None:
-            self._state.mark_done(action)
+        plugin_cls = self._plugins[name]
+        if len(pending_actions) == 1:
+            body = pending_actions[0].body
+        else:
+            body = plugin_cls.coalesce([action.body for action in pending_actions])
+            label += ' (merged {} actions)'.format(len(pending_actions))
+        full_label = '/'.join(path + [name])
+        if plugin_cls.barrier and not issubclass(plugin_cls, builtin_plugins.APT_INDEX_PLUGINS):
+            # Scripts and custom plugins may install packages from added PPAs with apt-get
+            self._update_index(path, indent_level, indent, verbose)
+        with self._tracer.span(full_label, 'action', path=path, actions=len(pending_actions)):
+            entry = self._progress.start(label, indent_level if indent else 0)
+            action_metrics = metrics.ActionMetrics(full_label, name, self._tracer if self._tracer.enabled else None,
+                                                   functools.partial(self._progress.update, entry))
+            plugins_inst = plugin_cls(
+                config=body,
+                data_path=self._data_path,
+                verbose=verbose,
+                log_path=self._run_log.log_path(full_label),
+                observer=action_metrics
+            )
+            started = time.time()
+            action_metrics.start()
+            try:
+                plugins_inst.perform()
+            except Exception as e:
+                self._progress.finish(entry, success=False)
+                self._record_runs(pending_actions, full_label, started, time.time() - started,
+                                  '{}: {}'.format(type(e).__name__, e))
+                raise
+            finally:
+                action_metrics.stop()
+                self._metrics.add(action_metrics)
+            self._progress.finish(entry)
+            self._record_runs(pending_actions, full_label, started, action_metrics.wall_time)
+
+            if self._state is not None:
+                with self._tracer.span('save state', 'state'):
+                    for action in pending_actions:
+                        self._state.mark_done(action)
+                        if self._drifted:
+                            with self._lock:
+                                self._drifted.discard(state.action_hash(action))
+
+    def _update_index(self, path: List[str], indent_level: int = 0, indent: bool = False, verbose: bool = False):
+        """
+        Update the package index if the apt sources changed, with a log file and progress entry of its own
+        """
+        if not apt.index_outdated():
+            return
+        full_label = '/'.join(path + [_INDEX_UPDATE_LABEL])
+        label = full_label if self._concurrent else _INDEX_UPDATE_LABEL
+        with self._tracer.span(full_label, 'action', path=path, actions=0):
+            entry = self._progress.start(label, indent_level if indent else 0)
+            index_metrics = metrics.ActionMetrics(full_label, builtin_plugins.AptPackagesPlugin.key,
+                                                  self._tracer if self._tracer.enabled else None,
+                                                  functools.partial(self._progress.update, entry))
+            updater = builtin_plugins.AptPackagesPlugin(
+                config=[],
+                data_path=self._data_path,
+                verbose=verbose,
+                log_path=self._run_log.log_path(full_label),
+                observer=index_metrics
+            )
+            index_metrics.start()
+            try:
+                apt.update_index(updater)
+            except Exception:
+                self._progress.finish(entry, success=False)
+                raise
+            finally:
+                index_metrics.stop()
+                self._metrics.add(index_metrics)
+            self._progress.finish(entry)
+
+    def _record_runs(self, actions: List[tree.Action], path: str, started: float, duration: float,
+                     error: str = None):
+        if self._state is None:
+            return
+        with self._tracer.span('record runs', 'state'):
+            for action in actions:
+                self._state.record_run(action, path, started, duration, error)
 
     def _load_custom_plugins(self) -> List[Type[plugins.AbstractPlugin]]:
         plugins_list = []
@@ -171,35 +627,34 @@ class Setup:
         return plugins_list
 
     def _set_plugins(self, plugins_list: List[Type[plugins.AbstractPlugin]]):
-        self._action_schema = {}
         self._plugins = {}
         for plugin in plugins_list:
             if plugin.key in self._plugins:
                 raise SetupError('Duplicate plugin key {}'.format(plugin.key))
+            if plugin.key in validation.DIRECTIVES:
+                raise SetupError('Reserved plugin key {}'.format(plugin.key))
             self._plugins[plugin.key] = plugin
-            self._action_schema[schema.Optional('$' + plugin.key)] = plugin.schema
-        self._category_schema = {
-            # Recursive validation of child categories (may not start with '$')
-            schema.Optional(lambda key: type(key) == str and not key.startswith('$')):
-                lambda value: schema.Schema(self._category_schema).validate(value),
-            # Validation of child actions (must start with '$')
-            **self._action_schema,
-        }
-        self._schema_root = {
-            **_OPTIONAL_META_SCHEMA,
-            'setup': self._category_schema
-        }
-
-    def _validate_schema(self, data):
-        s = schema.Schema(self._schema_root)
-        s.validate(data)
+        # Plugin schemata are compiled once per plugin set
+        self._validator = validation.TreeValidator(plugins_list)
+
+    def _validate_schema(self, data, filename: str = None, positions: loader.PositionIndex = None):
+        with self._tracer.span('validate', 'config', filename=filename):
+            self._validator.validate(data, filename, positions)
 
     def _visit_node(self, node_name: str, node_content: Dict):
         children = []
+        parallel = False
+        depends_on = []
 
         for child_key in node_content.keys():
             child_value = node_content[child_key]
-            if child_key.startswith('$'):
+            if child_key == '$' + validation.INCLUDE_DIRECTIVE:
+                children += [tree.Include(_names(child_value))]
+            elif child_key == '$' + validation.PARALLEL_DIRECTIVE:
+                parallel = child_value
+            elif child_key == '$' + validation.DEPENDS_ON_DIRECTIVE:
+                depends_on = _names(child_value)
+            elif child_key.startswith('$'):
                 children += [
                     self._visit_action(
                         child_key[1:],
@@ -213,7 +668,9 @@ class Setup:
                         child_value,
                     )
                 ]
-        return tree.Category(node_name, children)
+        return tree.Category(node_name, children, parallel, depends_on)
 
     def _visit_action(self, action_key: str, action_contents):
+        if self._round_trip:
+            action_contents = _plain(action_contents)
         return tree.Action(action_key, action_contents)
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+from typing import Dict, Optional
+
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import tempfile
+import requests
+
+from . import plugins
+
+
+DOWNLOAD_CACHE_DIR = os.path.expanduser('~/.cache/ubup/downloads')
+
+# Total size in bytes of the downloads to keep, the least recently used ones are removed first
+_MAX_SIZE = 2 * 1024 ** 3
+# Time in seconds a cached download is used without asking the server whether it changed
+_MAX_AGE = 24 * 3600.0
+
+_CHUNK_SIZE = 64 * 1024
+# ioctl cloning a file on file systems supporting copy-on-write (e.g. Btrfs or XFS)
+_FICLONE = 0x40049409
+
+
+def _file_digest(path: str) -> Optional[str]:
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(_CHUNK_SIZE), b''):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def _create_temp(directory: str, prefix: str):
+    # Unlike tempfile.mkstemp, this creates the file with the default permissions
+    while True:
+        path = os.path.join(directory, prefix + os.urandom(8).hex())
+        try:
+            return open(path, 'xb'), path
+        except FileExistsError:
+            pass
+
+
+def _link_or_copy(source: str, target: str):
+    # Share the data of the cached file if the file system allows it.
+    # The target is replaced atomically, so a hard linked cached file is never overwritten.
+    file, temp_path = _create_temp(os.path.dirname(os.path.abspath(target)), '.download_')
+    try:
+        with open(source, 'rb') as src, file:
+            try:
+                fcntl.ioctl(file.fileno(), _FICLONE, src.fileno())
+                cloned = True
+            except OSError:
+                cloned = False
+        if not cloned:
+            os.unlink(temp_path)
+            try:
+                # The cache notices changes of hard linked files by their modification time
+                os.link(source, temp_path)
+            except OSError:
+                shutil.copyfile(source, temp_path)
+        os.replace(temp_path, target)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class DownloadCache:
+    """
+    Persistent cache of downloaded files.
+
+    Files are stored by the SHA-256 digest of their content, so a file offered
+    at several URLs is only stored once. For each URL, the digest and the
+    validators sent by the server (ETag and Last-Modified) are recorded, so a
+    file is only downloaded again if it changed.
+    """
+
+    def __init__(self, cache_dir: str = None, max_size: int = _MAX_SIZE, max_age: float = _MAX_AGE):
+        """
+        :param cache_dir: Directory to store downloads in
+        :param max_size: Total size in bytes of the downloads to keep
+        :param max_age: Time in seconds a download is used without revalidating it
+        """
+        self._cache_dir = cache_dir or DOWNLOAD_CACHE_DIR
+        self._max_size = max_size
+        self._max_age = max_age
+
+    def fetch(self, url: str, observer: Optional[plugins.CommandObserver] = None,
+              headers: Optional[Dict[str, str]] = None) -> str:
+        """
+        Download a file unless it is cached already
+        :param url: URL of the file
+        :param observer: Observer to report the number of downloaded bytes to
+        :param headers: Additional HTTP headers
+        :return: Path of the cached file, which must not be modified
+        """
+        entry = self._load_entry(url)
+        if entry is not None and time.time() - entry['checked'] < self._max_age:
+            return self._use(entry)
+
+        request_headers = dict(headers or {})
+        if entry is not None:
+            if entry.get('etag'):
+                request_headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                request_headers['If-Modified-Since'] = entry['last_modified']
+        with requests.get(url, headers=request_headers, stream=True) as response:
+            if response.status_code == 304 and entry is not None:
+                entry['checked'] = time.time()
+                self._store_entry(url, entry)
+                return self._use(entry)
+            response.raise_for_status()
+            os.makedirs(self._object_dir, exist_ok=True)
+            file, temp_path = _create_temp(self._object_dir, '.download_')
+            try:
+                # Hash while streaming, so the file is read only once
+                digest = hashlib.sha256()
+                size = 0
+                with file:
+                    for chunk in response.iter_content(_CHUNK_SIZE):
+                        file.write(chunk)
+                        digest.update(chunk)
+                        size += len(chunk)
+                path = self._object_path(digest.hexdigest())
+                if _file_digest(path) == digest.hexdigest():
+                    # Keep the file other URLs with the same content refer to
+                    os.unlink(temp_path)
+                else:
+                    os.replace(temp_path, path)
+            except BaseException:
+                try:
+                    os.unlink(temp_path)
+                except OSError:
+                    pass
+                raise
+        if observer is not None:
+            observer.downloaded(size)
+        stat = os.stat(path)
+        entry = {
+            'url': url,
+            'digest': digest.hexdigest(),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'checked': time.time(),
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+        }
+        self._store_entry(url, entry)
+        self._prune()
+        return path
+
+    def download(self, url: str, target: str, observer: Optional[plugins.CommandObserver] = None,
+                 headers: Optional[Dict[str, str]] = None):
+        """
+        Download a file to a path, using the cached file if possible.
+        The target shares the data of the cached file (via reflinks or hard links) if possible.
+        :param url: URL of the file
+        :param target: Path to store the file at
+        :param observer: Observer to report the number of downloaded bytes to
+        :param headers: Additional HTTP headers
+        """
+        path = self.fetch(url, observer, headers)
+        if os.path.isfile(target) and os.path.samefile(path, target):
+            return
+        _link_or_copy(path, target)
+
+    @property
+    def _object_dir(self) -> str:
+        return os.path.join(self._cache_dir, 'objects')
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self._object_dir, digest)
+
+    def _entry_path(self, url: str) -> str:
+        return os.path.join(self._cache_dir, 'urls', hashlib.sha256(url.encode()).hexdigest() + '.json')
+
+    def _load_entry(self, url: str) -> Optional[Dict]:
+        try:
+            with open(self._entry_path(url)) as file:
+                entry = json.load(file)
+            stat = os.stat(self._object_path(entry['digest']))
+        except (OSError, ValueError, KeyError):
+            return None
+        # A changed file (e.g. modified through a hard link) is no longer the downloaded one
+        if entry.get('url') != url or stat.st_size != entry['size'] or stat.st_mtime_ns != entry['mtime_ns']:
+            return None
+        return entry
+
+    def _store_entry(self, url: str, entry: Dict):
+        path = self._entry_path(url)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(prefix='.entry_', dir=os.path.dirname(path))
+        except OSError:
+            # Without the entry, the file is only downloaded again next time
+            return
+        try:
+            with os.fdopen(fd, 'w') as file:
+                json.dump(entry, file)
+            os.replace(temp_path, path)
+        except OSError:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+
+    def _use(self, entry: Dict) -> str:
+        path = self._object_path(entry['digest'])
+        try:
+            # The access time records the last use, the modification time stays untouched
+            os.utime(path, ns=(int(time.time() * 1e9), entry['mtime_ns']))
+        except OSError:
+            pass
+        return path
+
+    def _prune(self):
+        objects = []
+        for name in os.listdir(self._object_dir):
+            if name.startswith('.'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self._object_dir, name))
+            except FileNotFoundError:
+                continue
+            objects.append((stat.st_atime_ns, stat.st_size, name))
+        objects.sort(reverse=True)
+        total = 0
+        for i, (_, size, name) in enumerate(objects):
+            total += size
+            # Always keep the most recently used file
+            if i > 0 and total > self._max_size:
+                try:
+                    os.unlink(os.path.join(self._object_dir, name))
+                except FileNotFoundError:
+                    pass
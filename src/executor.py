@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+from typing import Callable, Iterable, List
+
+import heapq
+import concurrent.futures
+
+
+class Task:
+    """
+    A unit of work in the dependency graph of an Executor
+    """
+    __slots__ = ('function', 'inline', 'dependents', 'waiting', 'index')
+
+    def __init__(self, function: Callable, inline: bool, index: int):
+        self.function = function
+        self.inline = inline
+        self.dependents = []
+        self.waiting = 0
+        self.index = index
+
+    def __lt__(self, other: 'Task') -> bool:
+        return self.index < other.index
+
+
+class Executor:
+    """
+    Runs a graph of tasks on a bounded pool of worker threads.
+
+    A task becomes ready once all of its dependencies are complete. Ready tasks
+    are started in the order they were added, so a graph in which every task
+    depends on its predecessor runs strictly sequentially.
+    Inline tasks (e.g. log output) run on the calling thread and never occupy a worker.
+    """
+
+    def __init__(self, jobs: int = 1):
+        """
+        :param jobs: Maximum number of tasks running concurrently
+        """
+        self._jobs = max(1, jobs)
+        self._tasks = []
+
+    def add(self, function: Callable = None, dependencies: Iterable[Task] = (), inline: bool = False) -> Task:
+        """
+        Add a task to the graph
+        :param function: Function to run or None for a task that only synchronizes its dependencies
+        :param dependencies: Tasks that need to complete before this task starts
+        :param inline: Whether to run the task on the thread calling run()
+        :return: The new task
+        """
+        task = Task(function, inline or function is None, len(self._tasks))
+        for dependency in dependencies:
+            dependency.dependents.append(task)
+            task.waiting += 1
+        self._tasks.append(task)
+        return task
+
+    def join(self, tasks: List[Task]) -> List[Task]:
+        """
+        Reduce a set of tasks to a single task completing once all of them are complete.
+        Depending on the result instead of the individual tasks keeps the number of edges
+        in the graph linear when many tasks depend on many others.
+        :param tasks: Tasks to join
+        :return: List containing the joining task (or the original list if it has less than two items)
+        """
+        if len(tasks) < 2:
+            return tasks
+        return [self.add(dependencies=tasks)]
+
+    def run(self):
+        """
+        Run all tasks. If a task fails, no further tasks are started and
+        the first error is raised once all running tasks are complete.
+        """
+        ready = [task for task in self._tasks if task.waiting == 0]
+        heapq.heapify(ready)
+        running = {}
+        errors = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._jobs) as pool:
+            while (ready and not errors) or running:
+                while ready and not errors:
+                    if ready[0].inline:
+                        task = heapq.heappop(ready)
+                        try:
+                            if task.function is not None:
+                                task.function()
+                        except Exception as e:
+                            errors.append(e)
+                            break
+                        self._complete(task, ready)
+                    elif len(running) < self._jobs:
+                        task = heapq.heappop(ready)
+                        running[pool.submit(task.function)] = task
+                    else:
+                        break
+                if not running:
+                    continue
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        errors.append(error)
+                    else:
+                        self._complete(task, ready)
+        if errors:
+            raise errors[0]
+
+    @staticmethod
+    def _complete(task: Task, ready: List[Task]):
+        for dependent in task.dependents:
+            dependent.waiting -= 1
+            if dependent.waiting == 0:
+                heapq.heappush(ready, dependent)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+from typing import Any, Tuple
+
+import sys
+import collections
+import ruamel.yaml as yaml
+from ruamel.yaml import constructor
+from ruamel.yaml import nodes
+
+# Whether plain dicts keep the insertion order (guaranteed since Python 3.7).
+# The order of categories and actions is the order they are performed in.
+DICTS_ARE_ORDERED = sys.version_info >= (3, 7)
+
+
+def mapping_type() -> type:
+    """
+    :return: Type of plain mappings keeping the order of their keys
+    """
+    return dict if DICTS_ARE_ORDERED else collections.OrderedDict
+
+
+class _OrderedSafeConstructor(constructor.SafeConstructor):
+    # Safe constructor building mappings that keep the order of the document
+    def construct_yaml_map(self, node):
+        data = collections.OrderedDict()
+        yield data
+        # Let the base class check and merge the keys, then restore their order
+        value = self.construct_mapping(node)
+        for key_node, _ in node.value:
+            key = self.construct_object(key_node, deep=True)
+            if isinstance(key, list):
+                key = tuple(key)
+            if key in value and key not in data:
+                data[key] = value[key]
+
+
+_OrderedSafeConstructor.add_constructor('tag:yaml.org,2002:map', _OrderedSafeConstructor.construct_yaml_map)
+
+
+def _safe_yaml() -> yaml.YAML:
+    y = yaml.YAML(typ='safe')
+    if not DICTS_ARE_ORDERED:
+        y.Constructor = _OrderedSafeConstructor
+    return y
+
+
+def load(content, round_trip: bool = False) -> Any:
+    """
+    Load a YAML document
+    :param content: YAML document
+    :param round_trip: Whether to use the ruamel.yaml round-trip loader which keeps comments
+                       and source positions of every node. By default, the (C-accelerated if
+                       available) safe loader is used to produce plain Python types.
+    :return: Loaded data
+    """
+    if round_trip:
+        return yaml.YAML().load(content)
+    return _safe_yaml().load(content)
+
+
+class PositionIndex:
+    """
+    Source lines of the keys and items of plain Python containers
+
+    Containers are identified by their id(), so the index is only valid
+    for as long as the data it was built for is alive.
+    """
+    __slots__ = ('_lines',)
+
+    def __init__(self):
+        self._lines = {}
+
+    def add(self, container, lines):
+        self._lines[id(container)] = lines
+
+    def line_of(self, container, key, default: int) -> int:
+        lines = self._lines.get(id(container))
+        if lines is None:
+            return default
+        if isinstance(lines, dict):
+            return lines.get(key if isinstance(key, str) else str(key), default)
+        try:
+            return lines[key]
+        except (IndexError, TypeError):
+            return default
+
+
+def load_with_positions(content) -> Tuple[Any, PositionIndex]:
+    """
+    Load a YAML document using the safe loader and additionally collect
+    the source lines of all keys and items. This is considerably more
+    expensive than load() and only meant to be used for error reporting.
+    :param content: YAML document
+    :return: Tuple of the loaded data and its position index
+    """
+    y = _safe_yaml()
+    node = y.compose(content)
+    if node is None:
+        return None, PositionIndex()
+    data = y.constructor.construct_document(node)
+    index = PositionIndex()
+    stack = [(node, data)]
+    while stack:
+        node, value = stack.pop()
+        if isinstance(node, nodes.MappingNode) and isinstance(value, dict):
+            # Merge keys break the correspondence between nodes and data
+            if len(node.value) != len(value):
+                continue
+            lines = {}
+            for (key_node, value_node), (key, child) in zip(node.value, value.items()):
+                lines[str(key_node.value)] = key_node.start_mark.line + 1
+                stack.append((value_node, child))
+            index.add(value, lines)
+        elif isinstance(node, nodes.SequenceNode) and isinstance(value, list):
+            index.add(value, [item.start_mark.line + 1 for item in node.value])
+            stack += zip(node.value, value)
+    return data, index
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+from typing import List
+
+import os
+import sys
+import json
+
+from . import config
+from . import log
+
+
+def perform(setup_filename: str, rerun: bool=False, no_cache: bool=False, as_json: bool=False,
+            exit_code: bool=False, verify: bool=False):
+    config_dir = os.path.dirname(setup_filename)
+
+    setup = config.Setup(config_dir, rerun)
+    setup.load_plugins()
+    setup.load_config_file(setup_filename, use_cache=not no_cache)
+
+    planned = setup.plan(verify=verify)
+    pending = [p for p in planned if p.status == config.PlannedAction.PENDING]
+
+    if as_json:
+        _print_json(planned)
+    else:
+        _print_plan(planned)
+
+    if exit_code and len(pending) > 0:
+        sys.exit(1)
+
+
+def _label(planned: config.PlannedAction) -> str:
+    return '/'.join(planned.path + ['$' + planned.action.name])
+
+
+def _format_duration(seconds: float) -> str:
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return '{} s'.format(seconds)
+    if seconds < 3600:
+        return '{} min {} s'.format(seconds // 60, seconds % 60)
+    return '{} h {} min'.format(seconds // 3600, seconds % 3600 // 60)
+
+
+def _print_plan(planned: List[config.PlannedAction]):
+    log.information('📋 Setup plan', bold=True)
+    for p in planned:
+        if p.status == config.PlannedAction.DONE:
+            log.regular('  ✓ {} (already performed)'.format(_label(p)))
+        elif p.status == config.PlannedAction.SATISFIED:
+            log.regular('  = {} (already satisfied)'.format(_label(p)))
+        elif p.steps is None:
+            log.warning('  + {} (~{})'.format(_label(p), _format_duration(p.estimated_duration)))
+        else:
+            log.warning('  + {}: {} (~{})'.format(_label(p), ', '.join(p.steps),
+                                                  _format_duration(p.estimated_duration)))
+
+    pending = [p for p in planned if p.status == config.PlannedAction.PENDING]
+    if len(pending) == 0:
+        log.success('✓ Nothing to do.', bold=True)
+    else:
+        log.warning('{} of {} actions pending, estimated duration: {}'.format(
+            len(pending), len(planned), _format_duration(sum(p.estimated_duration for p in pending))
+        ), bold=True)
+
+
+def _print_json(planned: List[config.PlannedAction]):
+    json.dump({
+        'actions': [
+            {
+                'path': p.path,
+                'action': p.action.name,
+                'status': p.status,
+                'steps': p.steps,
+                'estimated_duration': p.estimated_duration,
+            }
+            for p in planned
+        ],
+        'estimated_duration': sum(p.estimated_duration for p in planned if p.status == config.PlannedAction.PENDING),
+    }, sys.stdout, indent=2)
+    print()
@@ -9,16 +9,21 @@ import time
 import threading
 import simpleflock
 
+from . import apt
 from . import config
 from . import log
+from . import trace
 
 
 LOCK_FILE_DIR = os.path.expanduser('~/.cache/ubup')
 LOCK_FILE_PATH = '{}/lock'.format(LOCK_FILE_DIR)
 
 
-def perform(setup_filename: str, no_roots: bool=False, verbose: bool=False, rerun: bool=False):
+def perform(setup_filename: str, no_roots: bool=False, verbose: bool=False, rerun: bool=False,
+            no_cache: bool=False, jobs: int=4, trace_file: str=None, metrics_file: str=None,
+            verify: bool=False, lock_timeout: float=600.0):
     _require_root()
+    apt.lock_timeout = lock_timeout
 
     os.makedirs(LOCK_FILE_DIR, exist_ok=True)
 
@@ -34,21 +39,44 @@ def perform(setup_filename: str, no_roots: bool=False, verbose: bool=False, reru
 
             log.success('🚀 Performing your setup.', bold=True)
 
-            setup = config.Setup(config_dir, rerun)
-            setup.load_plugins()
-            setup.load_config_file(setup_filename)
-
-            setup.perform(indent=not (no_roots or verbose), verbose=verbose)
-
-            if setup.skipped_steps_count > 0:
-                if setup.skipped_steps_count == 1:
-                    log.warning('1 step was skipped because it was already run.')
-                else:
-                    log.warning(
-                        '{} steps were skipped because they were already run.'.format(setup.skipped_steps_count))
-                log.regular('Run with --rerun to run all steps even if they were already run.')
-
-            log.success('✓ Setup completed.', bold=True)
+            tracer = trace.Tracer() if trace_file is not None else None
+            setup = config.Setup(config_dir, rerun, tracer=tracer)
+            try:
+                setup.load_plugins()
+                setup.load_config_file(setup_filename, use_cache=not no_cache)
+
+                setup.perform(indent=not (no_roots or verbose), verbose=verbose, jobs=jobs, verify=verify)
+
+                setup.metrics.print_summary()
+
+                if setup.drifted_steps_count > 0:
+                    log.warning('{} already run steps were no longer in effect and were run again.'.format(
+                        setup.drifted_steps_count))
+
+                if setup.coalesced_steps_count > 0:
+                    log.information('{} steps were merged into preceding steps, saving as many package manager '
+                                    'transactions.'.format(setup.coalesced_steps_count))
+
+                if setup.skipped_steps_count > 0:
+                    if setup.skipped_steps_count == 1:
+                        log.warning('1 step was skipped because it was already run.')
+                    else:
+                        log.warning(
+                            '{} steps were skipped because they were already run.'.format(setup.skipped_steps_count))
+                    log.regular('Run with --verify to run steps again which are no longer in effect '
+                                'or with --rerun to run all steps even if they were already run.')
+
+                if setup.log_dir is not None:
+                    log.regular('Command output was logged to {}.'.format(setup.log_dir))
+
+                log.success('✓ Setup completed.', bold=True)
+            finally:
+                if metrics_file is not None:
+                    setup.metrics.write_json(metrics_file)
+                    log.regular('Metrics were written to {}.'.format(metrics_file))
+                if tracer is not None:
+                    tracer.write(trace_file)
+                    log.regular('Trace was written to {}.'.format(trace_file))
     except BlockingIOError:
         log.error('Another ubup process seems to be running.')
         log.error('Please wait for the other process to complete.')
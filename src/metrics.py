@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+from typing import Callable, Dict, List, Optional
+
+import json
+import time
+import resource
+import threading
+
+from . import log
+from . import plugins
+
+
+def _thread_cpu_time() -> float:
+    # Like time.thread_time(), which requires Python 3.7
+    usage = resource.getrusage(resource.RUSAGE_THREAD)
+    return usage.ru_utime + usage.ru_stime
+
+
+class ActionMetrics(plugins.CommandObserver):
+    """
+    Resources used by an action.
+
+    Child resource usage only covers commands run with run_command(),
+    asynchronous commands are reaped by the event loop.
+    """
+
+    def __init__(self, label: str, plugin: str, delegate: Optional[plugins.CommandObserver] = None,
+                 display: Optional[Callable] = None):
+        """
+        :param label: Label of the action
+        :param plugin: Key of the plugin performing the action
+        :param delegate: Observer to forward notifications about commands to
+        :param display: Function to forward progress notifications to, with the arguments of progress()
+        """
+        self.label = label
+        self.plugin = plugin
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.child_user_time = 0.0
+        self.child_system_time = 0.0
+        # Maximum resident set size of all commands in KiB
+        self.child_max_rss = 0
+        self.commands = 0
+        self.bytes_downloaded = 0
+        # Start and end times of the phases reported by the plugin
+        self._phases = {}
+        self._delegate = delegate
+        self._display = display
+        self._lock = threading.Lock()
+        self._wall_start = None
+        self._cpu_start = None
+
+    def start(self):
+        """
+        Start measuring on the thread performing the action
+        """
+        self._wall_start = time.perf_counter()
+        self._cpu_start = _thread_cpu_time()
+
+    def stop(self):
+        """
+        Stop measuring on the thread performing the action
+        """
+        self.wall_time = time.perf_counter() - self._wall_start
+        self.cpu_time = _thread_cpu_time() - self._cpu_start
+
+    def command_started(self, command: str, asynchronous: bool):
+        return self._delegate.command_started(command, asynchronous) if self._delegate is not None else None
+
+    def command_finished(self, token, return_code: Optional[int], rusage=None):
+        with self._lock:
+            self.commands += 1
+            if rusage is not None:
+                self.child_user_time += rusage.ru_utime
+                self.child_system_time += rusage.ru_stime
+                self.child_max_rss = max(self.child_max_rss, rusage.ru_maxrss)
+        if self._delegate is not None:
+            self._delegate.command_finished(token, return_code, rusage)
+
+    def downloaded(self, size: int):
+        with self._lock:
+            self.bytes_downloaded += size
+        if self._delegate is not None:
+            self._delegate.downloaded(size)
+
+    def progress(self, phase: str, fraction: float, rate: Optional[float] = None, eta: Optional[float] = None):
+        now = time.perf_counter()
+        with self._lock:
+            self._phases.setdefault(phase, [now, now])[1] = now
+        if self._delegate is not None:
+            self._delegate.progress(phase, fraction, rate, eta)
+        if self._display is not None:
+            self._display(phase, fraction, rate, eta)
+
+    @property
+    def phases(self) -> Dict[str, float]:
+        """
+        Durations in seconds of the phases reported by the plugin (e.g. downloading and installing)
+        """
+        with self._lock:
+            return {phase: end - start for phase, (start, end) in self._phases.items()}
+
+    def as_dict(self) -> Dict:
+        return {
+            'action': self.label,
+            'plugin': self.plugin,
+            'wall_time': self.wall_time,
+            'cpu_time': self.cpu_time,
+            'child_user_time': self.child_user_time,
+            'child_system_time': self.child_system_time,
+            'child_max_rss_kib': self.child_max_rss,
+            'commands': self.commands,
+            'bytes_downloaded': self.bytes_downloaded,
+            'phases': self.phases,
+        }
+
+
+class Metrics:
+    """
+    Resources used by all actions performed in a run
+    """
+
+    def __init__(self):
+        self._actions = []
+        self._lock = threading.Lock()
+
+    def add(self, metrics: ActionMetrics):
+        with self._lock:
+            self._actions.append(metrics)
+
+    @property
+    def actions(self) -> List[ActionMetrics]:
+        with self._lock:
+            return list(self._actions)
+
+    def write_json(self, filename: str):
+        """
+        Write the metrics of all actions to a JSON file
+        :param filename: Path of the file
+        """
+        with open(filename, 'w') as file:
+            json.dump({'actions': [m.as_dict() for m in self.actions]}, file, indent=2)
+            file.write('\n')
+
+    def print_summary(self):
+        """
+        Print a table of the metrics of all actions
+        """
+        actions = self.actions
+        if len(actions) == 0:
+            return
+        rows = [('Action', 'Wall', 'CPU', 'Child user', 'Child sys', 'Peak RSS', 'Downloaded')]
+        for m in actions:
+            rows.append((m.label, _format_seconds(m.wall_time), _format_seconds(m.cpu_time),
+                         _format_seconds(m.child_user_time), _format_seconds(m.child_system_time),
+                         _format_size(m.child_max_rss * 1024), _format_size(m.bytes_downloaded)))
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        for i, row in enumerate(rows):
+            line = '  '.join([row[0].ljust(widths[0])] + [c.rjust(w) for c, w in zip(row[1:], widths[1:])])
+            if i == 0:
+                log.information(line, bold=True)
+            else:
+                log.regular(line)
+
+
+def _format_seconds(seconds: float) -> str:
+    return '{:.1f} s'.format(seconds)
+
+
+def _format_size(size: int) -> str:
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return '{:.0f} {}'.format(size, unit) if unit == 'B' else '{:.1f} {}'.format(size, unit)
+        size /= 1024
+    return '{:.1f} GiB'.format(size)
@@ -11,7 +11,37 @@ def setup_options(func):
                   help='Enable verbose output. Disables tree-like output.')
     @click.option('--remote', default=None, help='Remote host to connect to via SSH (e.g. hostname or user@hostname)')
     @click.option('--rerun', default=False, is_flag=True, help='Rerun all steps even if they were already run')
+    @click.option('--no-cache', default=False, is_flag=True,
+                  help='Do not use cached setup plans and parse the configuration from scratch.')
     @click.option('--no-roots', default=False, is_flag=True, help='Disable tree-like progress output.')
+    @click.option('--verify', default=False, is_flag=True,
+                  help='Check whether already run steps are still in effect and run them again otherwise.')
+    @click.option('-j', '--jobs', default=4, type=click.IntRange(min=1),
+                  help='Maximum number of actions to perform concurrently in parallel categories.')
+    @click.option('--lock-timeout', default=600.0, type=click.FloatRange(min=0),
+                  help='Maximum number of seconds to wait for other package managers to release their locks.')
+    @click.option('--trace', 'trace_file', default=None,
+                  type=click.Path(dir_okay=False, writable=True, resolve_path=True),
+                  help='Record a timeline of the setup in Chrome trace event format to the given file.')
+    @click.option('--metrics', 'metrics_file', default=None,
+                  type=click.Path(dir_okay=False, writable=True, resolve_path=True),
+                  help='Write the resources used by each action as JSON to the given file.')
+    def wrapper(*args, **kwargs):
+        return func(*args, **kwargs)
+    return wrapper
+
+
+def plan_options(func):
+    @click.option('-p', '--path', default=os.getcwd(), type=click.Path(exists=True, resolve_path=True),
+                  help='Path to folder or setup.yaml file')
+    @click.option('--rerun', default=False, is_flag=True, help='Plan all steps even if they were already run')
+    @click.option('--no-cache', default=False, is_flag=True,
+                  help='Do not use cached setup plans and parse the configuration from scratch.')
+    @click.option('--verify', default=False, is_flag=True,
+                  help='Check whether already run steps are still in effect.')
+    @click.option('--json', 'as_json', default=False, is_flag=True, help='Print the plan as JSON.')
+    @click.option('--exit-code', default=False, is_flag=True,
+                  help='Exit with status 1 if any actions are pending.')
     def wrapper(*args, **kwargs):
         return func(*args, **kwargs)
     return wrapper
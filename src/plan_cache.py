@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+from typing import Iterable, Optional, Type
+
+import os
+import sys
+import glob
+import pickle
+import hashlib
+import inspect
+import tempfile
+
+from . import plugins
+from . import tree
+
+
+PLAN_CACHE_DIR = os.path.expanduser('~/.cache/ubup/plans')
+
+# Bump whenever the layout of tree nodes or of the cache entries changes
+_FORMAT_VERSION = 3
+# Number of cached plans to keep around
+_MAX_ENTRIES = 64
+# Modules parsing, validating and building plans
+_COMPILER_MODULES = ('config', 'loader', 'plan_cache', 'tree', 'validation')
+
+_source_digests = {}
+
+
+def _file_digest(filename: str) -> str:
+    try:
+        return _source_digests[filename]
+    except KeyError:
+        pass
+    with open(filename, 'rb') as file:
+        digest = hashlib.sha256(file.read()).hexdigest()
+    _source_digests[filename] = digest
+    return digest
+
+
+def _executable_fingerprint() -> str:
+    # Running in a bundle created by PyInstaller, sources of
+    # built-in modules are not available. Use the bundle instead.
+    stat = os.stat(sys.executable)
+    return '{}:{}:{}'.format(sys.executable, stat.st_size, stat.st_mtime_ns)
+
+
+def _plugin_fingerprint(plugin: Type[plugins.AbstractPlugin]) -> str:
+    """
+    Identify a plugin implementation. Any change to the source file
+    defining the plugin invalidates all plans compiled with it.
+    """
+    try:
+        source = _file_digest(inspect.getsourcefile(plugin))
+    except (TypeError, OSError):
+        source = _executable_fingerprint()
+    return '{}={}.{}@{}'.format(plugin.key, plugin.__module__, plugin.__qualname__, source)
+
+
+def _compiler_fingerprint() -> str:
+    """
+    Identify the implementation of compiling plans. Any change to the
+    modules parsing, validating or building plans invalidates all plans.
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        return ','.join(_file_digest(os.path.join(directory, name + '.py')) for name in _COMPILER_MODULES)
+    except OSError:
+        return _executable_fingerprint()
+
+
+class PlanCache:
+    """
+    Persistent cache of parsed and validated setup plans keyed by content
+    """
+
+    def __init__(self, plugins_list: Iterable[Type[plugins.AbstractPlugin]],
+                 cache_dir: str = None, max_entries: int = _MAX_ENTRIES):
+        """
+        :param plugins_list: Plugins the cached plans are validated against
+        :param cache_dir: Directory to store cached plans in
+        :param max_entries: Number of plans to keep
+        """
+        self._cache_dir = cache_dir or PLAN_CACHE_DIR
+        self._max_entries = max_entries
+        self._plugins_hash = hashlib.sha256()
+        self._plugins_hash.update('ubup-plan-v{}\0'.format(_FORMAT_VERSION).encode())
+        self._plugins_hash.update(_compiler_fingerprint().encode() + b'\0')
+        for fingerprint in sorted(_plugin_fingerprint(p) for p in plugins_list):
+            self._plugins_hash.update(fingerprint.encode() + b'\0')
+
+    def key(self, config: bytes) -> str:
+        """
+        Compute the cache key of a plan
+        :param config: Raw contents of the configuration file
+        :return: Cache key
+        """
+        h = self._plugins_hash.copy()
+        h.update(config)
+        return h.hexdigest()
+
+    def load(self, key: str) -> Optional[tree.Category]:
+        """
+        Load a cached plan
+        :param key: Cache key
+        :return: Root category of the plan or None if the plan is not cached
+        """
+        try:
+            with open(self._path(key), 'rb') as file:
+                version, root = pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Treat unreadable or truncated entries as a cache miss
+            return None
+        if version != _FORMAT_VERSION or not isinstance(root, tree.Category):
+            return None
+        try:
+            # Keep recently used plans from being pruned
+            os.utime(self._path(key))
+        except OSError:
+            pass
+        return root
+
+    def store(self, key: str, root: tree.Category):
+        """
+        Store a plan in the cache
+        :param key: Cache key
+        :param root: Root category of the plan
+        """
+        try:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(prefix='.plan_', dir=self._cache_dir)
+        except OSError:
+            # The cache is an optimization only
+            return
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump((_FORMAT_VERSION, root), file, protocol=pickle.HIGHEST_PROTOCOL)
+            # Atomically publish the entry so concurrent readers
+            # never observe a partially written plan
+            os.replace(temp_path, self._path(key))
+        except Exception:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            return
+        self._prune()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._cache_dir, key + '.pickle')
+
+    def _prune(self):
+        entries = []
+        for path in glob.glob(os.path.join(self._cache_dir, '*.pickle')):
+            try:
+                entries.append((os.stat(path).st_mtime, path))
+            except FileNotFoundError:
+                pass
+        entries.sort(reverse=True)
+        for _, path in entries[self._max_entries:]:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
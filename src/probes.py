@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+from typing import Callable, Dict, Optional, Set, Tuple
+
+import functools
+import concurrent.futures
+import subprocess
+import threading
+
+from . import snapd
+
+
+# Cheap, read-only probes of the system state.
+# Every probe runs at most once per process and its result is shared by all
+# callers until it is invalidated. Probes never require root privileges.
+
+
+def _run_once(f: Callable) -> Callable:
+    lock = threading.Lock()
+    result = []
+
+    @functools.wraps(f)
+    def wrapper():
+        with lock:
+            if not result:
+                result.append(f())
+            return result[0]
+
+    def invalidate():
+        with lock:
+            result.clear()
+
+    wrapper.invalidate = invalidate
+    return wrapper
+
+
+def _capture(*command: str) -> Optional[str]:
+    try:
+        return subprocess.check_output(command, stderr=subprocess.DEVNULL, universal_newlines=True)
+    except (OSError, subprocess.CalledProcessError):
+        # The tool is not installed or not functional
+        return None
+
+
+@_run_once
+def installed_snaps() -> Dict[str, Dict]:
+    """
+    :return: All installed snaps by name as reported by snapd
+    """
+    try:
+        with snapd.Client() as client:
+            return client.snaps()
+    except snapd.SnapdError:
+        # snapd is not installed or not running
+        return {}
+
+
+class FlatpakInventory:
+    """
+    Installed Flatpak refs and configured remotes of the system and user installations
+    """
+
+    def __init__(self, refs: Dict[str, Set[Tuple[str, str, str]]], remotes: Dict[str, Set[str]]):
+        """
+        :param refs: Installed refs as (id, architecture, branch) by installation ("system" or "user")
+        :param remotes: Names of remotes by installation
+        """
+        self.refs = refs
+        self.remotes = remotes
+
+    @property
+    def ids(self) -> Set[str]:
+        """
+        Ids of all installed applications and runtimes
+        """
+        return {ref[0] for refs in self.refs.values() for ref in refs}
+
+    def is_installed(self, installation: str, id_: str, arch: Optional[str] = None,
+                     branch: Optional[str] = None) -> bool:
+        """
+        Check whether a matching ref is installed
+        :param installation: "system" or "user"
+        :param id_: Id of the application or runtime (e.g. org.gimp.GIMP)
+        :param arch: Architecture or None for any
+        :param branch: Branch or None for any
+        """
+        return any(ref[0] == id_ and arch in (None, ref[1]) and branch in (None, ref[2])
+                   for ref in self.refs.get(installation, ()))
+
+    def has_remote(self, installation: str, name: str) -> bool:
+        return name in self.remotes.get(installation, ())
+
+
+def _flatpak_refs(installation: str) -> Set[Tuple[str, str, str]]:
+    output = _capture('flatpak', 'list', '--' + installation, '--columns=ref')
+    if output is None:
+        # Older versions of Flatpak don't support columns, but list refs first
+        output = _capture('flatpak', 'list', '--' + installation) or ''
+    refs = set()
+    for line in output.splitlines():
+        # e.g. org.gimp.GIMP/x86_64/stable
+        parts = line.split()[0].split('/') if line.strip() else []
+        if len(parts) == 3:
+            refs.add(tuple(parts))
+    return refs
+
+
+def _flatpak_remotes(installation: str) -> Set[str]:
+    output = _capture('flatpak', 'remotes', '--' + installation) or ''
+    return {line.split()[0] for line in output.splitlines() if line.strip()}
+
+
+@_run_once
+def flatpak_inventory() -> FlatpakInventory:
+    """
+    :return: Installed refs and configured remotes of the system and user installations.
+             Plugins changing them invalidate the probe.
+    """
+    installations = ('system', 'user')
+    with concurrent.futures.ThreadPoolExecutor(len(installations) * 2) as executor:
+        refs = {i: executor.submit(_flatpak_refs, i) for i in installations}
+        remotes = {i: executor.submit(_flatpak_remotes, i) for i in installations}
+        return FlatpakInventory({i: f.result() for i, f in refs.items()},
+                                {i: f.result() for i, f in remotes.items()})
+
+
+def prefetch(*probes: Callable):
+    """
+    Run a set of probes concurrently
+    :param probes: Probes to run
+    """
+    threads = [threading.Thread(target=probe, daemon=True) for probe in probes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
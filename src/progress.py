@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+from typing import List, Optional, TextIO
+
+import sys
+import threading
+import time
+
+from . import termcol
+
+
+_SPINNER = '|/-\\'
+
+
+class Entry:
+    """
+    An action which is displayed by a ProgressRenderer while it's running
+    """
+    __slots__ = ('label', 'indent_level', 'started', 'status')
+
+    def __init__(self, label: str, indent_level: int):
+        self.label = label
+        self.indent_level = indent_level
+        self.started = time.monotonic()
+        # Progress reported by the action
+        self.status = None
+
+
+class _Stream:
+    # Stands in for sys.stdout while a renderer is active so that output of
+    # plugins is printed above the lines of running actions
+    def __init__(self, renderer: 'ProgressRenderer'):
+        self._renderer = renderer
+
+    def write(self, text: str) -> int:
+        self._renderer.write(text)
+        return len(text)
+
+    def flush(self):
+        self._renderer.flush()
+
+    def __getattr__(self, name: str):
+        return getattr(self._renderer.stream, name)
+
+
+class ProgressRenderer:
+    """
+    Displays the progress of running actions.
+
+    A single thread redraws all running actions at most once per interval.
+    It sleeps until an action starts or completes, or the spinner advances,
+    so actions never wait for the renderer. If the output is not a terminal,
+    a plain line is printed whenever an action starts or completes instead.
+    """
+
+    def __init__(self, stream: TextIO = None, interval: float = 0.1, tty: Optional[bool] = None):
+        """
+        :param stream: Stream to render to (standard output by default)
+        :param interval: Minimum time in seconds between two redraws
+        :param tty: Whether to render interactively (detected by default)
+        """
+        self.stream = stream or sys.stdout
+        self._interval = interval
+        self._tty = self.stream.isatty() if tty is None else tty
+        self._running = []
+        self._drawn_lines = 0
+        self._frame = 0
+        self._dirty = False
+        self._closed = False
+        # Output without a trailing line break is held back until the line is complete
+        self._partial_line = ''
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stdout = None
+
+    def __enter__(self) -> 'ProgressRenderer':
+        if self._tty:
+            self._thread = threading.Thread(target=self._render_loop, daemon=True)
+            self._thread.start()
+            if self.stream is sys.stdout:
+                self._stdout = sys.stdout
+                sys.stdout = _Stream(self)
+        return self
+
+    def __exit__(self, *args):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+        if self._stdout is not None:
+            sys.stdout = self._stdout
+
+    def start(self, label: str, indent_level: int = 0) -> Entry:
+        """
+        Display a running action
+        :param label: Label of the action
+        :param indent_level: Indentation level of the action
+        :return: Entry to pass to finish()
+        """
+        entry = Entry(label, indent_level)
+        with self._condition:
+            if self._tty:
+                self._running.append(entry)
+                self._dirty = True
+                self._condition.notify()
+            else:
+                self._print(self._indent(entry) + termcol.warning('▶ ' + label))
+        return entry
+
+    def finish(self, entry: Entry, success: bool = True):
+        """
+        Replace a running action by its result
+        :param entry: Entry returned by start()
+        :param success: Whether the action succeeded
+        """
+        if success:
+            line = self._indent(entry) + termcol.success('✔ ' + entry.label)
+        else:
+            line = self._indent(entry) + termcol.error('❌ ' + entry.label)
+        with self._condition:
+            if self._tty:
+                self._running.remove(entry)
+                self._clear()
+                self._dirty = True
+                self._condition.notify()
+            self._print(line)
+
+    def update(self, entry: Entry, phase: str, fraction: float, rate: Optional[float] = None,
+               eta: Optional[float] = None):
+        """
+        Display the progress of a running action. It's shown with the next redraw.
+        :param entry: Entry returned by start()
+        :param phase: Description of the current phase
+        :param fraction: Completed fraction of the phase (0 to 1)
+        :param rate: Throughput in bytes per second if known
+        :param eta: Estimated time in seconds until the phase is completed if known
+        """
+        status = '{} {:.0f}%'.format(phase, fraction * 100)
+        if rate is not None:
+            status += ', {:.1f} MB/s'.format(rate / 1e6)
+        if eta is not None:
+            status += ', {:.0f} s left'.format(eta)
+        with self._condition:
+            entry.status = status
+
+    @property
+    def running(self) -> List[str]:
+        """
+        Labels of all actions which are currently running
+        """
+        with self._condition:
+            return [entry.label for entry in self._running]
+
+    def write(self, text: str):
+        """
+        Print text above the running actions
+        :param text: Text to print
+        """
+        with self._condition:
+            text = self._partial_line + text
+            lines, newline, self._partial_line = text.rpartition('\n')
+            if not newline:
+                return
+            self._clear()
+            self.stream.write(lines + newline)
+            if self._running:
+                self._dirty = True
+                self._condition.notify()
+
+    def flush(self):
+        with self._condition:
+            self.stream.flush()
+
+    def _render_loop(self):
+        last_draw = 0.0
+        with self._condition:
+            while not self._closed:
+                now = time.monotonic()
+                if self._dirty and now - last_draw >= self._interval:
+                    self._draw()
+                    last_draw = now
+                    self._frame += 1
+                    # Keep the spinners turning while actions are running
+                    self._dirty = len(self._running) > 0
+                    self._condition.wait(self._interval)
+                elif self._dirty:
+                    self._condition.wait(self._interval - (now - last_draw))
+                else:
+                    self._condition.wait()
+            self._clear()
+            self.stream.write(self._partial_line)
+            self._partial_line = ''
+            self.stream.flush()
+
+    def _draw(self):
+        self._clear()
+        lines = []
+        now = time.monotonic()
+        for entry in self._running:
+            text = _SPINNER[self._frame % len(_SPINNER)] + ' ' + entry.label
+            elapsed = int(now - entry.started)
+            if elapsed > 0:
+                text += ' ({} s)'.format(elapsed)
+            if entry.status is not None:
+                text += ' ' + entry.status
+            lines.append(self._indent(entry) + termcol.warning(text))
+        for line in lines:
+            self.stream.write(line + '\n')
+        self._drawn_lines = len(lines)
+        self.stream.flush()
+
+    def _clear(self):
+        # Move the cursor up and erase the lines of running actions
+        if self._drawn_lines > 0:
+            self.stream.write('\033[{}F\033[J'.format(self._drawn_lines))
+            self._drawn_lines = 0
+
+    def _print(self, line: str):
+        self.stream.write(line + '\n')
+        self.stream.flush()
+
+    @staticmethod
+    def _indent(entry: Entry) -> str:
+        return '  ' * entry.indent_level
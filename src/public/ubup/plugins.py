@@ -1,71 +1,395 @@
 # -*- coding: utf-8 -*-
 
+from typing import Callable, List, Optional
+
 import abc
 import os
+import sys
+import asyncio
+import signal
+import threading
+import collections
 import subprocess
 
 
+# Number of output lines of a command kept in memory for error reporting
+OUTPUT_TAIL_LINES = 50
+
+# Maximum length of a line of output of commands run asynchronously
+_STREAM_LIMIT = 1024 * 1024
+
+# Time in seconds commands get to exit before they are killed
+_KILL_GRACE_PERIOD = 5.0
+
+
+class CommandObserver:
+    """
+    Receives notifications about the commands run by a plugin (e.g. for tracing)
+    """
+
+    def command_started(self, command: str, asynchronous: bool):
+        """
+        :param command: Command line
+        :param asynchronous: Whether the command is run by run_command_async()
+        :return: Token passed to command_finished()
+        """
+        return None
+
+    def command_finished(self, token, return_code: Optional[int], rusage=None):
+        """
+        :param token: Token returned by command_started()
+        :param return_code: Exit code of the command (None if it couldn't be started)
+        :param rusage: Resource usage of the command as returned by os.wait4() if available
+        """
+        pass
+
+    def downloaded(self, size: int):
+        """
+        :param size: Number of bytes downloaded by the plugin
+        """
+        pass
+
+    def progress(self, phase: str, fraction: float, rate: Optional[float] = None, eta: Optional[float] = None):
+        """
+        :param phase: Description of the current phase of the work of the plugin (e.g. "Downloading")
+        :param fraction: Completed fraction of the phase (0 to 1)
+        :param rate: Throughput in bytes per second if known
+        :param eta: Estimated time in seconds until the phase is completed if known
+        """
+        pass
+
+
+class _CommandOutput:
+    """
+    Output of a command, which is logged to a file and of which only the last
+    lines are kept in memory unless the complete output is captured
+    """
+
+    def __init__(self, command: List[str], log_path: Optional[str], verbose: bool, capture: bool,
+                 observer: Optional[CommandObserver], asynchronous: bool = False,
+                 output_handler: Optional[Callable[[str], None]] = None):
+        self.command = ' '.join(command)
+        self._output_handler = output_handler
+        self._observer = observer
+        self._token = observer.command_started(self.command, asynchronous) if observer is not None else None
+        self._log_path = log_path
+        self._verbose = verbose
+        self._output = [] if capture else None
+        self._tail = collections.deque(maxlen=OUTPUT_TAIL_LINES)
+        self._log_file = None
+        if log_path is not None:
+            os.makedirs(os.path.dirname(log_path), exist_ok=True)
+            # Line buffered, so lines of concurrently running commands are not torn apart
+            self._log_file = open(log_path, 'a', buffering=1)
+            self._log_file.write('$ {}\n'.format(self.command))
+
+    def add(self, line: str):
+        line = line.rstrip()
+        if self._output_handler is not None:
+            self._output_handler(line)
+        self._tail.append(line)
+        if self._output is not None:
+            self._output.append(line)
+        if self._log_file is not None:
+            self._log_file.write(line + '\n')
+        if self._verbose:
+            print(line)
+
+    def close(self, return_code: Optional[int], rusage=None):
+        if self._log_file is not None:
+            self._log_file.close()
+        if self._observer is not None:
+            self._observer.command_finished(self._token, return_code, rusage)
+
+    def tail(self) -> str:
+        return '\n'.join(self._tail)
+
+    def result(self, return_code: int) -> Optional[str]:
+        if return_code:
+            if not self._verbose:
+                print(self.tail())
+            if self._log_path is not None:
+                print('Full output: {}'.format(self._log_path))
+            raise subprocess.CalledProcessError(return_code, self.command, output=self.tail())
+        if self._output is not None:
+            return '\n'.join(self._output) + '\n' if self._output else ''
+        return None
+
+
+def _wait(p: subprocess.Popen):
+    # Wait for a process and collect its resource usage
+    try:
+        _, status, rusage = os.wait4(p.pid, 0)
+    except ChildProcessError:
+        # Already reaped
+        return p.wait(), None
+    if os.WIFSIGNALED(status):
+        p.returncode = -os.WTERMSIG(status)
+    else:
+        p.returncode = os.WEXITSTATUS(status)
+    return p.returncode, rusage
+
+
+def _descendants(pid: int) -> List[int]:
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(entry)) as file:
+                stat = file.read()
+        except OSError:
+            continue
+        # The command name in parentheses may contain spaces
+        ppid = int(stat.rsplit(')', 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+    result = []
+    stack = [pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            result.append(child)
+            stack.append(child)
+    return result
+
+
+def _signal_all(pids: List[int], sig: int):
+    for pid in pids:
+        try:
+            os.kill(pid, sig)
+        except (ProcessLookupError, PermissionError):
+            # Processes run with sudo can't be signaled, but sudo relays the signal
+            pass
+
+
+async def _kill(p: asyncio.subprocess.Process):
+    # Orphaned descendants would keep the output pipe open, stop the whole tree
+    if p.returncode is not None:
+        return
+    pids = [p.pid] + _descendants(p.pid)
+    _signal_all(pids, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(p.wait(), _KILL_GRACE_PERIOD)
+    except asyncio.TimeoutError:
+        _signal_all(pids, signal.SIGKILL)
+        await p.wait()
+
+
+if sys.version_info < (3, 8):
+    class _ThreadedChildWatcher(asyncio.AbstractChildWatcher):
+        # Waits for each child process on a thread of its own, so that event loops of any
+        # thread can run commands (like asyncio.ThreadedChildWatcher of Python >= 3.8)
+        def add_child_handler(self, pid, callback, *args):
+            threading.Thread(target=self._wait, args=(pid, callback, args), daemon=True).start()
+
+        @staticmethod
+        def _wait(pid, callback, args):
+            try:
+                _, status = os.waitpid(pid, 0)
+            except ChildProcessError:
+                return_code = 255
+            else:
+                return_code = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+            callback(pid, return_code, *args)
+
+        def remove_child_handler(self, pid):
+            return True
+
+        def attach_loop(self, loop):
+            pass
+
+        def is_active(self):
+            return True
+
+        def close(self):
+            pass
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+    # The default watcher only works with the event loop of the main thread,
+    # but plugins are performed on worker threads
+    asyncio.set_child_watcher(_ThreadedChildWatcher())
+
+
+def _all_tasks(loop: asyncio.AbstractEventLoop):
+    # asyncio.all_tasks() requires Python 3.7
+    if hasattr(asyncio, 'all_tasks'):
+        return asyncio.all_tasks(loop)
+    return {task for task in asyncio.Task.all_tasks(loop) if not task.done()}
+
+
 class AbstractPlugin(abc.ABC):
     """
     Abstract base class representing a plugin skeleton
 
     Static class attributes:
-        key:        The unique name this plugin
-        schema:     Schema of plugin configuration as defined by the "schema" library
+        key:            The unique name this plugin
+        schema:         Schema of plugin configuration as defined by the "schema" library
+        step_duration:  Rough estimate of the time in seconds a single step takes
+        coalescible:    Whether consecutive actions of this plugin may be merged into a
+                        single action (see coalesce())
+        barrier:        Whether actions of this plugin may depend on the effects of
+                        preceding actions of other plugins. Coalescible actions are
+                        never merged across barriers.
     """
     key = ''
     schema = object
+    step_duration = 1.0
+    coalescible = False
+    barrier = True
 
-    def __init__(self, config=None, data_path: str=None, verbose: bool=False):
+    def __init__(self, config=None, data_path: str=None, verbose: bool=False, log_path: str=None,
+                 observer: CommandObserver=None):
         """
         :param config: Plugin configuration
         :param data_path: Path to configuration folder
         :param verbose: Whether verbose output is enabled
+        :param log_path: Path of the file to append the output of commands to
+        :param observer: Observer notified about all commands run by this plugin
         """
         self.config = config
         self.data_path = data_path
+        self.log_path = log_path
+        self.observer = observer
         self._verbose = verbose
 
-    def run_command(self, command: str, *args, cwd: str=None) -> str:
+    def run_command(self, command: str, *args, cwd: str=None, capture: bool=True,
+                    output_handler: Callable[[str], None]=None) -> Optional[str]:
         """
-        Run a command
+        Run a command. Its output is streamed to the log file of the action.
+        Only the last lines are kept in memory and printed if the command fails.
         :param command: Command to run
         :param args: Command arguments
         :param cwd: Current working directory
-        :return: Command output
-        """
-
-        cmd_str = ' '.join([command, *args])
-
-        p = subprocess.Popen(
-            [command, *args],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True,
-            cwd=cwd or self.data_path
-        )
-        output = ''
-        for line in iter(p.stdout.readline, ''):
-            output += line.strip() + '\n'
-            if self._verbose:
-                print(line.strip())
-        p.stdout.close()
-        return_code = p.wait()
-        if return_code:
-            if not self._verbose:
-                print(output)
-            raise subprocess.CalledProcessError(return_code, cmd_str)
-        return output
+        :param capture: Whether to keep and return the complete output (unset it for long unneeded outputs)
+        :param output_handler: Function called with each line of output as it arrives
+        :return: Command output, None if capture is unset
+        """
+        output = _CommandOutput([command, *args], self.log_path, self._verbose, capture, self.observer,
+                                output_handler=output_handler)
+
+        try:
+            p = subprocess.Popen(
+                [command, *args],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                universal_newlines=True,
+                cwd=cwd or self.data_path
+            )
+        except OSError:
+            output.close(None)
+            raise
+        try:
+            for line in p.stdout:
+                output.add(line)
+        finally:
+            p.stdout.close()
+            return_code, rusage = _wait(p)
+            output.close(return_code, rusage)
+        return output.result(return_code)
 
-    def run_command_sudo(self, command: str, *args, cwd: str=None) -> str:
+    def run_command_sudo(self, command: str, *args, cwd: str=None, capture: bool=True,
+                         output_handler: Callable[[str], None]=None) -> Optional[str]:
         """
         Run a command with sudo
         :param command: Command to run
         :param args: Command arguments
         :param cwd: Current working directory
-        :return: Command output
+        :param capture: Whether to keep and return the complete output (unset it for long unneeded outputs)
+        :param output_handler: Function called with each line of output as it arrives
+        :return: Command output, None if capture is unset
+        """
+        return self.run_command('sudo', command, *args, cwd=cwd, capture=capture, output_handler=output_handler)
+
+    async def run_command_async(self, command: str, *args, cwd: str=None, capture: bool=True,
+                                timeout: float=None, output_handler: Callable[[str], None]=None) -> Optional[str]:
+        """
+        Run a command without blocking the event loop, so that multiple commands
+        can run concurrently (e.g. using asyncio.gather()). Output is handled
+        like by run_command(). If the calling task is cancelled or the timeout
+        expires, the command is killed.
+        :param command: Command to run
+        :param args: Command arguments
+        :param cwd: Current working directory
+        :param capture: Whether to keep and return the complete output (unset it for long unneeded outputs)
+        :param timeout: Time in seconds after which the command is killed
+        :param output_handler: Function called with each line of output as it arrives
+        :return: Command output, None if capture is unset
         """
-        return self.run_command('sudo', command, *args, cwd=cwd)
+        output = _CommandOutput([command, *args], self.log_path, self._verbose, capture, self.observer,
+                                asynchronous=True, output_handler=output_handler)
+
+        try:
+            p = await asyncio.create_subprocess_exec(
+                command, *args,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                cwd=cwd or self.data_path,
+                limit=_STREAM_LIMIT
+            )
+        except OSError:
+            output.close(None)
+            raise
+
+        async def communicate():
+            async for line in p.stdout:
+                output.add(line.decode(errors='replace'))
+            return await p.wait()
+
+        try:
+            return_code = await asyncio.wait_for(communicate(), timeout)
+        except asyncio.TimeoutError:
+            await _kill(p)
+            raise subprocess.TimeoutExpired(output.command, timeout, output=output.tail())
+        except BaseException:
+            # Also kills the command if the task is cancelled
+            await _kill(p)
+            raise
+        finally:
+            output.close(p.returncode)
+        return output.result(return_code)
+
+    async def run_command_sudo_async(self, command: str, *args, cwd: str=None, capture: bool=True,
+                                     timeout: float=None,
+                                     output_handler: Callable[[str], None]=None) -> Optional[str]:
+        """
+        Run a command with sudo without blocking the event loop
+        :param command: Command to run
+        :param args: Command arguments
+        :param cwd: Current working directory
+        :param capture: Whether to keep and return the complete output (unset it for long unneeded outputs)
+        :param timeout: Time in seconds after which the command is killed
+        :param output_handler: Function called with each line of output as it arrives
+        :return: Command output, None if capture is unset
+        """
+        return await self.run_command_async('sudo', command, *args, cwd=cwd, capture=capture, timeout=timeout,
+                                            output_handler=output_handler)
+
+    @staticmethod
+    def run_async(coroutine):
+        """
+        Run a coroutine on a new event loop until it is complete, e.g. from perform().
+        Tasks which are still running when it completes are cancelled.
+        :param coroutine: Coroutine to run
+        :return: Result of the coroutine
+        """
+        # Like asyncio.run(), which requires Python 3.7
+        loop = asyncio.new_event_loop()
+        try:
+            asyncio.set_event_loop(loop)
+            return loop.run_until_complete(coroutine)
+        finally:
+            try:
+                pending = _all_tasks(loop)
+                for task in pending:
+                    task.cancel()
+                loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            finally:
+                asyncio.set_event_loop(None)
+                loop.close()
 
     @abc.abstractmethod
     def perform(self):
@@ -74,6 +398,25 @@ class AbstractPlugin(abc.ABC):
         """
         pass
 
+    @classmethod
+    def coalesce(cls, configs: List):
+        """
+        Merge the configurations of multiple actions of this plugin
+        (only used if coalescible is set)
+        :param configs: Plugin configurations in order
+        :return: Merged plugin configuration
+        """
+        raise NotImplementedError()
+
+    def pending(self) -> Optional[List[str]]:
+        """
+        Cheaply check which setup steps still need to be performed.
+        Must not modify the system and must not require root privileges.
+        :return: Descriptions of the pending steps, an empty list if there is nothing
+                 left to do or None if this can't be determined
+        """
+        return None
+
     def _expand_path(self, path: str) -> str:
         """
         Sanitize a file or folder path and expand a supported set
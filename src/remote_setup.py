@@ -4,9 +4,12 @@ from typing import List, Optional
 
 import sys
 import os
+import shlex
+import socket
 import subprocess
 
 from . import log
+from . import state
 
 
 def perform(setup_filename: str, remote: str):
@@ -45,7 +48,7 @@ def perform(setup_filename: str, remote: str):
         ubup_remote_exec_path = os.path.join(temp_dir, 'ubup')
 
     log.information('Running ubup remotely.')
-    _run_ubup(remote, temp_dir, ubup_remote_exec_path)
+    _run_ubup(remote, temp_dir, ubup_remote_exec_path, _state_namespace(setup_filename))
 
 
 def _probe(remote: str):
@@ -73,9 +76,15 @@ def _copy_ubup(ubup_executable_path: str, remote: str, remote_path: str):
     _scp(remote, ubup_executable_path, os.path.join(remote_path, 'ubup'))
 
 
-def _run_ubup(remote: str, remote_path: str, remote_ubup_executable: str):
+def _state_namespace(setup_filename: str) -> str:
+    # The configuration is copied to a new directory each time, so identify it by its local origin
+    return 'remote:{}:{}'.format(socket.gethostname(), os.path.realpath(setup_filename))
+
+
+def _run_ubup(remote: str, remote_path: str, remote_ubup_executable: str, namespace: str):
     args = _argv_without_args(['-p', '--path', '--remote'])
-    _ssh(remote, [remote_ubup_executable, 'setup', '-p', os.path.join(remote_path, 'setup'), *args])
+    _ssh(remote, ['{}={}'.format(state.NAMESPACE_ENV, shlex.quote(namespace)), remote_ubup_executable, 'setup',
+                  '-p', os.path.join(remote_path, 'setup'), *args])
 
 
 def _ssh(remote: str, command):
@@ -116,11 +125,11 @@ def _capture_command(command: List[str]) -> str:
         stderr=subprocess.STDOUT,
         universal_newlines=True,
     )
-    output = ''
-    for line in iter(p.stdout.readline, ''):
-        output += line.strip() + '\n'
+    # Only used for commands with short output which is needed in full
+    lines = [line.strip() + '\n' for line in p.stdout]
     p.stdout.close()
     return_code = p.wait()
+    output = ''.join(lines)
     if return_code != 0:
         log.error(output)
         raise subprocess.CalledProcessError(return_code, command_str)
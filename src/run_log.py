@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import time
+import shutil
+import threading
+
+
+RUN_LOG_DIR = os.path.expanduser('~/.cache/ubup/runs')
+
+# Number of runs to keep the logs of
+_MAX_RUNS = 10
+
+
+class RunLog:
+    """
+    Directory holding the command output logs of all actions of a single run
+    """
+
+    def __init__(self, base_dir: str = None, max_runs: int = _MAX_RUNS):
+        """
+        :param base_dir: Directory containing the directories of all runs (RUN_LOG_DIR by default)
+        :param max_runs: Number of runs to keep, older runs are removed
+        """
+        self._base_dir = base_dir or RUN_LOG_DIR
+        self._max_runs = max_runs
+        self._lock = threading.Lock()
+        self._count = 0
+        self.path = None
+
+    def log_path(self, label: str) -> str:
+        """
+        Allocate a log file for an action. The run directory is only created
+        by the first command writing to it (see AbstractPlugin.run_command).
+        :param label: Label of the action
+        :return: Path of the log file
+        """
+        with self._lock:
+            if self.path is None:
+                self._prune()
+                name = time.strftime('%Y%m%d-%H%M%S') + '-{}'.format(os.getpid())
+                self.path = os.path.join(self._base_dir, name)
+            self._count += 1
+            name = re.sub(r'[^\w.-]+', '_', label).strip('_')
+            return os.path.join(self.path, '{:04d}-{}.log'.format(self._count, name))
+
+    @property
+    def exists(self) -> bool:
+        """
+        Whether any output was logged in this run
+        """
+        return self.path is not None and os.path.isdir(self.path)
+
+    def _prune(self):
+        # Make room for this run, run directories sort chronologically by name
+        try:
+            runs = sorted(os.listdir(self._base_dir))
+        except FileNotFoundError:
+            return
+        for run in runs[:max(0, len(runs) - self._max_runs + 1)]:
+            shutil.rmtree(os.path.join(self._base_dir, run), ignore_errors=True)
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+from typing import Dict, List, Optional
+
+import json
+import time
+import socket
+import http.client
+import urllib.parse
+
+from . import plugins
+
+
+SNAPD_SOCKET_PATH = '/run/snapd.socket'
+
+# Time in seconds between two checks of the status of a change
+_POLL_INTERVAL = 0.25
+
+# Time in seconds to wait for a response of snapd
+_TIMEOUT = 60.0
+
+
+class SnapdError(Exception):
+    """
+    Error reported by snapd
+    """
+
+    def __init__(self, message: str, status: Optional[int] = None, kind: Optional[str] = None):
+        """
+        :param message: Description of the error
+        :param status: HTTP status code of the response
+        :param kind: Kind of the error as reported by snapd (e.g. "snap-not-found")
+        """
+        super().__init__(message)
+        self.status = status
+        self.kind = kind
+
+    @property
+    def access_denied(self) -> bool:
+        """
+        Whether the request requires root privileges (or authorization via polkit)
+        """
+        return self.status in (401, 403)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: float):
+        super().__init__('localhost', timeout=timeout)
+        self._socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self._socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+def normalize_channel(channel: str) -> str:
+    """
+    :param channel: Channel as accepted by snap (e.g. "beta", "latest/edge" or "18/stable")
+    :return: Channel including track and risk (e.g. "latest/beta")
+    """
+    if channel in ('stable', 'candidate', 'beta', 'edge'):
+        return 'latest/' + channel
+    if '/' not in channel:
+        # Only a track was given
+        return channel + '/stable'
+    return channel
+
+
+def is_satisfied(snap: Dict, channel: Optional[str] = None, devmode: bool = False,
+                 jailmode: bool = False) -> bool:
+    """
+    Check whether an installed snap matches the requested options.
+    Confinement set by the snap itself (e.g. classic) can't be changed and isn't compared.
+    :param snap: Installed snap as returned by Client.snaps()
+    :param channel: Requested channel
+    :param devmode: Whether the snap is requested in development mode
+    :param jailmode: Whether the snap is requested in jail mode
+    """
+    if channel is not None:
+        tracking = snap.get('tracking-channel') or snap.get('channel') or ''
+        if normalize_channel(tracking) != normalize_channel(channel):
+            return False
+    return bool(snap.get('devmode')) == devmode and bool(snap.get('jailmode')) == jailmode
+
+
+class Client:
+    """
+    Client of the REST API of snapd.
+    All requests are sent over a single connection to the socket of snapd.
+    """
+
+    def __init__(self, socket_path: Optional[str] = None):
+        """
+        :param socket_path: Path of the socket of snapd, defaults to the one of the system
+        """
+        self._socket_path = socket_path or SNAPD_SOCKET_PATH
+        self._connection = None
+
+    def __enter__(self) -> 'Client':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def snaps(self) -> Dict[str, Dict]:
+        """
+        :return: All installed snaps by name
+        """
+        return {snap['name']: snap for snap in self._request('GET', '/v2/snaps')['result']}
+
+    def install(self, name: str, channel: Optional[str] = None, classic: bool = False, devmode: bool = False,
+                jailmode: bool = False) -> str:
+        """
+        Start installing a snap
+        :return: ID of the change installing the snap
+        """
+        return self._snap_action('install', name, channel, classic, devmode, jailmode)
+
+    def install_many(self, names: List[str]) -> str:
+        """
+        Start installing multiple snaps without options in a single change
+        :return: ID of the change installing the snaps
+        """
+        return self._request('POST', '/v2/snaps', {'action': 'install', 'snaps': names})['change']
+
+    def refresh(self, name: str, channel: Optional[str] = None, classic: bool = False, devmode: bool = False,
+                jailmode: bool = False) -> str:
+        """
+        Start switching an installed snap to other options (e.g. another channel)
+        :return: ID of the change refreshing the snap
+        """
+        return self._snap_action('refresh', name, channel, classic, devmode, jailmode)
+
+    def change(self, change_id: str) -> Dict:
+        """
+        :return: Status of a change
+        """
+        return self._request('GET', '/v2/changes/{}'.format(urllib.parse.quote(change_id)))['result']
+
+    def wait(self, change_id: str, observer: Optional[plugins.CommandObserver] = None) -> Dict:
+        """
+        Wait until a change is complete
+        :param change_id: ID of the change
+        :param observer: Observer to report the progress of the change to
+        :return: Status of the change
+        """
+        while True:
+            change = self.change(change_id)
+            if change.get('ready'):
+                break
+            if observer is not None:
+                tasks = change.get('tasks', [])
+                done = sum(task.get('progress', {}).get('done', 0) for task in tasks)
+                total = sum(task.get('progress', {}).get('total', 0) for task in tasks)
+                if total > 0:
+                    observer.progress(change.get('summary', 'Changing snaps'), done / total)
+            time.sleep(_POLL_INTERVAL)
+        if change.get('status') != 'Done':
+            raise SnapdError(change.get('err') or '{} failed'.format(change.get('summary', 'Change')))
+        return change
+
+    def _snap_action(self, action: str, name: str, channel: Optional[str], classic: bool, devmode: bool,
+                     jailmode: bool) -> str:
+        body = {'action': action}
+        if channel is not None:
+            body['channel'] = channel
+        for option, value in (('classic', classic), ('devmode', devmode), ('jailmode', jailmode)):
+            if value:
+                body[option] = True
+        return self._request('POST', '/v2/snaps/{}'.format(urllib.parse.quote(name)), body)['change']
+
+    def _request(self, method: str, path: str, body: Optional[Dict] = None) -> Dict:
+        data = json.dumps(body).encode() if body is not None else None
+        headers = {'Content-Type': 'application/json'} if data is not None else {}
+        # A kept-alive connection may have been closed by snapd, retry once on a new one
+        for attempt in range(2):
+            if self._connection is None:
+                self._connection = _UnixHTTPConnection(self._socket_path, _TIMEOUT)
+            try:
+                self._connection.request(method, path, data, headers)
+                response = self._connection.getresponse()
+                content = response.read()
+                break
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                self.close()
+                if attempt == 1:
+                    raise
+            except OSError as e:
+                self.close()
+                raise SnapdError('Could not connect to snapd at {}: {}'.format(self._socket_path, e))
+        try:
+            result = json.loads(content.decode())
+        except ValueError:
+            raise SnapdError('Invalid response of snapd to {} {}'.format(method, path), response.status)
+        if result.get('type') == 'error':
+            error = result.get('result') or {}
+            raise SnapdError(error.get('message', 'Request failed'), response.status, error.get('kind'))
+        return result
@@ -1,67 +1,271 @@
 # -*- coding: utf-8 -*-
 
+from typing import List, Optional, Set
+
 import os
-import io
+import json
+import math
+import time
+import sqlite3
+import hashlib
+import threading
+import contextlib
 import ruamel.yaml as yaml
 
 from . import tree
+from . import version
 
 
 STATE_CONFIG_DIR = os.path.expanduser('~/.config/ubup')
+STATE_DB_NAME = 'state.sqlite3'
+# Legacy state files, migrated to the database when it's created
 STATE_CONFIG_PATH = '{}/state.yaml'.format(STATE_CONFIG_DIR)
+STATE_JOURNAL_NAME = 'state.journal'
+
+# Namespace of actions which were performed before states were kept per configuration.
+# Actions in this namespace count as performed for all configurations.
+SHARED_NAMESPACE = ''
+
+# Environment variable overriding the namespace of a configuration,
+# e.g. for remote setups whose configuration is copied to a new directory each time
+NAMESPACE_ENV = 'UBUP_STATE_NAMESPACE'
+
+# Bump and extend _migrate() whenever the schema changes
+_SCHEMA_VERSION = 1
+
+# Time in seconds to wait for other processes writing to the database
+_BUSY_TIMEOUT = 30.0
+
+# Number of runs kept per action. The latest successful run is always kept.
+_MAX_RUNS_PER_ACTION = 20
+
+# Length of a record of the legacy journal (hex digest and line break)
+_JOURNAL_RECORD_LENGTH = 65
+
+
+def _canonical(value):
+    # Represent scalars as strings, the same way the legacy state file stored
+    # them, so that migrated records match the actions they were created for
+    if isinstance(value, dict):
+        return {_canonical(k): _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, float):
+        if math.isnan(value):
+            return '.nan'
+        if math.isinf(value):
+            return '.inf' if value > 0 else '-.inf'
+        return repr(value)
+    return str(value)
+
+
+def action_hash(action: tree.Action) -> str:
+    """
+    :return: Digest identifying an action by its plugin and configuration
+    """
+    data = json.dumps({'name': _canonical(action.name), 'body': _canonical(action.body)},
+                      sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class Run:
+    """
+    A recorded run of an action
+    """
+    __slots__ = ('action', 'path', 'started', 'duration', 'success', 'error', 'version')
+
+    def __init__(self, action: str, path: str, started: float, duration: float, success: bool,
+                 error: Optional[str], version: str):
+        self.action = action
+        self.path = path
+        self.started = started
+        self.duration = duration
+        self.success = bool(success)
+        self.error = error
+        self.version = version
 
 
 class ConfigState:
-    def __init__(self):
-        self._performed_actions = []
+    """
+    Performed actions and the history of their runs, kept per configuration.
+
+    Performed actions are looked up in memory. They and all runs are stored
+    in an SQLite database in WAL mode, so other processes can read it while
+    it's written to.
+    """
+
+    def __init__(self, namespace: str = SHARED_NAMESPACE):
+        """
+        :param namespace: Identity of the configuration (e.g. the path of the configuration file)
+        """
+        self._namespace = namespace
+        self._done = set()
+        self._unsaved = []
+        self._lock = threading.Lock()
         if not os.path.isdir(STATE_CONFIG_DIR):
             os.makedirs(STATE_CONFIG_DIR, exist_ok=True)
-        self._state_filepath = STATE_CONFIG_PATH
+        self._db_filepath = os.path.join(STATE_CONFIG_DIR, STATE_DB_NAME)
+        self._journal_filepath = os.path.join(STATE_CONFIG_DIR, STATE_JOURNAL_NAME)
+        self._legacy_filepath = STATE_CONFIG_PATH
+        self._db = None
 
     @property
     def exists(self) -> bool:
-        return os.path.isfile(self._state_filepath)
+        return any(os.path.isfile(f) for f in (self._db_filepath, self._journal_filepath, self._legacy_filepath))
 
     def is_done(self, action_to_perform: tree.Action) -> bool:
-        action_data = self._serialize_action(action_to_perform)
-        return action_data in self._performed_actions
+        digest = action_hash(action_to_perform)
+        with self._lock:
+            return digest in self._done
 
     def mark_done(self, performed_action: tree.Action, auto_save: bool = True):
-        self._performed_actions += [self._serialize_action(performed_action)]
-        if auto_save:
-            self.save()
+        digest = action_hash(performed_action)
+        with self._lock:
+            if digest in self._done:
+                return
+            self._done.add(digest)
+            self._unsaved.append(digest)
+            if auto_save:
+                self._save()
+
+    def record_run(self, action: tree.Action, path: str, started: float, duration: float,
+                   error: Optional[str] = None):
+        """
+        Add a run of an action to the history
+        :param action: Performed action
+        :param path: Path of the action in the configuration
+        :param started: Start time as returned by time.time()
+        :param duration: Duration in seconds
+        :param error: Description of the error if the action failed
+        """
+        digest = action_hash(action)
+        with self._lock, self._transaction() as db:
+            db.execute('INSERT INTO runs (namespace, digest, action, path, started, duration, success, error, '
+                       'version) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                       (self._namespace, digest, action.name, path, started, duration,
+                        error is None, error, version.VERSION))
+            # Keep the history from growing with each run
+            db.execute('DELETE FROM runs WHERE namespace = ? AND digest = ? AND id NOT IN ('
+                       'SELECT id FROM runs WHERE namespace = ? AND digest = ? ORDER BY started DESC LIMIT ?) '
+                       'AND id NOT IN ('
+                       'SELECT id FROM runs WHERE namespace = ? AND digest = ? AND success '
+                       'ORDER BY started DESC LIMIT 1)',
+                       (self._namespace, digest, self._namespace, digest, _MAX_RUNS_PER_ACTION,
+                        self._namespace, digest))
+
+    def last_successful_run(self, action: tree.Action) -> Optional[Run]:
+        """
+        :return: Latest successful run of an action of this configuration or None
+        """
+        with self._lock:
+            row = self._connection().execute(
+                'SELECT action, path, started, duration, success, error, version FROM runs '
+                'WHERE namespace = ? AND digest = ? AND success ORDER BY started DESC LIMIT 1',
+                (self._namespace, action_hash(action))).fetchone()
+        return Run(*row) if row is not None else None
+
+    def stale_runs(self, days: float) -> List[Run]:
+        """
+        :param days: Number of days
+        :return: Latest successful runs of all actions of this configuration
+                 which weren't performed successfully within the given number of days
+        """
+        # SQLite takes the other columns from the row with the maximum start time
+        with self._lock:
+            rows = self._connection().execute(
+                'SELECT action, path, MAX(started), duration, success, error, version FROM runs '
+                'WHERE namespace = ? AND success GROUP BY digest HAVING MAX(started) < ? ORDER BY started',
+                (self._namespace, time.time() - days * 24 * 3600)).fetchall()
+        return [Run(*row) for row in rows]
 
     def save(self):
-        with open(self._state_filepath, 'w') as file:
-            yaml.dump(self._performed_actions, file)
+        with self._lock:
+            self._save()
 
     def load(self):
-        with open(self._state_filepath) as file:
-            y = yaml.YAML(typ='base')
-            self._performed_actions = y.load(file)
-
-    @staticmethod
-    def _encode_filename(filename) -> str:
-        filename = os.path.basename(filename)
-        filename = filename.replace('_', '__')
-        filename = filename.replace('.', '_')
-        return filename
-
-    @staticmethod
-    def _purify_yaml(yaml_obj):
-        # Convert YAML type to pure Python type
-        # FIXME: This is fairly hacky.
-        # There must be a better way to do this.
-        temp = io.StringIO()
-        y_roundtrip = yaml.YAML(typ='rt')
-        y_roundtrip.dump(yaml_obj, temp)
-        temp.seek(0)
-        y_base = yaml.YAML(typ='base')
-        return y_base.load(temp)
-
-    @staticmethod
-    def _serialize_action(action: tree.Action):
-        return ConfigState._purify_yaml({
-            'name': action.name,
-            'body': action.body
-        })
+        with self._lock:
+            rows = self._connection().execute('SELECT digest FROM done WHERE namespace IN (?, ?)',
+                                              (self._namespace, SHARED_NAMESPACE))
+            self._done = {digest for digest, in rows}
+
+    def close(self):
+        """
+        Save all performed actions and close the database
+        """
+        with self._lock:
+            self._save()
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _save(self):
+        if len(self._unsaved) == 0:
+            return
+        with self._transaction() as db:
+            db.executemany('INSERT OR IGNORE INTO done (namespace, digest) VALUES (?, ?)',
+                           [(self._namespace, digest) for digest in self._unsaved])
+        self._unsaved = []
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # Take the write lock up front, so concurrent writers wait for each other instead of failing
+        db = self._connection()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._db is None:
+            # Transactions are managed explicitly, the sqlite3 module must not begin or commit them implicitly
+            db = sqlite3.connect(self._db_filepath, timeout=_BUSY_TIMEOUT, check_same_thread=False,
+                                 isolation_level=None)
+            try:
+                db.execute('PRAGMA journal_mode = WAL')
+                db.execute('PRAGMA synchronous = NORMAL')
+                self._migrate(db)
+            except BaseException:
+                db.close()
+                raise
+            self._db = db
+        return self._db
+
+    def _migrate(self, db: sqlite3.Connection):
+        # Lock the database, so only one of several concurrent processes migrates it
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            schema_version, = db.execute('PRAGMA user_version').fetchone()
+            if schema_version < 1:
+                db.execute('CREATE TABLE done (namespace TEXT NOT NULL, digest TEXT NOT NULL, '
+                           'PRIMARY KEY (namespace, digest)) WITHOUT ROWID')
+                db.execute('CREATE TABLE runs (id INTEGER PRIMARY KEY, namespace TEXT NOT NULL, '
+                           'digest TEXT NOT NULL, action TEXT NOT NULL, path TEXT NOT NULL, started REAL NOT NULL, '
+                           'duration REAL NOT NULL, success INTEGER NOT NULL, error TEXT, version TEXT NOT NULL)')
+                db.execute('CREATE INDEX runs_by_action ON runs (namespace, digest, success, started)')
+                db.executemany('INSERT OR IGNORE INTO done (namespace, digest) VALUES (?, ?)',
+                               [(SHARED_NAMESPACE, digest) for digest in self._read_legacy()])
+            if schema_version < _SCHEMA_VERSION:
+                db.execute('PRAGMA user_version = {}'.format(_SCHEMA_VERSION))
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def _read_legacy(self) -> Set[str]:
+        digests = set()
+        if os.path.isfile(self._journal_filepath):
+            with open(self._journal_filepath) as file:
+                digests.update(line[:-1] for line in file
+                               if len(line) == _JOURNAL_RECORD_LENGTH and line[-1] == '\n')
+        if os.path.isfile(self._legacy_filepath):
+            with open(self._legacy_filepath) as file:
+                actions = yaml.YAML(typ='base').load(file) or []
+            digests.update(action_hash(tree.Action(action['name'], action.get('body'))) for action in actions)
+        return digests
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+from typing import Dict, List, Optional
+
+import os
+import json
+import time
+import itertools
+import threading
+
+from . import plugins
+
+
+class _Span:
+    # Context manager recording a complete event when exited
+    __slots__ = ('_tracer', '_name', '_category', '_args', '_start')
+
+    def __init__(self, tracer: 'Tracer', name: str, category: str, args: Dict):
+        self._tracer = tracer
+        self._name = name
+        self._category = category
+        self._args = args
+
+    def __enter__(self):
+        self._start = self._tracer.now()
+        return self._args
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is not None:
+            self._args['error'] = exc_type.__name__
+        self._tracer.complete(self._name, self._category, self._start, self._tracer.now(), self._args)
+
+
+class _NullSpan:
+    # Context manager recording nothing (contextlib.nullcontext requires Python 3.7)
+    __slots__ = ('_args',)
+
+    def __init__(self, args: Dict):
+        self._args = args
+
+    def __enter__(self):
+        return self._args
+
+    def __exit__(self, *args):
+        pass
+
+
+class NullTracer(plugins.CommandObserver):
+    """
+    Tracer which records nothing, used when tracing is disabled
+    """
+    enabled = False
+
+    def span(self, name: str, category: str, **args):
+        return _NullSpan(args)
+
+
+class Tracer(plugins.CommandObserver):
+    """
+    Records a timeline of a run in the Chrome trace event format,
+    which can be opened in chrome://tracing or https://ui.perfetto.dev
+    """
+    enabled = True
+
+    def __init__(self):
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+        self._events = []
+        self._threads = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def now(self) -> float:
+        """
+        :return: Microseconds since the tracer was created
+        """
+        return (time.perf_counter() - self._origin) * 1e6
+
+    def span(self, name: str, category: str, **args) -> _Span:
+        """
+        Record the time spent in a with statement on the current thread.
+        Arguments may be added to the dictionary returned by the with statement.
+        :param name: Name of the event
+        :param category: Category of the event
+        :param args: Arguments of the event
+        :return: Context manager
+        """
+        return _Span(self, name, category, args)
+
+    def complete(self, name: str, category: str, start: float, end: float, args: Dict = None):
+        """
+        Record an event on the current thread
+        :param name: Name of the event
+        :param category: Category of the event
+        :param start: Start time as returned by now()
+        :param end: End time as returned by now()
+        :param args: Arguments of the event
+        """
+        self._add({
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': start,
+            'dur': end - start,
+            'tid': self._thread_id(),
+            'args': args or {},
+        })
+
+    def command_started(self, command: str, asynchronous: bool):
+        token = (command, self.now(), next(self._ids) if asynchronous else None, self._thread_id())
+        if asynchronous:
+            # Commands run concurrently on the same thread don't nest, use async events
+            self._add({'name': command.split(' ', 1)[0], 'cat': 'command', 'ph': 'b', 'id': token[2],
+                       'ts': token[1], 'tid': token[3], 'args': {'command': command}})
+        return token
+
+    def command_finished(self, token, return_code: Optional[int], rusage=None):
+        command, start, async_id, tid = token
+        args = {'command': command, 'exit_code': return_code}
+        if rusage is not None:
+            args['user_time'] = rusage.ru_utime
+            args['system_time'] = rusage.ru_stime
+            args['max_rss_kib'] = rusage.ru_maxrss
+        if async_id is not None:
+            self._add({'name': command.split(' ', 1)[0], 'cat': 'command', 'ph': 'e', 'id': async_id,
+                       'ts': self.now(), 'tid': tid, 'args': args})
+        else:
+            self.complete(command.split(' ', 1)[0], 'command', start, self.now(), args)
+
+    def progress(self, phase: str, fraction: float, rate: Optional[float] = None, eta: Optional[float] = None):
+        args = {'percent': fraction * 100}
+        if rate is not None:
+            args['bytes_per_second'] = rate
+        self._add({'name': phase, 'cat': 'progress', 'ph': 'C', 'ts': self.now(), 'tid': self._thread_id(),
+                   'args': args})
+
+    def write(self, filename: str):
+        """
+        Write all recorded events to a file
+        :param filename: Path of the trace file
+        """
+        with self._lock:
+            events = list(self._events) + self._category_events(self._events)
+            threads = dict(self._threads)
+        for name, tid in threads.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': self._pid, 'tid': tid, 'args': {'name': name}})
+        for event in events:
+            event['pid'] = self._pid
+        with open(filename, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+    def _add(self, event: Dict):
+        with self._lock:
+            self._events.append(event)
+
+    def _thread_id(self) -> int:
+        thread = threading.current_thread()
+        with self._lock:
+            return self._threads.setdefault(thread.name, len(self._threads) + 1)
+
+    def _category_events(self, events: List[Dict]) -> List[Dict]:
+        # Categories span from the start of their first to the end of their last action.
+        # Children of parallel categories overlap, so they are recorded as async events.
+        spans = {}
+        for event in events:
+            if event['cat'] != 'action':
+                continue
+            path = event['args']['path']
+            for i in range(1, len(path) + 1):
+                key = tuple(path[:i])
+                start, end = spans.get(key, (event['ts'], event['ts'] + event['dur']))
+                spans[key] = (min(start, event['ts']), max(end, event['ts'] + event['dur']))
+        result = []
+        for i, (path, (start, end)) in enumerate(sorted(spans.items())):
+            name = '/'.join(path)
+            result.append({'name': name, 'cat': 'category', 'ph': 'b', 'id': 'category-{}'.format(i),
+                           'ts': start, 'tid': 0})
+            result.append({'name': name, 'cat': 'category', 'ph': 'e', 'id': 'category-{}'.format(i),
+                           'ts': end, 'tid': 0})
+        return result
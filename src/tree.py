@@ -4,12 +4,26 @@ from typing import List, Union, Dict
 
 
 class Action:
+    __slots__ = ('name', 'body')
+
     def __init__(self, name: str, body: Dict):
         self.name = name
         self.body = body
 
 
 class Category:
-    def __init__(self, name: str = '', children: List[Union[Action, 'Category']] = None):
+    __slots__ = ('name', 'children', 'parallel', 'depends_on')
+
+    def __init__(self, name: str = '', children: List[Union[Action, 'Category', 'Include']] = None,
+                 parallel: bool = False, depends_on: List[str] = None):
         self.name = name
         self.children = children or []
+        self.parallel = parallel
+        self.depends_on = depends_on or []
+
+
+class Include:
+    __slots__ = ('patterns',)
+
+    def __init__(self, patterns: List[str]):
+        self.patterns = patterns
@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+
+from typing import Any, Callable, Dict, List, Tuple, Type
+
+import weakref
+import schema
+
+from . import plugins
+
+
+# Reserved action keys which are not handled by plugins
+# Include other configuration files
+INCLUDE_DIRECTIVE = 'include'
+# Perform the child categories and actions of a category concurrently
+PARALLEL_DIRECTIVE = 'parallel'
+# Perform a category after the given sibling categories
+DEPENDS_ON_DIRECTIVE = 'depends-on'
+DIRECTIVES = (INCLUDE_DIRECTIVE, PARALLEL_DIRECTIVE, DEPENDS_ON_DIRECTIVE)
+
+_OPTIONAL_META_KEYS = {
+    'author': str,
+    'description': str,
+}
+
+
+class Issue:
+    """
+    A single problem found while validating a setup configuration
+    """
+    __slots__ = ('path', 'line', 'message')
+
+    def __init__(self, path: Tuple, line: int, message: str):
+        self.path = path
+        self.line = line
+        self.message = message
+
+    def __str__(self) -> str:
+        location = '/'.join(str(p) for p in self.path) or '<root>'
+        if self.line is not None:
+            location = 'line {}: {}'.format(self.line, location)
+        return '{}: {}'.format(location, self.message)
+
+
+class ValidationError(Exception):
+    def __init__(self, issues: List[Issue], filename: str = None):
+        self.issues = issues
+        self.filename = filename
+        location = ' in ' + filename if filename else ''
+        details = '\n'.join('  ' + str(i) for i in issues)
+        super().__init__('Invalid setup configuration{}:\n{}'.format(location, details))
+
+
+def _round_trip_line_of(container, key, default: int) -> int:
+    # ruamel.yaml round-trip containers carry their source positions
+    lc = getattr(container, 'lc', None)
+    if lc is None:
+        return default
+    try:
+        if isinstance(container, dict):
+            return lc.key(key)[0] + 1
+        return lc.item(key)[0] + 1
+    except (KeyError, IndexError, TypeError):
+        return default
+
+
+class _Context:
+    """
+    Collects issues during a validation pass and resolves source positions
+    """
+    __slots__ = ('issues', 'line_of')
+
+    def __init__(self, positions=None):
+        """
+        :param positions: Source positions of plain containers (e.g. a loader.PositionIndex)
+        """
+        self.issues = []
+        self.line_of = positions.line_of if positions is not None else _round_trip_line_of
+
+    def error(self, path: Tuple, line: int, message: str):
+        self.issues.append(Issue(path, line, message))
+
+
+# A compiled validator checks a value and reports problems to the context.
+# Signature: (value, path, line, context, report) -> bool
+# When report is False, the validator must not record any issues and is only
+# used to probe whether a value matches (e.g. for alternatives).
+Validator = Callable[[Any, Tuple, int, _Context, bool], bool]
+
+
+def _describe(s) -> str:
+    if isinstance(s, type):
+        return s.__name__
+    return repr(s)
+
+
+def _compile_type(t: type) -> Validator:
+    def validate(value, path, line, ctx, report):
+        if isinstance(value, t):
+            return True
+        if report:
+            ctx.error(path, line, 'expected {}, got {}'.format(t.__name__, type(value).__name__))
+        return False
+    return validate
+
+
+def _compile_literal(expected) -> Validator:
+    def validate(value, path, line, ctx, report):
+        if value == expected:
+            return True
+        if report:
+            ctx.error(path, line, 'expected {!r}, got {!r}'.format(expected, value))
+        return False
+    return validate
+
+
+def _compile_callable(f: Callable) -> Validator:
+    def validate(value, path, line, ctx, report):
+        try:
+            if f(value):
+                return True
+            message = '{}({!r}) should evaluate to True'.format(getattr(f, '__name__', repr(f)), value)
+        except Exception as e:
+            message = '{}({!r}) raised {!r}'.format(getattr(f, '__name__', repr(f)), value, e)
+        if report:
+            ctx.error(path, line, message)
+        return False
+    return validate
+
+
+def _compile_fallback(s) -> Validator:
+    # Schema constructs without a dedicated compiled form (e.g. And, Use, Regex)
+    # are wrapped into a schema.Schema once and reused for every validation.
+    compiled = schema.Schema(s)
+
+    def validate(value, path, line, ctx, report):
+        try:
+            compiled.validate(value)
+            return True
+        except schema.SchemaError as e:
+            if report:
+                ctx.error(path, line, str(e).replace('\n', ' '))
+            return False
+    return validate
+
+
+def _shape(s):
+    # Container type a schema declaration expects, if any
+    if type(s) in (list, tuple, set, frozenset):
+        return type(s)
+    if type(s) is dict:
+        return dict
+    return None
+
+
+def _compile_alternatives(declarations: List) -> Validator:
+    alternatives = [compile_schema(d) for d in declarations]
+    if len(alternatives) == 1:
+        return alternatives[0]
+    shapes = [_shape(d) for d in declarations]
+    descriptions = ', '.join(_describe(d) for d in declarations)
+
+    def validate(value, path, line, ctx, report):
+        for alternative in alternatives:
+            if alternative(value, path, line, ctx, False):
+                return True
+        if report:
+            # Report detailed issues if only one alternative has a matching shape
+            matching = [a for a, shape in zip(alternatives, shapes) if shape is not None and isinstance(value, shape)]
+            if len(matching) == 1:
+                matching[0](value, path, line, ctx, True)
+            else:
+                ctx.error(path, line, '{!r} did not match any of: {}'.format(value, descriptions))
+        return False
+    return validate
+
+
+def _compile_iterable(s) -> Validator:
+    container_type = type(s)
+    element = _compile_alternatives(list(s))
+
+    def validate(value, path, line, ctx, report):
+        if not isinstance(value, container_type):
+            if report:
+                ctx.error(path, line, 'expected {}, got {}'.format(container_type.__name__, type(value).__name__))
+            return False
+        valid = True
+        for index, item in enumerate(value):
+            item_line = ctx.line_of(value, index, line)
+            if not element(item, path + (index,), item_line, ctx, report):
+                valid = False
+                if not report:
+                    break
+        return valid
+    return validate
+
+
+def _priority(s) -> int:
+    # Same precedence the "schema" library uses when matching dictionary keys
+    if type(s) in (list, tuple, set, frozenset):
+        return 5
+    if isinstance(s, dict):
+        return 4
+    if isinstance(s, type):
+        return 3
+    if hasattr(s, 'validate'):
+        return 2
+    if callable(s):
+        return 1
+    return 0
+
+
+def _key_priority(key) -> float:
+    if isinstance(key, schema.Optional):
+        return _priority(key.schema) + 0.5
+    return _priority(key)
+
+
+def _compile_dict(s: Dict) -> Validator:
+    entries = []
+    required = []
+    for key in sorted(s.keys(), key=_key_priority):
+        optional = isinstance(key, schema.Optional)
+        key_schema = key.schema if optional else key
+        entries.append((compile_schema(key_schema), compile_schema(s[key]), key))
+        if not optional:
+            required.append(key)
+
+    def validate(value, path, line, ctx, report):
+        if not isinstance(value, dict):
+            if report:
+                ctx.error(path, line, 'expected a mapping, got {}'.format(type(value).__name__))
+            return False
+        valid = True
+        covered = set()
+        for data_key, data_value in value.items():
+            key_line = ctx.line_of(value, data_key, line)
+            for key_validator, value_validator, key in entries:
+                if key_validator(data_key, path, key_line, ctx, False):
+                    covered.add(id(key))
+                    if not value_validator(data_value, path + (data_key,), key_line, ctx, report):
+                        valid = False
+                    break
+            else:
+                valid = False
+                if report:
+                    ctx.error(path, key_line, 'wrong key {!r}'.format(data_key))
+            if not valid and not report:
+                return False
+        for key in required:
+            if id(key) not in covered:
+                valid = False
+                if report:
+                    ctx.error(path, line, 'missing key {}'.format(_describe(key)))
+        return valid
+    return validate
+
+
+def compile_schema(s) -> Validator:
+    """
+    Compile a declaration of the "schema" library into a reusable validator
+    :param s: Schema declaration (e.g. the "schema" attribute of a plugin)
+    :return: Compiled validator
+    """
+    if type(s) is schema.Schema and not s.ignore_extra_keys and getattr(s, '_error', None) is None:
+        return compile_schema(s.schema)
+    if type(s) is schema.Or and not s.only_one and getattr(s, '_error', None) is None:
+        return _compile_alternatives(list(s.args))
+    if type(s) in (list, tuple, set, frozenset):
+        return _compile_iterable(s)
+    if type(s) is dict:
+        return _compile_dict(s)
+    if isinstance(s, type):
+        return _compile_type(s)
+    if hasattr(s, 'validate'):
+        return _compile_fallback(s)
+    if callable(s):
+        return _compile_callable(s)
+    return _compile_literal(s)
+
+
+# Compiled validators are reused for as long as the plugin class exists
+_plugin_validators = weakref.WeakKeyDictionary()
+
+
+def _plugin_validator(plugin: Type[plugins.AbstractPlugin]) -> Validator:
+    try:
+        return _plugin_validators[plugin]
+    except KeyError:
+        validator = compile_schema(plugin.schema)
+        _plugin_validators[plugin] = validator
+        return validator
+
+
+class TreeValidator:
+    """
+    Validator for a complete setup configuration compiled for a set of plugins
+    """
+
+    def __init__(self, plugins_list: List[Type[plugins.AbstractPlugin]]):
+        self._actions = {plugin.key: _plugin_validator(plugin) for plugin in plugins_list}
+
+    def validate(self, data: Dict, filename: str = None, positions=None):
+        """
+        Validate a setup configuration in a single pass
+        :param data: Configuration data including the "setup" root
+        :param filename: Name of the file the configuration was loaded from
+        :param positions: Source positions of the configuration data if it
+                          does not consist of ruamel.yaml round-trip types
+        :raises ValidationError: if any issues were found
+        """
+        ctx = _Context(positions)
+        if not isinstance(data, dict):
+            ctx.error((), None, 'expected a mapping, got {}'.format(type(data).__name__))
+            raise ValidationError(ctx.issues, filename)
+
+        # Metadata
+        for key, value in data.items():
+            line = ctx.line_of(data, key, None)
+            if key == 'setup':
+                continue
+            if key not in _OPTIONAL_META_KEYS:
+                ctx.error((), line, 'wrong key {!r}'.format(key))
+            elif not isinstance(value, _OPTIONAL_META_KEYS[key]):
+                ctx.error((key,), line, 'expected {}, got {}'.format(_OPTIONAL_META_KEYS[key].__name__,
+                                                                     type(value).__name__))
+        if 'setup' not in data:
+            ctx.error((), None, "missing key 'setup'")
+            raise ValidationError(ctx.issues, filename)
+
+        # Categories and actions, iteratively
+        stack = [(data['setup'], (), ctx.line_of(data, 'setup', None))]
+        while stack:
+            node, path, line = stack.pop()
+            if not isinstance(node, dict):
+                ctx.error(path, line, 'expected a category mapping, got {}'.format(type(node).__name__))
+                continue
+            for key, value in node.items():
+                key_line = ctx.line_of(node, key, line)
+                if not isinstance(key, str):
+                    ctx.error(path, key_line, 'wrong key {!r}'.format(key))
+                elif key == '$' + INCLUDE_DIRECTIVE or key == '$' + DEPENDS_ON_DIRECTIVE:
+                    self._validate_names(value, path + (key,), key_line, ctx)
+                elif key == '$' + PARALLEL_DIRECTIVE:
+                    if not isinstance(value, bool):
+                        ctx.error(path + (key,), key_line, 'expected bool, got {}'.format(type(value).__name__))
+                elif key.startswith('$'):
+                    validator = self._actions.get(key[1:])
+                    if validator is None:
+                        ctx.error(path, key_line, 'unknown plugin key {!r}'.format(key[1:]))
+                    else:
+                        validator(value, path + (key,), key_line, ctx, True)
+                else:
+                    stack.append((value, path + (key,), key_line))
+
+        if ctx.issues:
+            ctx.issues.sort(key=lambda i: i.line if i.line is not None else -1)
+            raise ValidationError(ctx.issues, filename)
+
+    @staticmethod
+    def _validate_names(value, path: Tuple, line: int, ctx: _Context):
+        # A string or a non-empty list of strings
+        names = value if isinstance(value, list) else [value]
+        if not names:
+            ctx.error(path, line, 'expected at least one item')
+        for index, name in enumerate(names):
+            if not isinstance(name, str):
+                ctx.error(path, ctx.line_of(value, index, line),
+                          'expected str, got {}'.format(type(name).__name__))
@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+
+# Replaced by the release version when building a release (see scripts/build_release.py)
+VERSION = 'dev'
@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 
+import os
 import subprocess
 
+from src import apt
 from src import config
+from src import builtin_plugins
 
 
 _MOCK_CONFIG = '''
@@ -24,6 +27,20 @@ def test_mock():
     setup.load_config_str(_MOCK_CONFIG)
 
 
+def test_installed_packages_are_skipped(tmpdir, monkeypatch):
+    monkeypatch.setattr(apt, 'DPKG_STATUS_PATH', os.path.join(os.path.dirname(__file__), '..', 'assets', 'dpkg_status'))
+    commands = []
+    monkeypatch.setattr(apt, '_index_invalidated_by', None)
+    monkeypatch.setattr(apt, 'wait_for_lock', lambda: None)
+    monkeypatch.setattr(builtin_plugins.AptPackagesPlugin, 'run_command_sudo', lambda self, *c, **_: commands.append(c))
+    builtin_plugins.AptPackagesPlugin(config=['libc6', 'cowsay'], data_path=str(tmpdir)).perform()
+    assert commands == []
+    plugin = builtin_plugins.AptPackagesPlugin(config=['libc6', 'vim', 'cowsay', 'curl'], data_path=str(tmpdir))
+    assert plugin.pending() == ['install vim', 'install curl']
+    plugin.perform()
+    assert commands[0][-5:] == ('-y', '-q', 'install', 'vim', 'curl')
+
+
 def test_real():
     setup = config.Setup()
     setup.load_plugins()
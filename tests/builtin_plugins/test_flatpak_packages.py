@@ -3,6 +3,7 @@
 import subprocess
 
 from src import config
+from src.builtin_plugins import FlatpakPackagesPlugin
 
 
 _MOCK_CONFIG = '''
@@ -38,6 +39,48 @@ def test_mock():
     setup.load_config_str(_MOCK_CONFIG)
 
 
+def test_installed_refs_are_skipped(fake_flatpak, tmpdir, monkeypatch):
+    tmpdir.join('foo.flatpakref').write('[Flatpak Ref]\nName=org.foo.Foo\nBranch=master\n')
+    tmpdir.join('bar.flatpakref').write('[Flatpak Ref]\nName=org.foo.Foo\nBranch=stable\n')
+    commands = []
+    monkeypatch.setattr(FlatpakPackagesPlugin, '_check_is_flatpak_available', staticmethod(lambda: True))
+    monkeypatch.setattr(FlatpakPackagesPlugin, '_check_is_flatpak_installed', lambda self: True)
+    monkeypatch.setattr(FlatpakPackagesPlugin, 'run_command', lambda self, *command, **_: commands.append(command))
+    monkeypatch.setattr(FlatpakPackagesPlugin, 'run_command_sudo', lambda self, *command, **_: commands.append(command))
+    config = ['org.gimp.GIMP', 'app/org.gimp.GIMP/x86_64/beta', 'foo.flatpakref', 'bar.flatpakref',
+              {'package': 'org.freedesktop.Platform', 'type': 'runtime', 'target': 'user'},
+              {'package': 'org.freedesktop.Platform//22.08', 'type': 'runtime', 'target': 'user'}]
+    plugin = FlatpakPackagesPlugin(config=config, data_path=str(tmpdir))
+    assert plugin.pending() == ['install app/org.gimp.GIMP/x86_64/beta', 'install bar.flatpakref',
+                                'install org.freedesktop.Platform//22.08']
+    plugin.perform()
+    assert commands == [
+        ('flatpak', 'install', '-y', '--system', '--app', 'app/org.gimp.GIMP/x86_64/beta'),
+        ('flatpak', 'install', '-y', '--system', '--from', str(tmpdir.join('bar.flatpakref'))),
+        ('flatpak', 'install', '-y', '--user', '--runtime', 'org.freedesktop.Platform//22.08'),
+    ]
+
+
+def test_refs_are_installed_together(fake_flatpak, tmpdir, monkeypatch):
+    commands = []
+    monkeypatch.setattr(FlatpakPackagesPlugin, '_check_is_flatpak_installed', lambda self: True)
+    monkeypatch.setattr(FlatpakPackagesPlugin, 'run_command', lambda self, *command, **_: commands.append(command))
+    monkeypatch.setattr(FlatpakPackagesPlugin, 'run_command_sudo', lambda self, *command, **_: commands.append(command))
+    tmpdir.join('baz.flatpak').write('')
+    config = [{'package': 'org.a.A', 'remote': 'flathub'}, 'baz.flatpak', {'package': 'org.b.B', 'remote': 'flathub'},
+              {'package': 'org.c.C', 'remote': 'flathub', 'target': 'user'}, {'package': 'org.d.D', 'remote': 'other'},
+              {'package': 'org.e.E', 'remote': 'flathub'}]
+    FlatpakPackagesPlugin(config=config, data_path=str(tmpdir)).perform()
+    # Packages are grouped up to the bundle, which may provide runtimes of the following ones
+    assert commands == [
+        ('flatpak', 'install', '-y', '--system', '--app', 'flathub', 'org.a.A'),
+        ('flatpak', 'install', '-y', '--reinstall', '--system', '--bundle', str(tmpdir.join('baz.flatpak'))),
+        ('flatpak', 'install', '-y', '--system', '--app', 'flathub', 'org.b.B', 'org.e.E'),
+        ('flatpak', 'install', '-y', '--user', '--app', 'flathub', 'org.c.C'),
+        ('flatpak', 'install', '-y', '--system', '--app', 'other', 'org.d.D'),
+    ]
+
+
 def test_real():
     setup = config.Setup()
     setup.load_plugins()
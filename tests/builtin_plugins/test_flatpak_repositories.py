@@ -3,6 +3,7 @@
 import subprocess
 
 from src import config
+from src.builtin_plugins import FlatpakRepositoriesPlugin
 
 
 _MOCK_CONFIG = '''
@@ -27,6 +28,22 @@ def test_mock():
     setup.load_config_str(_MOCK_CONFIG)
 
 
+def test_existing_remotes_are_skipped(fake_flatpak, tmpdir, monkeypatch):
+    commands = []
+    monkeypatch.setattr(FlatpakRepositoriesPlugin, '_check_is_flatpak_available', staticmethod(lambda: True))
+    monkeypatch.setattr(FlatpakRepositoriesPlugin, '_check_is_flatpak_installed', lambda self: True)
+    monkeypatch.setattr(FlatpakRepositoriesPlugin, 'run_command', lambda self, *command, **_: commands.append(command))
+    monkeypatch.setattr(FlatpakRepositoriesPlugin, 'run_command_sudo',
+                        lambda self, *command, **_: commands.append(command))
+    location = 'https://flathub.org/repo/flathub.flatpakrepo'
+    config = [{'name': 'flathub', 'location': location},
+              {'name': 'flathub', 'location': location, 'target': 'user'}]
+    plugin = FlatpakRepositoriesPlugin(config=config, data_path=str(tmpdir))
+    assert plugin.pending() == ['add remote flathub']
+    plugin.perform()
+    assert commands == [('flatpak', 'remote-add', '--if-not-exists', '--user', 'flathub', location)]
+
+
 def test_real():
     setup = config.Setup()
     setup.load_plugins()
@@ -38,3 +38,17 @@ def test_real():
         assert os.path.isdir(os.path.join(tempdir, 'test/a/b/c/d'))
         assert os.path.isdir(os.path.join(tempdir, 'test/foo'))
         assert os.path.isdir(os.path.join(tempdir, 'bar'))
+
+
+def test_plan():
+    with tempfile.TemporaryDirectory() as tempdir:
+        os.makedirs(os.path.join(tempdir, 'bar'))
+        setup = config.Setup(tempdir)
+        setup.load_plugins()
+        setup.load_config_str(_REAL_CONFIG)
+        planned, = setup.plan()
+        assert planned.status == config.PlannedAction.PENDING
+        assert planned.steps == ['create test/a/b/c/d', 'create test/foo']
+        setup.perform()
+        planned, = setup.plan()
+        assert planned.status == config.PlannedAction.SATISFIED
@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 
 import os.path
+import json
 
 from src import config
+from src import download_cache
+from src.builtin_plugins import GitHubReleasesPlugin
 
 
 _MOCK_CONFIG = '''
@@ -32,6 +35,26 @@ def test_mock():
     setup.load_config_str(_MOCK_CONFIG)
 
 
+def test_release_metadata_is_always_revalidated(tmpdir, monkeypatch):
+    fetched = []
+
+    def fetch(self, url, observer=None, headers=None):
+        fetched.append((url, self._max_age))
+        path = str(tmpdir.join('release.json'))
+        with open(path, 'w') as file:
+            json.dump({'assets': [{'name': 'ubup-1.0-x86_64', 'browser_download_url': 'https://example.com/a'}]},
+                      file)
+        return path
+
+    monkeypatch.setattr(download_cache.DownloadCache, 'fetch', fetch)
+    monkeypatch.setattr(download_cache.DownloadCache, 'download',
+                        lambda self, url, target, observer=None: fetched.append((url, self._max_age)))
+    config = [{'repo': 'user/repo', 'release': 'latest', 'asset': 'ubup-[0-9.]+-x86_64', 'target': 'ubup'}]
+    GitHubReleasesPlugin(config=config, data_path=str(tmpdir)).perform()
+    assert fetched == [('https://api.github.com/repos/user/repo/releases/latest', 0),
+                       ('https://example.com/a', download_cache._MAX_AGE)]
+
+
 def test_real():
     setup = config.Setup()
     setup.load_plugins()
@@ -1,5 +1,9 @@
 # -*- coding: utf-8 -*-
 
+import os
+import base64
+
+from src import apt
 from src import config
 from src.builtin_plugins import PPAsPlugin
 
@@ -16,6 +20,11 @@ $ppas:
 '''
 
 
+def _armored_key(ppa: str) -> str:
+    return ('-----BEGIN PGP PUBLIC KEY BLOCK-----\n\n{}\n-----END PGP PUBLIC KEY BLOCK-----\n'
+            .format(base64.b64encode(('key of ' + ppa).encode()).decode()))
+
+
 class PPAsHelper(PPAsPlugin):
     def is_ppa_installed(self, ppa: str):
         return ppa in self._get_existing_ppas()
@@ -27,6 +36,39 @@ def test_mock():
     setup.load_config_str(_MOCK_CONFIG)
 
 
+def test_ppas_are_added_in_one_step(tmpdir, monkeypatch):
+    apt_dir = tmpdir.mkdir('apt')
+    apt_dir.mkdir('sources.list.d').join('existing.list').write(
+        'deb http://ppa.launchpad.net/foo/bar/ubuntu bionic main\n')
+    monkeypatch.setattr(apt, 'APT_CONFIG_DIR', str(apt_dir))
+    monkeypatch.setattr(apt, 'distribution_codename', lambda: 'bionic')
+    monkeypatch.setattr(apt, 'supports_https', lambda: True)
+    monkeypatch.setattr(apt, '_index_invalidated_by', None)
+    monkeypatch.setattr(PPAsPlugin, '_fetch_signing_key', lambda self, ppa: _armored_key(ppa))
+    commands = []
+
+    def run_command_sudo(self, *command):
+        commands.append(command)
+        staged = {os.path.relpath(os.path.join(root, f), command[-2]): open(os.path.join(root, f), 'rb').read()
+                  for root, _, files in os.walk(command[-2]) for f in files}
+        assert staged['keyrings/holy-ubuntu-moly.gpg'] == b'key of holy/moly'
+        assert staged['keyrings/a-ubuntu-b.gpg'] == b'key of a/b'
+        assert b'URIs: https://ppa.launchpadcontent.net/holy/moly/ubuntu/\n' \
+            in staged['sources.list.d/holy-ubuntu-moly-bionic.sources']
+        assert b'Signed-By: ' + os.path.join(str(apt_dir), 'keyrings', 'holy-ubuntu-moly.gpg').encode() \
+            in staged['sources.list.d/holy-ubuntu-moly-bionic.sources']
+        assert len(staged) == 4
+
+    monkeypatch.setattr(PPAsPlugin, 'run_command_sudo', run_command_sudo)
+    plugin = PPAsPlugin(config=PPAsPlugin.coalesce([['foo/bar', 'holy/moly'], ['a/b', 'holy/moly']]),
+                        data_path=str(tmpdir))
+    assert plugin.pending() == ['add ppa:holy/moly', 'add ppa:a/b']
+    plugin.perform()
+    assert len(commands) == 1
+    assert commands[0][-1] == str(apt_dir)
+    assert apt._index_invalidated_by is plugin
+
+
 def test_real():
     setup = config.Setup()
     setup.load_plugins()
@@ -3,7 +3,10 @@
 import os
 import subprocess
 
+import pytest
+
 from src import config
+from src.builtin_plugins import SnapPackagesPlugin
 
 
 TESTS_PATH = os.path.abspath(os.path.join(os.path.basename(__file__), '..'))
@@ -37,6 +40,58 @@ def test_mock():
     setup.load_config_str(_MOCK_CONFIG)
 
 
+def test_only_unsatisfied_snaps_are_installed(fake_snapd, tmpdir, monkeypatch):
+    fake_snapd.snaps = [{'name': 'foo', 'tracking-channel': 'latest/stable'},
+                        {'name': 'bar', 'tracking-channel': 'latest/stable'}]
+    commands = []
+
+    def run_command_sudo(self, *command, **kwargs):
+        commands.append(command)
+        return fake_snapd.add_change(command[1], [command[-1]])
+
+    monkeypatch.setattr(SnapPackagesPlugin, 'run_command_sudo', run_command_sudo)
+    plugin = SnapPackagesPlugin(config=['foo', {'package': 'bar', 'channel': 'edge'}, 'baz'], data_path=str(tmpdir))
+    assert plugin.pending() == ['install bar', 'install baz']
+    plugin.perform()
+    assert fake_snapd.requests == [('POST', '/v2/snaps/baz', {'action': 'install'}),
+                                   ('POST', '/v2/snaps/bar', {'action': 'refresh', 'channel': 'edge'})]
+    assert commands == []
+
+    # Without root privileges, the snap command submits changes
+    fake_snapd.deny_changes = True
+    SnapPackagesPlugin(config=[{'package': 'qux', 'classic': True}], data_path=str(tmpdir)).perform()
+    assert commands == [('snap', 'install', '--no-wait', '--classic', 'qux')]
+
+
+def test_snaps_are_installed_together_without_root_privileges(fake_snapd, tmpdir, monkeypatch):
+    fake_snapd.deny_changes = True
+    commands = []
+
+    def run_command_sudo(self, *command, **kwargs):
+        commands.append(command)
+        return fake_snapd.add_change(command[1], command[3:])
+
+    monkeypatch.setattr(SnapPackagesPlugin, 'run_command_sudo', run_command_sudo)
+    SnapPackagesPlugin(config=['a', 'b'], data_path=str(tmpdir)).perform()
+    assert commands == [('snap', 'install', '--no-wait', 'a', 'b')]
+
+
+def test_snaps_without_options_are_installed_together(fake_snapd, tmpdir, capsys):
+    fake_snapd.snaps = [{'name': 'foo', 'tracking-channel': 'latest/stable'}]
+    config = ['a', 'foo', {'package': 'b'}, {'package': 'c', 'classic': True}, 'd']
+    SnapPackagesPlugin(config=config, data_path=str(tmpdir), verbose=True).perform()
+    assert fake_snapd.requests == [('POST', '/v2/snaps', {'action': 'install', 'snaps': ['a', 'b', 'd']}),
+                                   ('POST', '/v2/snaps/c', {'action': 'install', 'classic': True})]
+    assert capsys.readouterr().out.splitlines() == ['a: installed', 'b: installed', 'd: installed', 'c: installed']
+
+    fake_snapd.requests = []
+    fake_snapd.change_error = 'cannot install "e"'
+    with pytest.raises(Exception) as e:
+        SnapPackagesPlugin(config=['a', 'e', 'f'], data_path=str(tmpdir)).perform()
+    assert str(e.value).splitlines() == ['Could not install 2 of the snaps:', 'e: cannot install "e"',
+                                         'f: cannot install "e"']
+
+
 def test_real():
     setup = config.Setup(data_path=ASSETS_PATH)
     setup.load_plugins()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+import http.server
+import socketserver
+
+import pytest
+
+from src import probes
+from src import snapd
+
+
+class _FakeSnapd:
+    """
+    Stands in for snapd on a Unix socket. Changes complete on the second status request.
+    """
+
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+        # Installed snaps as reported by GET /v2/snaps
+        self.snaps = []
+        # Requests which modify snaps as (method, path, body)
+        self.requests = []
+        # Whether changes are refused like snapd does for other users than root
+        self.deny_changes = False
+        # Error of the changes submitted next
+        self.change_error = None
+        self.changes = {}
+        self._server = None
+
+    def __enter__(self):
+        fake = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def address_string(self):
+                return 'snapd'
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status: int, body: dict):
+                data = json.dumps(dict(body, **{'status-code': status})).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path == '/v2/snaps':
+                    self._reply(200, {'type': 'sync', 'result': fake.snaps})
+                elif self.path.startswith('/v2/changes/'):
+                    change = fake.changes[self.path.rsplit('/', 1)[1]]
+                    change['polls'] += 1
+                    ready = change['polls'] > 1
+                    self._reply(200, {'type': 'sync', 'result': {
+                        'id': change['id'], 'summary': change['summary'], 'ready': ready,
+                        'status': ('Error' if change['err'] else 'Done') if ready else 'Doing',
+                        'err': change['err'] if ready else None,
+                        'tasks': [{'progress': {'label': '', 'done': 1 if ready else 0, 'total': 1}}]}})
+                else:
+                    self._reply(404, {'type': 'error', 'result': {'message': 'not found'}})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode())
+                fake.requests.append(('POST', self.path, body))
+                if fake.deny_changes:
+                    self._reply(401, {'type': 'error', 'result': {'message': 'access denied',
+                                                                  'kind': 'login-required'}})
+                    return
+                names = body['snaps'] if self.path == '/v2/snaps' else [self.path.rsplit('/', 1)[1]]
+                self._reply(202, {'type': 'async', 'change': fake.add_change(self.path, names)})
+
+        self._server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def add_change(self, summary: str, names=()) -> str:
+        """
+        Start a change, which installs the given snaps unless change_error is set
+        :return: ID of the change
+        """
+        change_id = str(len(self.changes) + 1)
+        if self.change_error is None:
+            installed = {snap['name'] for snap in self.snaps}
+            self.snaps.extend({'name': name} for name in names if name not in installed)
+        self.changes[change_id] = {'id': change_id, 'summary': summary, 'polls': 0, 'err': self.change_error}
+        return change_id
+
+
+@pytest.fixture
+def fake_snapd(tmpdir, monkeypatch):
+    """
+    snapd stand-in, which the snapd client connects to by default
+    """
+    socket_path = str(tmpdir.join('snapd.socket'))
+    monkeypatch.setattr(snapd, 'SNAPD_SOCKET_PATH', socket_path)
+    monkeypatch.setattr(snapd, '_POLL_INTERVAL', 0.01)
+    with _FakeSnapd(socket_path) as fake:
+        yield fake
+
+
+@pytest.fixture
+def fake_flatpak(monkeypatch):
+    """
+    Makes the probes see a fixed set of installed Flatpak refs and remotes
+    """
+    outputs = {
+        ('flatpak', 'list', '--system', '--columns=ref'): 'org.gimp.GIMP/x86_64/stable\norg.foo.Foo/x86_64/master\n',
+        ('flatpak', 'list', '--user', '--columns=ref'): 'org.freedesktop.Platform/x86_64/23.08\n',
+        ('flatpak', 'remotes', '--system'): 'flathub\tsystem\n',
+        ('flatpak', 'remotes', '--user'): '',
+    }
+    monkeypatch.setattr(probes, '_capture', lambda *command: outputs.get(command))
+    probes.flatpak_inventory.invalidate()
+    yield
+    probes.flatpak_inventory.invalidate()
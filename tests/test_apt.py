@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import shutil
+import subprocess
+
+import pytest
+
+from src import apt
+from src import plugins
+
+
+_STATUS_PATH = os.path.join(os.path.dirname(__file__), 'assets', 'dpkg_status')
+
+
+def test_installed_packages():
+    installed = apt.installed_packages(_STATUS_PATH)
+    assert installed == {
+        'libc6': '2.35-0ubuntu3.1',
+        'libc6:amd64': '2.35-0ubuntu3.1',
+        'cowsay': '3.03+dfsg2-8',
+        'cowsay:all': '3.03+dfsg2-8',
+        'g++': '4:11.2.0-1ubuntu1',
+        'g++:amd64': '4:11.2.0-1ubuntu1',
+    }
+    assert apt.installed_packages(_STATUS_PATH) is installed
+
+
+def test_missing_packages():
+    packages = ['libc6', 'libc6:amd64', 'libc6:i386', 'cowsay=3.03+dfsg2-8', 'cowsay=3.03', 'vim', 'curl',
+                'cowsay/jammy', 'cowsay-', 'lib*', 'unknown', 'g++', 'g++:amd64', 'g++-', 'libstdc++6']
+    # Names ending with "+" are looked up before treating the "+" as an action modifier
+    assert apt.missing_packages(packages, _STATUS_PATH) == [
+        'libc6:i386', 'cowsay=3.03', 'vim', 'curl', 'cowsay/jammy', 'cowsay-', 'lib*', 'unknown', 'g++-',
+        'libstdc++6']
+
+
+def test_index_is_invalidated(tmpdir):
+    path = str(tmpdir.join('status'))
+    with open(path, 'w'):
+        pass
+    assert apt.missing_packages(['cowsay'], path) == ['cowsay']
+    shutil.copy(_STATUS_PATH, path)
+    assert apt.missing_packages(['cowsay'], path) == []
+
+
+class _Runner:
+    observer = None
+
+    def __init__(self):
+        self.commands = []
+
+    def run_command_sudo(self, *command, **kwargs):
+        self.commands.append(command)
+
+
+def test_index_is_updated_once(monkeypatch):
+    monkeypatch.setattr(apt, '_index_invalidated_by', None)
+    monkeypatch.setattr(apt, 'wait_for_lock', lambda: None)
+    monkeypatch.setattr(apt, 'lock_timeout', 60)
+    ppas, packages = _Runner(), _Runner()
+    apt.install(packages, ['foo'])
+    apt.invalidate_index(ppas)
+    apt.invalidate_index(ppas)
+    apt.install(packages, ['bar'])
+    apt.install(packages, ['baz'])
+    assert ppas.commands == []
+    assert [c[3:] for c in packages.commands] == [('-y', '-q', 'install', 'foo'), ('-q', 'update'),
+                                                  ('-y', '-q', 'install', 'bar'), ('-y', '-q', 'install', 'baz')]
+    assert packages.commands[0][:3] == ('apt-get', '-o', 'DPkg::Lock::Timeout=60')
+    apt.invalidate_index(ppas)
+    apt.update_index()
+    apt.update_index()
+    assert [c[3:] for c in ppas.commands] == [('-q', 'update')]
+
+
+def test_existing_ppas(tmpdir):
+    tmpdir.join('sources.list').write(
+        'deb http://archive.ubuntu.com/ubuntu bionic main\n'
+        'deb [arch=amd64] http://ppa.launchpad.net/alexlarsson/flatpak/ubuntu bionic main\n'
+        '# deb http://ppa.launchpad.net/commented/out/ubuntu bionic main\n'
+        'deb-src http://ppa.launchpad.net/source/only/ubuntu bionic main\n')
+    sources = tmpdir.mkdir('sources.list.d').join('foo.sources')
+    sources.write(
+        'Types: deb\n'
+        'URIs: https://ppa.launchpadcontent.net/foo/bar/ubuntu/\n'
+        'Suites: jammy\n'
+        '\n'
+        'Enabled: no\n'
+        'Types: deb\n'
+        'URIs: https://ppa.launchpadcontent.net/disabled/ppa/ubuntu/\n')
+    assert apt.existing_ppas(str(tmpdir)) == {'alexlarsson/flatpak', 'foo/bar'}
+    sources.write(apt.ppa_sources('holy/moly', 'jammy', '/etc/apt/keyrings/holy-ubuntu-moly.gpg'))
+    os.utime(str(sources), ns=(0, 0))
+    assert apt.existing_ppas(str(tmpdir)) == {'alexlarsson/flatpak', 'holy/moly'}
+    # apt without https support fetches PPAs via http
+    sources.write(apt.ppa_sources('holy/moly', 'xenial', '/etc/apt/keyrings/holy-ubuntu-moly.gpg', https=False))
+    os.utime(str(sources), ns=(1, 1))
+    assert apt.existing_ppas(str(tmpdir)) == {'alexlarsson/flatpak', 'holy/moly'}
+    assert 'URIs: http://ppa.launchpad.net/holy/moly/ubuntu/\n' in sources.read()
+
+
+def test_dearmor():
+    key = ('-----BEGIN PGP PUBLIC KEY BLOCK-----\n'
+           'Comment: Hostname: keyserver.ubuntu.com\n'
+           '\n'
+           'a2V5IG9m\n'
+           'IGhvbHkvbW9seQ==\n'
+           '=9Adf\n'
+           '-----END PGP PUBLIC KEY BLOCK-----\n')
+    assert apt.dearmor(key) == b'key of holy/moly'
+    with pytest.raises(Exception, match='Invalid OpenPGP key'):
+        apt.dearmor('<html>Not found</html>')
+
+
+def test_distribution_codename(tmpdir):
+    os_release = tmpdir.join('os-release')
+    os_release.write('NAME="Linux Mint"\nVERSION_CODENAME=vanessa\nUBUNTU_CODENAME=jammy\n')
+    assert apt.distribution_codename(str(os_release)) == 'jammy'
+    os_release.write('NAME="Ubuntu"\nVERSION_CODENAME=noble\n')
+    assert apt.distribution_codename(str(os_release)) == 'noble'
+
+
+def _hold_lock(path: str, seconds: float, linger: float = 0.0) -> subprocess.Popen:
+    # Take a lock the same way dpkg does (fcntl) in another process, which keeps running after releasing it
+    script = 'import fcntl, sys, time; f = open(sys.argv[1], "w"); fcntl.lockf(f, fcntl.LOCK_EX); ' \
+             'print(flush=True); time.sleep(float(sys.argv[2])); fcntl.lockf(f, fcntl.LOCK_UN); ' \
+             'time.sleep(float(sys.argv[3]))'
+    process = subprocess.Popen([sys.executable, '-c', script, path, str(seconds), str(linger)],
+                               stdout=subprocess.PIPE)
+    process.stdout.readline()
+    return process
+
+
+def test_wait_for_lock(tmpdir, monkeypatch, capsys):
+    lock_path = str(tmpdir.join('lock-frontend'))
+    monkeypatch.setattr(apt, 'LOCK_PATHS', (lock_path, str(tmpdir.join('missing'))))
+    assert apt.lock_holders() == []
+    holder = _hold_lock(lock_path, 0.5)
+    try:
+        assert apt.lock_holders() == [holder.pid]
+        with pytest.raises(Exception, match='pid {}'.format(holder.pid)):
+            apt.wait_for_lock(0.1)
+        start = time.monotonic()
+        apt.wait_for_lock(10)
+        assert time.monotonic() - start < 2
+        assert 'Waiting for python' in capsys.readouterr().out
+    finally:
+        holder.kill()
+        holder.wait()
+    assert apt.lock_holders() == []
+
+
+def test_wait_for_lock_without_pidfds(tmpdir, monkeypatch):
+    # pidfd_open() requires Python 3.9, before that the lock files themselves are waited for
+    monkeypatch.delattr(os, 'pidfd_open', raising=False)
+    lock_path = str(tmpdir.join('lock-frontend'))
+    monkeypatch.setattr(apt, 'LOCK_PATHS', (lock_path, str(tmpdir.join('missing'))))
+    holder = _hold_lock(lock_path, 0.5, linger=30)
+    try:
+        with pytest.raises(Exception, match='pid {}'.format(holder.pid)):
+            apt.wait_for_lock(0.1)
+        start = time.monotonic()
+        apt.wait_for_lock(10)
+        # Released locks are noticed right away, while their holder keeps running
+        assert time.monotonic() - start < 0.8
+        assert holder.poll() is None
+    finally:
+        holder.kill()
+        holder.wait()
+
+
+class _ProgressObserver(plugins.CommandObserver):
+    def __init__(self):
+        self.reports = []
+
+    def progress(self, phase, fraction, rate=None, eta=None):
+        self.reports.append((phase, fraction, rate is not None, eta is not None))
+
+
+class _AptPlugin(plugins.AbstractPlugin):
+    key = 'apt'
+
+    def run_command_sudo(self, command, *args, **kwargs):
+        return self.run_command(command, *args, **kwargs)
+
+    def perform(self):
+        pass
+
+
+def test_install_progress(tmpdir, monkeypatch):
+    # Stands in for apt-get, writing status records to the file descriptor given by APT::Status-Fd
+    tmpdir.join('apt-get').write(
+        '#!/bin/sh\n'
+        'echo "Need to get 1,024 kB/2.5 MB of archives."\n'
+        'echo "dlstatus:1:0:Retrieving file 1 of 2" >&3\n'
+        'sleep 0.1\n'
+        'echo "dlstatus:2:50:Retrieving file 2 of 2" >&3\n'
+        'echo "pmstatus:foo:25:Unpacking foo" >&3\n'
+        'sleep 0.1\n'
+        'echo "pmstatus:foo:100:Installed foo" >&3\n'
+        'echo "$@"\n')
+    tmpdir.join('apt-get').chmod(0o755)
+    monkeypatch.setenv('PATH', str(tmpdir), prepend=os.pathsep)
+    monkeypatch.setattr(apt, '_index_invalidated_by', None)
+    monkeypatch.setattr(apt, 'wait_for_lock', lambda: None)
+    observer = _ProgressObserver()
+    plugin = _AptPlugin(data_path=str(tmpdir), log_path=str(tmpdir.join('apt.log')), observer=observer)
+    apt.install(plugin, ['foo'])
+    assert observer.reports == [('Downloading', 0.0, False, False), ('Downloading', 0.5, True, True),
+                                ('Installing', 0.25, False, False), ('Installing', 1.0, False, True)]
+    assert 'APT::Status-Fd=3' in tmpdir.join('apt.log').read()
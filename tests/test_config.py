@@ -1,6 +1,19 @@
 # -*- coding: utf-8 -*-
 
+import os
+import time
+
+import pytest
+import schema
+
+from src import apt
 from src import config
+from src import loader
+from src import plan_cache
+from src import plugins
+from src import run_log
+from src import state
+from src import validation
 
 
 _MINIMALISTIC_CONFIG = '''
@@ -45,3 +58,425 @@ def test_load_advanced_config():
     setup = config.Setup()
     setup.load_plugins()
     setup.load_config_str(_ADVANCED_CONFIG)
+
+
+_INVALID_CONFIG = '''
+category:
+  $apt-packages: foo
+  nested:
+    $snap-packages:
+      - package: bar
+        classic: maybe
+$unknown-plugin: []
+'''
+
+
+def test_load_invalid_config():
+    for round_trip in (False, True):
+        setup = config.Setup(round_trip=round_trip)
+        setup.load_plugins()
+        with pytest.raises(validation.ValidationError) as e:
+            setup.load_config_str(_INVALID_CONFIG)
+        # All issues are reported at once, in source order
+        assert [issue.line for issue in e.value.issues] == [3, 7, 8]
+        assert e.value.issues[2].message == "unknown plugin key 'unknown-plugin'"
+
+
+def test_loaders_produce_same_plan():
+    bodies = []
+    for round_trip in (False, True):
+        setup = config.Setup(round_trip=round_trip)
+        setup.load_plugins()
+        setup.load_config_str(_SIMPLE_CONFIG)
+        action = setup._root.children[0].children[0].children[0]
+        assert type(action.body) is list
+        bodies.append(action.body)
+    assert bodies[0] == bodies[1]
+
+
+def test_loaders_keep_the_order_of_keys(monkeypatch):
+    # Plain dicts only keep their order since Python 3.7
+    monkeypatch.setattr(loader, 'DICTS_ARE_ORDERED', False)
+    keys = ['key{}'.format(i) for i in reversed(range(50))]
+    content = ''.join('{}: {{value: {}}}\n'.format(key, i) for i, key in enumerate(keys))
+    data = loader.load(content)
+    assert list(data) == keys
+    data, positions = loader.load_with_positions(content)
+    assert list(data) == keys
+    assert [positions.line_of(data, key, 0) for key in keys] == list(range(1, 51))
+    assert all(data[key] == {'value': i} for i, key in enumerate(keys))
+    assert list(config._plain(data)) == keys
+
+
+def test_compiled_schema_matches_schema_library():
+    plugin_schema = [
+        str,
+        {
+            'package': str,
+            schema.Optional('channel'): str,
+            schema.Optional('classic'): bool,
+            schema.Optional('type'): schema.Or('bundle', 'ref'),
+        },
+    ]
+    values = (
+        ['foo', {'package': 'bar'}],
+        [{'package': 'bar', 'channel': 'edge', 'classic': True, 'type': 'ref'}],
+        [{'package': 'bar', 'type': 'app'}],
+        [{'channel': 'edge'}],
+        [{'package': 'bar', 'extra': 1}],
+        [42],
+        'foo',
+    )
+    validator = validation.compile_schema(plugin_schema)
+    for value in values:
+        expected = schema.Schema(plugin_schema).is_valid(value)
+        assert validator(value, (), None, validation._Context(), False) == expected
+
+
+def _isolate(tmpdir, monkeypatch):
+    # Keep plans and state of the tests away from the user's home directory
+    monkeypatch.setattr(plan_cache, 'PLAN_CACHE_DIR', str(tmpdir.join('plans')))
+    monkeypatch.setattr(state, 'STATE_CONFIG_DIR', str(tmpdir.join('config')))
+    monkeypatch.setattr(state, 'STATE_CONFIG_PATH', str(tmpdir.join('config', 'state.yaml')))
+    monkeypatch.setattr(run_log, 'RUN_LOG_DIR', str(tmpdir.join('runs')))
+    monkeypatch.delenv(state.NAMESPACE_ENV, raising=False)
+
+
+def test_plan_cache(tmpdir, monkeypatch):
+    _isolate(tmpdir, monkeypatch)
+    setup_file = tmpdir.join('setup.yaml')
+    setup_file.write(_SIMPLE_CONFIG)
+
+    setup = config.Setup()
+    setup.load_plugins()
+    setup.load_config_file(str(setup_file))
+    assert len(tmpdir.join('plans').listdir()) == 1
+
+    # Cached plans are used without parsing the configuration again
+    monkeypatch.setattr(loader.yaml, 'YAML', None)
+    cached_setup = config.Setup()
+    cached_setup.load_plugins()
+    cached_setup.load_config_file(str(setup_file))
+    action = cached_setup._root.children[0].children[0].children[0]
+    assert (action.name, action.body) == ('apt-packages', ['foo', 'bar'])
+
+    # Changing the configuration invalidates the cached plan
+    monkeypatch.undo()
+    _isolate(tmpdir, monkeypatch)
+    setup_file.write(_MINIMALISTIC_CONFIG)
+    changed_setup = config.Setup()
+    changed_setup.load_plugins()
+    changed_setup.load_config_file(str(setup_file))
+    assert changed_setup._root.children[0].body == ['holy', 'moly']
+    assert len(tmpdir.join('plans').listdir()) == 2
+
+
+def test_plan_cache_is_invalidated_by_compiler_changes(monkeypatch):
+    key = plan_cache.PlanCache([]).key(b'config')
+    validation_path = os.path.join(os.path.dirname(os.path.abspath(plan_cache.__file__)), 'validation.py')
+    monkeypatch.setitem(plan_cache._source_digests, validation_path, 'changed')
+    assert plan_cache.PlanCache([]).key(b'config') != key
+
+
+class _RecordPlugin(plugins.AbstractPlugin):
+    key = 'record'
+    schema = str
+    performed = []
+
+    def perform(self):
+        self.performed.append(self.config)
+
+
+def test_include(tmpdir, monkeypatch):
+    _isolate(tmpdir, monkeypatch)
+    tmpdir.join('setup.yaml').write('''
+$record: first
+apps:
+  $include: apps/*.yaml
+tail:
+  $record: last
+''')
+    tmpdir.mkdir('apps')
+    tmpdir.join('apps', 'a.yaml').write('$record: a\n$include: ../common.yaml\n')
+    tmpdir.join('apps', 'b.yaml').write('b:\n  $record: b\n')
+    tmpdir.join('common.yaml').write('$record: common\n')
+
+    setup = config.Setup()
+    setup._set_plugins([_RecordPlugin])
+    setup.load_config_file(str(tmpdir.join('setup.yaml')))
+    # Included files are loaded when performing, but before any action is performed
+    assert setup._included_plans == {}
+    tmpdir.join('apps', 'c.yaml').write('$unknown: c\n')
+    _RecordPlugin.performed = []
+    with pytest.raises(validation.ValidationError):
+        setup.perform()
+    assert _RecordPlugin.performed == []
+    tmpdir.join('apps', 'c.yaml').remove()
+    setup.perform()
+    assert _RecordPlugin.performed == ['first', 'a', 'common', 'b', 'last']
+
+
+def test_missing_includes_are_rejected(tmpdir, monkeypatch):
+    _isolate(tmpdir, monkeypatch)
+    # Files created by earlier actions can't be included by the same setup
+    for include in ('dotfiles/setup.yaml', 'dotfiles/*.yaml'):
+        tmpdir.join('setup.yaml').write('$record: clone\ndotfiles:\n  $include: {}\n'.format(include))
+        setup = config.Setup()
+        setup._set_plugins([_RecordPlugin])
+        setup.load_config_file(str(tmpdir.join('setup.yaml')), use_cache=False)
+        _RecordPlugin.performed = []
+        with pytest.raises(config.SetupError, match='loaded before performing'):
+            setup.perform()
+        assert _RecordPlugin.performed == []
+
+
+def test_recursive_include(tmpdir, monkeypatch):
+    _isolate(tmpdir, monkeypatch)
+    tmpdir.join('setup.yaml').write('$include: setup.yaml\n')
+    setup = config.Setup()
+    setup._set_plugins([_RecordPlugin])
+    setup.load_config_file(str(tmpdir.join('setup.yaml')), use_cache=False)
+    with pytest.raises(config.SetupError):
+        setup.perform()
+
+
+class _SleepPlugin(plugins.AbstractPlugin):
+    key = 'sleep'
+    schema = str
+    events = []
+
+    def perform(self):
+        if self.config == 'fail':
+            raise RuntimeError('failed')
+        self.events.append(('start', self.config))
+        time.sleep(0.2)
+        self.events.append(('end', self.config))
+
+
+_PARALLEL_CONFIG = '''
+downloads:
+  $parallel: true
+  a:
+    $sleep: a
+  b:
+    $sleep: b
+  c:
+    $depends-on: a
+    $sleep: c
+after:
+  $sleep: after
+'''
+
+
+def test_parallel_categories(tmpdir, monkeypatch):
+    _isolate(tmpdir, monkeypatch)
+    setup = config.Setup()
+    setup._set_plugins([_SleepPlugin])
+    setup.load_config_str(_PARALLEL_CONFIG)
+    _SleepPlugin.events = []
+    start = time.monotonic()
+    setup.perform(jobs=4)
+    assert time.monotonic() - start < 0.7
+    events = _SleepPlugin.events
+    # a and b run concurrently, c waits for a, everything else waits for the parallel category
+    assert events[:2] in ([('start', 'a'), ('start', 'b')], [('start', 'b'), ('start', 'a')])
+    assert events.index(('start', 'c')) > events.index(('end', 'a'))
+    assert events[-2:] == [('start', 'after'), ('end', 'after')]
+
+
+def test_sequential_by_default(tmpdir, monkeypatch):
+    _isolate(tmpdir, monkeypatch)
+    setup = config.Setup()
+    setup._set_plugins([_SleepPlugin])
+    setup.load_config_str(_PARALLEL_CONFIG.replace('$parallel: true', '$parallel: false'))
+    _SleepPlugin.events = []
+    setup.perform(jobs=4)
+    assert [e for e in _SleepPlugin.events if e[0] == 'start'] == \
+        [('start', 'a'), ('start', 'b'), ('start', 'c'), ('start', 'after')]
+
+
+def test_parallel_error(tmpdir, monkeypatch):
+    _isolate(tmpdir, monkeypatch)
+    setup = config.Setup()
+    setup._set_plugins([_SleepPlugin])
+    setup.load_config_str(_PARALLEL_CONFIG.replace('$sleep: b', '$sleep: fail'))
+    _SleepPlugin.events = []
+    with pytest.raises(RuntimeError):
+        setup.perform(jobs=4)
+    # Running actions complete, but no further actions are started
+    assert ('end', 'a') in _SleepPlugin.events
+    assert ('start', 'after') not in _SleepPlugin.events
+
+
+class _BatchPlugin(plugins.AbstractPlugin):
+    key = 'batch'
+    schema = [str]
+    coalescible = True
+    performed = []
+
+    @classmethod
+    def coalesce(cls, configs):
+        return [item for c in configs for item in c]
+
+    def perform(self):
+        self.performed.append(self.config)
+
+
+class _NoBarrierPlugin(_RecordPlugin):
+    key = 'no-barrier'
+    barrier = False
+
+
+def test_coalesce_actions(tmpdir, monkeypatch):
+    _isolate(tmpdir, monkeypatch)
+    setup = config.Setup()
+    setup._set_plugins([_BatchPlugin, _RecordPlugin, _NoBarrierPlugin])
+    tmpdir.join('setup.yaml').write('''
+$batch: [a, b]
+first:
+  $no-barrier: x
+  $batch: [c]
+second:
+  $record: barrier
+  $batch: [d]
+  third:
+    $batch: [e]
+''')
+    setup.load_config_file(str(tmpdir.join('setup.yaml')))
+    _BatchPlugin.performed = []
+    _RecordPlugin.performed = []
+    setup.perform()
+    # Actions are merged across non-barriers, but not across barriers
+    assert _BatchPlugin.performed == [['a', 'b', 'c'], ['d', 'e']]
+    assert _RecordPlugin.performed == ['x', 'barrier']
+    assert setup.coalesced_steps_count == 2
+
+    # Each merged action is marked as performed
+    setup.perform()
+    assert setup.skipped_steps_count == 6
+    assert setup.coalesced_steps_count == 0
+
+
+class _SourcesPlugin(_BatchPlugin):
+    # Coalescible barrier like $ppas, whose effects later batch actions depend on
+    key = 'sources'
+
+
+def test_coalescible_barriers_close_other_batches(tmpdir, monkeypatch):
+    _isolate(tmpdir, monkeypatch)
+    setup = config.Setup()
+    setup._set_plugins([_BatchPlugin, _SourcesPlugin])
+    tmpdir.join('setup.yaml').write('''
+base:
+  $batch: [a]
+repos:
+  $sources: [x/y]
+apps:
+  $batch: [from-x]
+more-repos:
+  $sources: [z/w]
+''')
+    setup.load_config_file(str(tmpdir.join('setup.yaml')))
+    _BatchPlugin.performed = []
+    setup.perform()
+    assert _BatchPlugin.performed == [['a'], ['x/y'], ['from-x'], ['z/w']]
+
+
+class _ChangeSourcesPlugin(plugins.AbstractPlugin):
+    key = 'change-sources'
+    schema = str
+
+    def perform(self):
+        apt.invalidate_index(self)
+
+
+def test_index_is_updated_before_barriers(tmpdir, monkeypatch):
+    _isolate(tmpdir, monkeypatch)
+    monkeypatch.setattr(apt, '_index_invalidated_by', None)
+    monkeypatch.setattr(apt, '_apt_get', lambda plugin, *args: _RecordPlugin.performed.append(' '.join(args)))
+    setup = config.Setup()
+    setup._set_plugins([_ChangeSourcesPlugin, _RecordPlugin, _NoBarrierPlugin])
+    tmpdir.join('setup.yaml').write('''
+$change-sources: x
+$no-barrier: a
+install:
+  $record: b
+more:
+  $record: c
+''')
+    setup.load_config_file(str(tmpdir.join('setup.yaml')))
+    _RecordPlugin.performed = []
+    setup.perform()
+    assert _RecordPlugin.performed == ['a', '-q update', 'b', 'c']
+
+
+def test_index_update_is_a_step_of_its_own(tmpdir, monkeypatch):
+    _isolate(tmpdir, monkeypatch)
+    monkeypatch.setattr(apt, '_index_invalidated_by', None)
+    updaters = []
+    monkeypatch.setattr(apt, '_apt_get', lambda plugin, *args: updaters.append(plugin))
+    setup = config.Setup()
+    setup._set_plugins([_ChangeSourcesPlugin])
+    tmpdir.join('setup.yaml').write('sources:\n  $change-sources: x\n')
+    setup.load_config_file(str(tmpdir.join('setup.yaml')))
+    setup.perform()
+    # The update after the last action doesn't reuse the log and progress of that action
+    updater, = updaters
+    assert os.path.basename(updater.log_path) == '0002-update-package-index.log'
+    assert updater.observer.label == 'update-package-index'
+    assert [m.label for m in setup.metrics._actions] == ['sources/change-sources', 'update-package-index']
+    assert not apt.index_outdated()
+
+
+class _FilePlugin(plugins.AbstractPlugin):
+    key = 'file'
+    schema = str
+    performed = []
+
+    def perform(self):
+        self.performed.append(self.config)
+        open(self.config, 'w').close()
+
+    def pending(self):
+        return [] if os.path.exists(self.config) else ['create ' + self.config]
+
+
+def test_verify(tmpdir, monkeypatch):
+    _isolate(tmpdir, monkeypatch)
+    a, b = str(tmpdir.join('a')), str(tmpdir.join('b'))
+    tmpdir.join('setup.yaml').write('$file: {}\nb:\n  $file: {}\n$record: c\n'.format(a, b))
+    setup = config.Setup()
+    setup._set_plugins([_FilePlugin, _RecordPlugin])
+    setup.load_config_file(str(tmpdir.join('setup.yaml')))
+    _FilePlugin.performed = []
+    setup.perform()
+    assert _FilePlugin.performed == [a, b]
+
+    # Only drifted actions are performed again, actions without probes are trusted
+    os.remove(b)
+    _FilePlugin.performed = []
+    _RecordPlugin.performed = []
+    assert [p.status for p in setup.plan(verify=True)] == \
+        [config.PlannedAction.DONE, config.PlannedAction.PENDING, config.PlannedAction.DONE]
+    setup.perform(verify=True)
+    assert _FilePlugin.performed == [b]
+    assert _RecordPlugin.performed == []
+    assert setup.drifted_steps_count == 1
+    setup.perform(verify=True)
+    assert _FilePlugin.performed == [b]
+    assert setup.drifted_steps_count == 0
+
+
+def test_state_namespace_of_copied_configs(tmpdir, monkeypatch):
+    _isolate(tmpdir, monkeypatch)
+    # Remote setups copy the configuration to a new directory each time
+    monkeypatch.setenv(state.NAMESPACE_ENV, 'remote:host:/home/user/setup/setup.yaml')
+    for copy in ('copy1', 'copy2'):
+        tmpdir.join(copy, 'setup.yaml').write('$record: a\n', ensure=True)
+        setup = config.Setup()
+        setup._set_plugins([_RecordPlugin])
+        setup.load_config_file(str(tmpdir.join(copy, 'setup.yaml')))
+        _RecordPlugin.performed = []
+        setup.perform()
+        setup._state.close()
+        assert _RecordPlugin.performed == (['a'] if copy == 'copy1' else [])
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+import http.server
+import socketserver
+
+import pytest
+import requests
+
+from src import plugins
+from src import download_cache
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    # http.server.ThreadingHTTPServer requires Python 3.7
+    daemon_threads = True
+
+
+class _Server:
+    """
+    Serves files from a dict and answers revalidations via ETag
+    """
+
+    def __init__(self):
+        self.files = {}
+        # Requests as (path, status)
+        self.requests = []
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                data = server.files.get(self.path)
+                if data is None:
+                    status = 404
+                elif self.headers.get('If-None-Match') == '"{}"'.format(hash(data)):
+                    status = 304
+                else:
+                    status = 200
+                server.requests.append((self.path, status))
+                self.send_response(status)
+                if data is not None:
+                    self.send_header('ETag', '"{}"'.format(hash(data)))
+                body = data if status == 200 else b''
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._httpd = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self._httpd.serve_forever, args=(0.05,), daemon=True).start()
+
+    def url(self, path: str) -> str:
+        return 'http://127.0.0.1:{}{}'.format(self._httpd.server_address[1], path)
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+class _DownloadObserver(plugins.CommandObserver):
+    def __init__(self):
+        self.bytes = 0
+
+    def downloaded(self, size):
+        self.bytes += size
+
+
+@pytest.fixture
+def server():
+    server = _Server()
+    yield server
+    server.close()
+
+
+def test_cached_downloads_need_no_requests(server, tmpdir):
+    server.files['/a'] = b'a' * 1000
+    cache = download_cache.DownloadCache(str(tmpdir.join('cache')))
+    observer = _DownloadObserver()
+    target = str(tmpdir.join('a'))
+    cache.download(server.url('/a'), target, observer)
+    cache.download(server.url('/a'), target, observer)
+    assert open(target, 'rb').read() == b'a' * 1000
+    assert server.requests == [('/a', 200)]
+    assert observer.bytes == 1000
+    # Identical content at another URL is stored once
+    server.files['/b'] = b'a' * 1000
+    assert cache.fetch(server.url('/b')) == cache.fetch(server.url('/a'))
+    assert len(os.listdir(str(tmpdir.join('cache', 'objects')))) == 1
+
+
+def test_revalidation(server, tmpdir):
+    server.files['/a'] = b'old'
+    cache = download_cache.DownloadCache(str(tmpdir.join('cache')), max_age=0)
+    assert open(cache.fetch(server.url('/a')), 'rb').read() == b'old'
+    assert open(cache.fetch(server.url('/a')), 'rb').read() == b'old'
+    server.files['/a'] = b'new'
+    assert open(cache.fetch(server.url('/a')), 'rb').read() == b'new'
+    assert server.requests == [('/a', 200), ('/a', 304), ('/a', 200)]
+
+
+def test_modified_files_are_downloaded_again(server, tmpdir):
+    server.files['/a'] = b'content'
+    cache = download_cache.DownloadCache(str(tmpdir.join('cache')))
+    target = str(tmpdir.join('a'))
+    cache.download(server.url('/a'), target)
+    with open(cache.fetch(server.url('/a')), 'ab') as file:
+        file.write(b' changed')
+    cache.download(server.url('/a'), target)
+    assert open(target, 'rb').read() == b'content'
+    assert server.requests == [('/a', 200), ('/a', 200)]
+
+
+def test_least_recently_used_files_are_removed(server, tmpdir):
+    for name in 'abc':
+        server.files['/' + name] = name.encode() * 100
+    cache = download_cache.DownloadCache(str(tmpdir.join('cache')), max_size=250)
+    cache.fetch(server.url('/a'))
+    path = cache.fetch(server.url('/b'))
+    # Make b the least recently used file
+    os.utime(path, ns=(1, os.stat(path).st_mtime_ns))
+    cache.fetch(server.url('/c'))
+    assert len(os.listdir(str(tmpdir.join('cache', 'objects')))) == 2
+    cache.fetch(server.url('/a'))
+    cache.fetch(server.url('/b'))
+    assert server.requests == [('/a', 200), ('/b', 200), ('/c', 200), ('/b', 200)]
+
+
+def test_errors(server, tmpdir):
+    cache = download_cache.DownloadCache(str(tmpdir.join('cache')))
+    with pytest.raises(requests.HTTPError):
+        cache.fetch(server.url('/missing'))
+    assert not tmpdir.join('cache', 'objects').check()
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from src import config
+from src import plugins
+from src import run_log
+
+
+class _CommandPlugin(plugins.AbstractPlugin):
+    key = 'command'
+    schema = str
+
+    def perform(self):
+        self.run_command('sh', '-c', self.config)
+        self.observer.downloaded(1000)
+        self.observer.progress('Working', 1.0)
+
+
+def test_metrics(tmpdir, monkeypatch, capsys):
+    monkeypatch.setattr(run_log, 'RUN_LOG_DIR', str(tmpdir.join('runs')))
+    setup = config.Setup()
+    setup._set_plugins([_CommandPlugin])
+    setup.load_config_str('''
+a:
+  $command: i=0; while [ $i -lt 20000 ]; do i=$((i+1)); done
+b:
+  $command: sleep 0.2
+''')
+    setup.perform()
+
+    a, b = setup.metrics.actions
+    assert (a.label, a.plugin, a.commands, a.bytes_downloaded) == ('a/command', 'command', 1, 1000)
+    assert a.child_user_time + a.child_system_time > 0
+    assert a.child_max_rss > 0
+    assert b.wall_time >= 0.2
+    assert b.child_user_time + b.child_system_time < b.wall_time
+
+    setup.metrics.write_json(str(tmpdir.join('metrics.json')))
+    data = json.loads(tmpdir.join('metrics.json').read())
+    assert [action['action'] for action in data['actions']] == ['a/command', 'b/command']
+    assert list(data['actions'][0]['phases']) == ['Working']
+
+    setup.metrics.print_summary()
+    assert 'b/command' in capsys.readouterr().out
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+import time
+import asyncio
+import concurrent.futures
+import subprocess
+
+import pytest
+
+from src import plugins
+from src import run_log
+
+
+class _CommandPlugin(plugins.AbstractPlugin):
+    key = 'command'
+    schema = str
+
+    def perform(self):
+        pass
+
+
+def test_command_output_is_logged(tmpdir):
+    log = run_log.RunLog(str(tmpdir))
+    plugin = _CommandPlugin(data_path=str(tmpdir), log_path=log.log_path('a/command'))
+    assert plugin.run_command('echo', 'hello', capture=False) is None
+    assert plugin.run_command('echo', 'world') == 'world\n'
+    with open(plugin.log_path) as file:
+        assert file.read() == '$ echo hello\nhello\n$ echo world\nworld\n'
+
+
+def test_command_failure_keeps_tail(tmpdir, capsys):
+    plugin = _CommandPlugin(data_path=str(tmpdir), log_path=str(tmpdir.join('command.log')))
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        plugin.run_command('sh', '-c', 'seq 1000; exit 3')
+    assert e.value.returncode == 3
+    assert e.value.output.splitlines() == [str(i) for i in range(1001 - plugins.OUTPUT_TAIL_LINES, 1001)]
+    out = capsys.readouterr().out
+    assert '\n1\n' not in out
+    assert str(tmpdir.join('command.log')) in out
+    assert len(tmpdir.join('command.log').readlines()) == 1001
+
+
+def test_old_runs_are_pruned(tmpdir):
+    for i in range(5):
+        tmpdir.mkdir('20000101-00000{}-1'.format(i))
+    log = run_log.RunLog(str(tmpdir), max_runs=3)
+    plugin = _CommandPlugin(data_path=str(tmpdir), log_path=log.log_path('a'))
+    assert not log.exists
+    plugin.run_command('true')
+    assert log.exists
+    assert len(tmpdir.listdir()) == 3
+    assert tmpdir.join('20000101-000004-1').check()
+    assert not tmpdir.join('20000101-000002-1').check()
+
+
+def test_async_commands_run_concurrently(tmpdir):
+    plugin = _CommandPlugin(data_path=str(tmpdir), log_path=str(tmpdir.join('command.log')))
+
+    async def run():
+        return await asyncio.gather(
+            plugin.run_command_async('sh', '-c', 'sleep 0.3; echo a'),
+            plugin.run_command_async('sh', '-c', 'sleep 0.3; echo b'),
+            plugin.run_command_async('sleep', '0.3'),
+        )
+
+    start = time.monotonic()
+    assert plugin.run_async(run()) == ['a\n', 'b\n', '']
+    assert time.monotonic() - start < 0.8
+    assert tmpdir.join('command.log').read().count('$ ') == 3
+
+
+def test_async_commands_run_on_worker_threads(tmpdir):
+    # Actions are performed on worker threads, which have no event loop of their own
+    plugin = _CommandPlugin(data_path=str(tmpdir))
+    with concurrent.futures.ThreadPoolExecutor(1) as pool:
+        future = pool.submit(plugin.run_async, plugin.run_command_async('echo', 'a'))
+        assert future.result(5) == 'a\n'
+
+
+def test_async_command_timeout(tmpdir):
+    plugin = _CommandPlugin(data_path=str(tmpdir))
+    start = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        plugin.run_async(plugin.run_command_async('sh', '-c', 'echo started; sleep 10', timeout=0.2))
+    assert time.monotonic() - start < 5
+    with pytest.raises(subprocess.CalledProcessError):
+        plugin.run_async(plugin.run_command_async('false'))
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+from src import progress
+
+import io
+import time
+
+
+def test_plain_output():
+    stream = io.StringIO()
+    with progress.ProgressRenderer(stream, tty=False) as renderer:
+        a = renderer.start('a')
+        b = renderer.start('b', indent_level=1)
+        renderer.finish(b)
+        renderer.finish(a, success=False)
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 4
+    assert '▶ a' in lines[0]
+    assert lines[1].startswith('  ') and '▶ b' in lines[1]
+    assert '✔ b' in lines[2]
+    assert '❌ a' in lines[3]
+
+
+def test_interactive_output():
+    stream = io.StringIO()
+    with progress.ProgressRenderer(stream, interval=0.01, tty=True) as renderer:
+        a = renderer.start('a')
+        b = renderer.start('b')
+        renderer.update(b, 'Downloading', 0.5, rate=2.5e6, eta=3)
+        time.sleep(0.05)
+        assert renderer.running == ['a', 'b']
+        renderer.write('partial ')
+        renderer.write('line\n')
+        renderer.finish(a)
+        time.sleep(0.05)
+        renderer.finish(b)
+        assert renderer.running == []
+    output = stream.getvalue()
+    # Running actions are redrawn below completed output
+    assert output.index('partial line\n') < output.rindex('b')
+    assert '✔ a' in output and '✔ b' in output
+    assert 'b Downloading 50%, 2.5 MB/s, 3 s left' in output
+    # Running actions are erased once they are complete
+    assert output.endswith(progress.termcol.success('✔ b') + '\n')
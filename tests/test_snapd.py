@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from src import plugins
+from src import snapd
+
+
+class _ProgressObserver(plugins.CommandObserver):
+    def __init__(self):
+        self.reports = []
+
+    def progress(self, phase, fraction, rate=None, eta=None):
+        self.reports.append((phase, fraction))
+
+
+def test_snaps(fake_snapd):
+    fake_snapd.snaps = [{'name': 'core', 'tracking-channel': 'latest/stable'}, {'name': 'hello-world'}]
+    with snapd.Client() as client:
+        assert sorted(client.snaps()) == ['core', 'hello-world']
+        # The connection is reused
+        connection = client._connection
+        client.snaps()
+        assert client._connection is connection
+
+
+def test_install(fake_snapd):
+    observer = _ProgressObserver()
+    with snapd.Client() as client:
+        change_id = client.install('foo', channel='beta', classic=True)
+        assert client.wait(change_id, observer)['status'] == 'Done'
+    assert fake_snapd.requests == [('POST', '/v2/snaps/foo', {'action': 'install', 'channel': 'beta', 'classic': True})]
+    assert observer.reports == [('/v2/snaps/foo', 0.0)]
+
+
+def test_errors(fake_snapd, tmpdir):
+    fake_snapd.change_error = 'cannot install "foo"'
+    with snapd.Client() as client:
+        change_id = client.install('foo')
+        with pytest.raises(snapd.SnapdError, match='cannot install "foo"'):
+            client.wait(change_id)
+        fake_snapd.deny_changes = True
+        with pytest.raises(snapd.SnapdError) as e:
+            client.refresh('foo')
+        assert e.value.access_denied and e.value.kind == 'login-required'
+    with pytest.raises(snapd.SnapdError, match='Could not connect'):
+        snapd.Client(str(tmpdir.join('missing.socket'))).snaps()
+
+
+def test_is_satisfied():
+    snap = {'name': 'foo', 'tracking-channel': 'latest/stable', 'devmode': False}
+    assert snapd.is_satisfied(snap)
+    assert snapd.is_satisfied(snap, channel='stable')
+    assert snapd.is_satisfied(snap, channel='latest')
+    assert not snapd.is_satisfied(snap, channel='edge')
+    assert not snapd.is_satisfied(snap, devmode=True)
+    assert snapd.is_satisfied({'name': 'foo', 'tracking-channel': '18/beta'}, channel='18/beta')
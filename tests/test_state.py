@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+
+from src import state
+from src import tree
+
+
+def _isolate(tmpdir, monkeypatch):
+    monkeypatch.setattr(state, 'STATE_CONFIG_DIR', str(tmpdir))
+    monkeypatch.setattr(state, 'STATE_CONFIG_PATH', str(tmpdir.join('state.yaml')))
+
+
+def test_namespaces(tmpdir, monkeypatch):
+    _isolate(tmpdir, monkeypatch)
+    s = state.ConfigState('/a/setup.yaml')
+    assert not s.exists
+    a = tree.Action('apt-packages', ['foo'])
+    b = tree.Action('folders', ['~/a', '~/b'])
+    s.mark_done(a)
+    s.mark_done(b, auto_save=False)
+    assert s.is_done(a) and s.is_done(b)
+    s.close()
+
+    s = state.ConfigState('/a/setup.yaml')
+    assert s.exists
+    s.load()
+    assert s.is_done(a) and s.is_done(b)
+    # Actions are identified by their content, list order is significant
+    assert s.is_done(tree.Action('folders', ['~/a', '~/b']))
+    assert not s.is_done(tree.Action('folders', ['~/b', '~/a']))
+
+    other = state.ConfigState('/b/setup.yaml')
+    other.load()
+    assert not other.is_done(a)
+
+
+def test_legacy_migration(tmpdir, monkeypatch):
+    _isolate(tmpdir, monkeypatch)
+    # Legacy state files store all scalars as strings
+    tmpdir.join('state.yaml').write('''
+- name: apt-packages
+  body:
+  - foo
+- name: custom
+  body:
+    enabled: 'true'
+    count: '3'
+    ratio: '0.5'
+    empty: ''
+''')
+    journaled = tree.Action('snap-packages', ['bar'])
+    # The journal ends with a record torn by a crash
+    tmpdir.join(state.STATE_JOURNAL_NAME).write(state.action_hash(journaled) + '\n' + '0123')
+    s = state.ConfigState('/a/setup.yaml')
+    assert s.exists
+    s.load()
+    assert s.is_done(tree.Action('apt-packages', ['foo']))
+    assert s.is_done(tree.Action('custom', {'count': 3, 'empty': None, 'enabled': True, 'ratio': 0.5}))
+    assert not s.is_done(tree.Action('custom', {'count': 4, 'empty': None, 'enabled': True, 'ratio': 0.5}))
+    assert s.is_done(journaled)
+
+    # Legacy actions count as performed for all configurations
+    other = state.ConfigState('/b/setup.yaml')
+    other.load()
+    assert other.is_done(journaled)
+
+
+def test_history(tmpdir, monkeypatch):
+    _isolate(tmpdir, monkeypatch)
+    s = state.ConfigState('/a/setup.yaml')
+    a = tree.Action('apt-packages', ['foo'])
+    b = tree.Action('apt-packages', ['bar'])
+    now = time.time()
+    s.record_run(a, 'a/apt-packages', now - 10 * 86400, 5.0)
+    s.record_run(a, 'a/apt-packages', now - 3600, 2.0)
+    s.record_run(a, 'a/apt-packages', now - 60, 1.0, error='CalledProcessError: failed')
+    s.record_run(b, 'b/apt-packages', now - 8 * 86400, 3.0)
+    assert state.ConfigState('/b/setup.yaml').last_successful_run(a) is None
+
+    # Other processes can read the history while it's written to
+    reader = state.ConfigState('/a/setup.yaml')
+    run = reader.last_successful_run(a)
+    assert (run.path, run.duration, run.success, run.version) == ('a/apt-packages', 2.0, True, 'dev')
+    stale = reader.stale_runs(7)
+    assert [(r.path, r.duration) for r in stale] == [('b/apt-packages', 3.0)]
+    assert reader.stale_runs(30) == []
+
+
+def test_history_is_pruned(tmpdir, monkeypatch):
+    _isolate(tmpdir, monkeypatch)
+    monkeypatch.setattr(state, '_MAX_RUNS_PER_ACTION', 3)
+    s = state.ConfigState('/a/setup.yaml')
+    a = tree.Action('apt-packages', ['foo'])
+    b = tree.Action('apt-packages', ['bar'])
+    now = time.time()
+    s.record_run(a, 'a/apt-packages', now - 100, 5.0)
+    for i in range(10):
+        s.record_run(a, 'a/apt-packages', now - 50 + i, 1.0, error='CalledProcessError: failed')
+    s.record_run(b, 'b/apt-packages', now, 3.0)
+    state.ConfigState('/b/setup.yaml').record_run(a, 'a/apt-packages', now, 1.0)
+    runs = s._connection().execute('SELECT namespace, path, started FROM runs ORDER BY id').fetchall()
+    # The latest successful run is kept along with the latest runs
+    assert runs == [('/a/setup.yaml', 'a/apt-packages', now - 100)] + \
+        [('/a/setup.yaml', 'a/apt-packages', now - 50 + i) for i in range(7, 10)] + \
+        [('/a/setup.yaml', 'b/apt-packages', now), ('/b/setup.yaml', 'a/apt-packages', now)]
+    assert s.last_successful_run(a).duration == 5.0
+
+
+def test_concurrent_writers(tmpdir, monkeypatch):
+    _isolate(tmpdir, monkeypatch)
+    writers = [state.ConfigState('/a/setup.yaml') for _ in range(2)]
+    for writer in writers:
+        writer._connection()
+    # A writer waits until the transaction of the other one is committed
+    with writers[0]._transaction() as db:
+        thread = threading.Thread(target=writers[1].mark_done, args=(tree.Action('apt-packages', ['foo']),))
+        thread.start()
+        thread.join(0.2)
+        assert thread.is_alive()
+        db.execute('INSERT INTO done (namespace, digest) VALUES (?, ?)', ('/a/setup.yaml', 'a'))
+    thread.join()
+    reader = state.ConfigState('/a/setup.yaml')
+    reader.load()
+    assert len(reader._done) == 2
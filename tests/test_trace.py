@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from src import config
+from src import plugins
+from src import run_log
+from src import trace
+
+
+class _CommandPlugin(plugins.AbstractPlugin):
+    key = 'command'
+    schema = str
+
+    def perform(self):
+        self.run_command('sh', '-c', self.config)
+
+
+def test_trace(tmpdir, monkeypatch):
+    monkeypatch.setattr(run_log, 'RUN_LOG_DIR', str(tmpdir.join('runs')))
+    tracer = trace.Tracer()
+    setup = config.Setup(tracer=tracer)
+    setup._set_plugins([_CommandPlugin])
+    setup.load_config_str('''
+downloads:
+  $parallel: true
+  a:
+    $command: sleep 0.1
+  b:
+    $command: exit 0
+tail:
+  $command: "true"
+''')
+    setup.perform(jobs=2)
+    tracer.write(str(tmpdir.join('trace.json')))
+
+    events = json.loads(tmpdir.join('trace.json').read())['traceEvents']
+    actions = [e for e in events if e.get('cat') == 'action']
+    assert sorted(e['name'] for e in actions) == ['downloads/a/command', 'downloads/b/command', 'tail/command']
+    commands = [e for e in events if e.get('cat') == 'command']
+    assert sorted(e['args']['command'] for e in commands) == ['sh -c exit 0', 'sh -c sleep 0.1', 'sh -c true']
+    assert all(e['args']['exit_code'] == 0 for e in commands)
+    # Commands are nested in their actions
+    for command in commands:
+        end = command['ts'] + command['dur']
+        action, = [e for e in actions
+                   if e['tid'] == command['tid'] and e['ts'] <= command['ts'] <= end <= e['ts'] + e['dur']]
+    categories = {e['name'] for e in events if e.get('cat') == 'category'}
+    assert categories == {'downloads', 'downloads/a', 'downloads/b', 'tail'}
+    assert {e['name'] for e in events if e.get('cat') == 'config'} == {'validate'}
+
+
+def test_null_tracer():
+    with trace.NullTracer().span('name', 'category', foo=1) as args:
+        args['bar'] = 2